@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for Nodular. See ``benchmarks/README.rst`` for usage.
+"""
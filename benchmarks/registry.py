@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for registry construction at worker startup. Usage::
+
+    python -m benchmarks.registry --types 50 --views 5 --routes 10
+
+Defines ``views`` view classes with ``routes`` routes each, registers all
+of them for each of ``types`` node types and times each step. ``register_eager``
+recompiles the URL map after every registration, as Nodular did before
+:meth:`~nodular.registry.NodeRegistry.freeze` was introduced, for comparison.
+``load_snapshot`` loads the frozen registry from a JSON snapshot instead.
+Results are written as JSON in the same format as ``benchmarks.tree``.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import sys
+import json
+import argparse
+import platform
+from datetime import datetime
+from collections import OrderedDict
+from timeit import default_timer
+
+import werkzeug
+from nodular import Node, NodeRegistry, NodeView, __version__
+
+
+def make_views(count, routes):
+    views = []
+    for i in range(count):
+        attrs = {'__module__': __name__}
+        for j in range(routes):
+            def handler(self, **kwargs):
+                return 'ok'
+            handler.__name__ = str('route%d' % j)
+            if j % 2:
+                rule = '/view%d/route%d/<int:item>' % (i, j)
+            else:
+                rule = '/view%d/route%d' % (i, j)
+            attrs[handler.__name__] = NodeView.route(rule, methods=['GET', 'POST'])(handler)
+        views.append(type(str('BenchView%d' % i), (NodeView,), attrs))
+    return views
+
+
+def register(views, types, eager=False):
+    registry = NodeRegistry()
+    for t in range(types):
+        itype = 'type%d' % t
+        registry.register_node(Node, itype=itype)
+        for view in views:
+            registry.register_view(itype, view)
+            if eager:
+                registry.urlmaps[itype].update()
+    return registry
+
+
+def timed(results, name, func, repeat):
+    times = []
+    retval = None
+    for i in range(repeat):
+        start = default_timer()
+        retval = func()
+        times.append(default_timer() - start)
+    times.sort()
+    results[name] = OrderedDict([
+        ('runs', repeat),
+        ('min', times[0]),
+        ('median', times[len(times) // 2]),
+        ('mean', sum(times) / len(times)),
+        ('max', times[-1]),
+        ('queries', 0),
+        ])
+    return retval
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Nodular registry construction.")
+    parser.add_argument('--types', type=int, default=50, help="Node types (default: 50)")
+    parser.add_argument('--views', type=int, default=5, help="Views per node type (default: 5)")
+    parser.add_argument('--routes', type=int, default=10, help="Routes per view (default: 10)")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per benchmark (default: 5)")
+    parser.add_argument('--output', '-o', help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = OrderedDict()
+    views = timed(results, 'define_views', lambda: make_views(args.views, args.routes), args.repeat)
+    timed(results, 'register_eager', lambda: register(views, args.types, eager=True), args.repeat)
+    timed(results, 'register', lambda: register(views, args.types), args.repeat)
+
+    def register_freeze():
+        registry = register(views, args.types)
+        registry.freeze()
+        return registry
+    registry = timed(results, 'register_freeze', register_freeze, args.repeat)
+    snapshot = json.dumps(registry.snapshot())
+    timed(results, 'load_snapshot', lambda: NodeRegistry.from_snapshot(json.loads(snapshot)), args.repeat)
+
+    report = OrderedDict([
+        ('meta', OrderedDict([
+            ('nodular', __version__),
+            ('python', platform.python_version()),
+            ('werkzeug', werkzeug.__version__),
+            ('types', args.types),
+            ('views', args.views),
+            ('routes', args.routes),
+            ('rules', sum(len(list(m.iter_rules())) for m in registry.urlmaps.values())),
+            ('snapshot_bytes', len(snapshot)),
+            ('repeat', args.repeat),
+            ('timestamp', datetime.utcnow().isoformat() + 'Z'),
+            ])),
+        ('results', results),
+        ])
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    for name, result in results.items():
+        print("%-20s median %10.6fs  min %10.6fs" % (name, result['median'], result['min']), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
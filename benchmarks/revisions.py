@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for delta-compressed revision storage. Usage::
+
+    python -m benchmarks.revisions --revisions 200 --lines 500
+    python -m benchmarks.revisions --intervals 1 10 50 --db postgresql://localhost/nodular_bench
+
+For each full-copy interval, makes a document with ``revisions`` revisions of
+a ``lines`` line text, each changing a few random lines, and reports the
+storage used by the revisioned column, the time taken to save revisions and
+the time to load a random revision into an empty session. An interval of 1
+stores every revision in full, as revisions without delta storage do.
+
+The database is dropped and recreated, as with ``benchmarks.tree``. Results
+are written as JSON in the same format.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import sys
+import json
+import random
+import argparse
+import platform
+from datetime import datetime
+from collections import OrderedDict
+from timeit import default_timer
+
+import sqlalchemy
+from nodular import db, Node, RevisionedNodeMixin, querycount, __version__
+from .tree import make_app
+
+
+class BenchDeltaDocument(RevisionedNodeMixin, Node):
+    __tablename__ = 'bench_delta_document'
+
+
+class BenchDeltaDocumentRevision(BenchDeltaDocument.RevisionMixin, db.Model):
+    __delta_columns__ = ('content',)
+    content = db.Column(db.UnicodeText, nullable=False, default='')
+
+
+def summarize(runs):
+    times = sorted(r[0] for r in runs)
+    queries = sorted(r[1] for r in runs)
+    return OrderedDict([
+        ('runs', len(runs)),
+        ('min', times[0]),
+        ('median', times[len(times) // 2]),
+        ('mean', sum(times) / len(times)),
+        ('max', times[-1]),
+        ('queries', queries[len(queries) // 2]),
+        ])
+
+
+def run(root_id, interval, args, rng):
+    BenchDeltaDocumentRevision.__delta_interval__ = interval
+    doc = BenchDeltaDocument(name='doc%d' % interval, title='Interval %d' % interval,
+        parent=Node.query.get(root_id))
+    db.session.add(doc)
+    lines = ['Line %d: %s\n' % (i, ' '.join('word%d' % rng.randrange(1000) for w in range(10)))
+        for i in range(args.lines)]
+    ids = []
+    writes = []
+    revision = None
+    for counter in range(args.revisions):
+        for change in range(args.changes):
+            lines[rng.randrange(len(lines))] = 'Changed in revision %d\n' % counter
+        start = default_timer()
+        startcount = querycount()
+        revision = doc.revise(revision)
+        revision.content = ''.join(lines)
+        db.session.commit()
+        writes.append((default_timer() - start, querycount() - startcount))
+        ids.append(revision.id)
+
+    table = BenchDeltaDocumentRevision.__table__
+    storage = db.session.execute(sqlalchemy.select([sqlalchemy.func.sum(sqlalchemy.func.length(
+        table.c.content))]).where(table.c.node_id == doc.id)).scalar()
+
+    reads = []
+    for i in range(args.repeat):
+        revid = rng.choice(ids)
+        db.session.expunge_all()
+        start = default_timer()
+        startcount = querycount()
+        BenchDeltaDocumentRevision.query.get(revid).content
+        reads.append((default_timer() - start, querycount() - startcount))
+    db.session.expunge_all()
+    return OrderedDict([
+        ('storage', storage),
+        ('write', summarize(writes)),
+        ('read', summarize(reads)),
+        ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark delta-compressed revision storage.")
+    parser.add_argument('--db', default='sqlite://',
+        help="Database URI (default: in-memory SQLite). The database will be dropped and recreated")
+    parser.add_argument('--revisions', type=int, default=200, help="Revisions per document (default: 200)")
+    parser.add_argument('--lines', type=int, default=500, help="Lines of text per revision (default: 500)")
+    parser.add_argument('--changes', type=int, default=3, help="Lines changed per revision (default: 3)")
+    parser.add_argument('--intervals', type=int, nargs='+', default=[1, 5, 20, 50],
+        help="Full-copy intervals to compare (default: 1 5 20 50)")
+    parser.add_argument('--repeat', type=int, default=20, help="Revisions to read per interval (default: 20)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument('--output', '-o', help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    app = make_app(args.db)
+    results = OrderedDict()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        root = Node(name='root', title='Root')
+        db.session.add(root)
+        db.session.commit()
+        root_id = root.id
+        for interval in args.intervals:
+            results['interval_%d' % interval] = run(root_id, interval, args, random.Random(args.seed))
+        report = OrderedDict([
+            ('meta', OrderedDict([
+                ('nodular', __version__),
+                ('python', platform.python_version()),
+                ('sqlalchemy', sqlalchemy.__version__),
+                ('dialect', db.engine.dialect.name),
+                ('revisions', args.revisions),
+                ('lines', args.lines),
+                ('changes', args.changes),
+                ('repeat', args.repeat),
+                ('seed', args.seed),
+                ('timestamp', datetime.utcnow().isoformat() + 'Z'),
+                ])),
+            ('results', results),
+            ])
+        db.session.rollback()
+        db.drop_all()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    for name, result in results.items():
+        print("%-14s storage %10d  write median %9.6fs  read median %9.6fs  queries %d" % (
+            name, result['storage'], result['write']['median'], result['read']['median'],
+            result['read']['queries']), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
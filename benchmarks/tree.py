@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for tree operations on synthetic node trees. Usage::
+
+    python -m benchmarks.tree --width 10 --depth 3
+    python -m benchmarks.tree --width 10 --depth 6 --output results.json \\
+        --db postgresql://localhost/nodular_bench
+
+The tree has a single root with ``width`` children per node, ``depth`` levels
+deep, for a total of ``1 + width + width ** 2 + ... + width ** depth`` nodes.
+The database is dropped and recreated at the start of each run, so always
+point ``--db`` at a dedicated database.
+
+Results are written as JSON. Each benchmark reports the number of runs and
+the min, median, mean and max time in seconds, along with the median number
+of SQL statements per run.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import sys
+import json
+import uuid
+import random
+import argparse
+import platform
+from datetime import datetime
+from contextlib import contextmanager
+from collections import OrderedDict
+from timeit import default_timer
+
+import sqlalchemy
+from flask import Flask
+from coaster.utils import buid
+from coaster.sqlalchemy import BaseMixin
+
+from nodular import (db, Node, RevisionedNodeMixin, NodeRegistry, NodePublisher, NodeView,
+    querycount, set_sqlite_profile, SQLITE_PROFILES, __version__)
+
+BENCHMARKS = ['traverse', 'publish', 'getprop', 'proxydict', 'rename', 'move', 'delete',
+    'delete_subtree', 'revise', 'export', 'import']
+
+INSERT_CHUNK = 10000
+
+
+class User(BaseMixin, db.Model):
+    __tablename__ = 'user'
+    userid = db.Column(db.Unicode(22), nullable=False, default=buid, unique=True)
+    username = db.Column(db.Unicode(250), nullable=True)
+
+
+class BenchDocument(RevisionedNodeMixin, Node):
+    __tablename__ = 'bench_document'
+
+
+class BenchDocumentRevision(BenchDocument.RevisionMixin, db.Model):
+    content = db.Column(db.UnicodeText, nullable=False, default='')
+
+    def copy(self):
+        revision = super(BenchDocumentRevision, self).copy()
+        revision.content = self.content
+        return revision
+
+
+class BenchView(NodeView):
+    @NodeView.route('/')
+    def index(self):
+        return 'index'
+
+    @NodeView.route('/edit')
+    def edit(self):
+        return 'edit'
+
+
+def make_app(uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    db.app = app
+    return app
+
+
+class Tree(object):
+    """
+    Synthetic node tree, inserted with bulk statements rather than through
+    the ORM so that trees with millions of nodes can be built quickly.
+    """
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        #: List of levels, each a list of (id, path) tuples
+        self.levels = []
+
+    @property
+    def size(self):
+        return sum(len(level) for level in self.levels)
+
+    def build(self):
+        now = datetime.utcnow()
+        counter = [0]
+
+        def row(nodeid, parent_id, root_id, name, path, depth):
+            counter[0] += 1
+            return {
+                'id': nodeid,
+                'parent_id': parent_id,
+                'root_id': root_id,
+                'name': name,
+                'title': name,
+                'path': path,
+                'depth': depth,
+                'type': Node.__type__,
+                'properties': {},
+                'created_at': now,
+                'updated_at': now,
+                }
+
+        self.root_id = uuid.uuid4()
+        rootrow = row(self.root_id, None, self.root_id, 'root', '/', 0)
+        rootrow['properties'] = {'theme': 'default'}
+        db.session.execute(Node.__table__.insert(), [rootrow])
+        self.levels = [[(self.root_id, '/')]]
+
+        for level in range(self.depth):
+            parents = self.levels[-1]
+            current = []
+            rows = []
+            for parent_id, parent_path in parents:
+                for i in range(self.width):
+                    # Names are unique across the tree so that nodes can be
+                    # imported into a single container
+                    name = 'n%d' % counter[0]
+                    path = (parent_path if parent_path != '/' else '') + '/' + name
+                    nodeid = uuid.uuid4()
+                    rows.append(row(nodeid, parent_id, self.root_id, name, path, level + 1))
+                    current.append((nodeid, path))
+                    if len(rows) >= INSERT_CHUNK:
+                        db.session.execute(Node.__table__.insert(), rows)
+                        rows = []
+            if rows:
+                db.session.execute(Node.__table__.insert(), rows)
+            self.levels.append(current)
+        db.session.commit()
+
+
+class Runner(object):
+    """Run benchmarks and collect measurements."""
+    def __init__(self, tree, repeat, seed, subtree_level, revisions):
+        self.tree = tree
+        self.repeat = repeat
+        self.random = random.Random(seed)
+        self.subtree_level = min(max(subtree_level, 1), tree.depth)
+        self.revisions = revisions
+        self.measurements = OrderedDict()
+
+        self.registry = NodeRegistry()
+        self.registry.register_node(Node, view=BenchView, child_nodetypes=['*'])
+        self.registry.register_node(BenchDocument, view=BenchView, parent_nodetypes=['*'])
+        self.publisher = NodePublisher(tree.root_id, self.registry, '/')
+
+    @contextmanager
+    def measure(self, name):
+        startcount = querycount()
+        start = default_timer()
+        yield
+        duration = default_timer() - start
+        self.measurements.setdefault(name, []).append((duration, querycount() - startcount))
+
+    def results(self):
+        results = OrderedDict()
+        for name, runs in self.measurements.items():
+            times = sorted(r[0] for r in runs)
+            queries = sorted(r[1] for r in runs)
+            results[name] = OrderedDict([
+                ('runs', len(runs)),
+                ('min', times[0]),
+                ('median', times[len(times) // 2]),
+                ('mean', sum(times) / len(times)),
+                ('max', times[-1]),
+                ('queries', queries[len(queries) // 2]),
+                ])
+        return results
+
+    def sample(self, level):
+        return self.random.choice(self.tree.levels[level])
+
+    def leafpaths(self):
+        return [self.sample(-1)[1] for i in range(self.repeat)]
+
+    def fresh(self):
+        """Start each run with an empty identity map."""
+        db.session.rollback()
+        db.session.expunge_all()
+
+    def bench_traverse(self):
+        for path in self.leafpaths():
+            self.fresh()
+            with self.measure('traverse'):
+                self.publisher.traverse(path)
+
+    def bench_publish(self):
+        for path in self.leafpaths():
+            self.fresh()
+            with db.app.test_request_context():
+                with self.measure('publish'):
+                    self.publisher.publish(path + '/edit')
+
+    def bench_getprop(self):
+        for path in self.leafpaths():
+            self.fresh()
+            node = Node.query.filter_by(_root_id=self.tree.root_id, path=path).one()
+            with self.measure('getprop'):
+                node.getprop('theme')
+
+    def bench_proxydict(self):
+        level = max(self.tree.depth - 1, 0)
+        for i in range(self.repeat):
+            self.fresh()
+            nodeid, path = self.sample(level)
+            node = Node.query.get(nodeid)
+            with self.measure('proxydict.keys'):
+                keys = node.nodes.keys()
+            name = self.random.choice(keys)
+            with self.measure('proxydict.getitem'):
+                node.nodes[name]
+            with self.measure('proxydict.contains'):
+                name in node.nodes
+            with self.measure('proxydict.len'):
+                len(node.nodes)
+            with self.measure('proxydict.setitem'):
+                # Assigning a parentless node autoflushes it mid-assignment
+                # with its interim root path unless autoflush is disabled
+                with db.session.no_autoflush:
+                    node.nodes['new'] = Node(title='New')
+            with self.measure('proxydict.delitem'):
+                del node.nodes[name]
+                db.session.flush()
+
+    def bench_rename(self):
+        for i in range(self.repeat):
+            self.fresh()
+            node = Node.query.get(self.sample(self.subtree_level)[0])
+            with self.measure('rename'):
+                node.name = 'renamed'
+                db.session.flush()
+
+    def bench_move(self):
+        for i in range(self.repeat):
+            self.fresh()
+            nodeid, path = self.sample(self.subtree_level)
+            targetid = nodeid
+            while targetid == nodeid:
+                # Another node on the same level is never a descendant
+                targetid = self.sample(self.subtree_level)[0]
+            node = Node.query.get(nodeid)
+            target = Node.query.get(targetid)
+            with self.measure('move'):
+                node.parent = target
+                db.session.flush()
+
+    def bench_delete(self):
+        for i in range(self.repeat):
+            self.fresh()
+            node = Node.query.get(self.sample(self.subtree_level)[0])
+            with self.measure('delete'):
+                db.session.delete(node)
+                db.session.flush()
+
+    def bench_delete_subtree(self):
+        for i in range(self.repeat):
+            self.fresh()
+            node = Node.query.get(self.sample(self.subtree_level)[0])
+            with self.measure('delete_subtree'):
+                node.delete_subtree()
+                db.session.flush()
+
+    def bench_revise(self):
+        self.fresh()
+        root = Node.query.get(self.tree.root_id)
+        document = BenchDocument(name='benchdoc', title='Benchmark Document', parent=root)
+        db.session.add(document)
+        revision = document.revise(workflow_label='draft')
+        revision.content = 'Revision 0'
+        db.session.flush()
+        for i in range(self.revisions):
+            with self.measure('revise'):
+                revision = document.revise(revision, workflow_label='draft')
+                revision.content = 'Revision %d' % (i + 1)
+                db.session.flush()
+
+    def _subtree(self):
+        nodeid, path = self.sample(self.subtree_level)
+        return Node.query.filter(Node._root_id == self.tree.root_id,
+            Node.path.like(path + '/%')).all()
+
+    def bench_export(self):
+        for i in range(self.repeat):
+            self.fresh()
+            nodes = self._subtree()
+            with self.measure('export'):
+                [node.as_dict() for node in nodes]
+
+    def bench_import(self):
+        for i in range(self.repeat):
+            self.fresh()
+            # as_dict does not export properties, which import_from requires
+            data = [dict(node.as_dict(), properties=node.properties) for node in self._subtree()]
+            root = Node.query.get(self.tree.root_id)
+            container = Node(name='imported', title='Imported', parent=root)
+            with self.measure('import'):
+                for item in data:
+                    node = Node(name=item['name'], title=item['title'], parent=container)
+                    item['buid'] = buid()
+                    node.import_from(item)
+                db.session.flush()
+
+    def run(self, benchmarks):
+        for name in benchmarks:
+            getattr(self, 'bench_' + name)()
+            self.fresh()
+        return self.results()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Nodular tree operations.")
+    parser.add_argument('--db', default='sqlite://',
+        help="Database URI (default: in-memory SQLite). The database will be dropped and recreated")
+    parser.add_argument('--width', type=int, default=10, help="Children per node (default: 10)")
+    parser.add_argument('--depth', type=int, default=3, help="Levels below the root (default: 3)")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per benchmark (default: 5)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for sampling nodes (default: 0)")
+    parser.add_argument('--subtree-level', type=int, default=1,
+        help="Tree level of nodes that are renamed, moved, deleted and exported (default: 1)")
+    parser.add_argument('--revisions', type=int, default=100, help="Revisions to create (default: 100)")
+    parser.add_argument('--only', action='append', choices=BENCHMARKS,
+        help="Run only this benchmark (may be repeated)")
+    parser.add_argument('--sqlite-profile', choices=sorted(SQLITE_PROFILES), default='default',
+        help="Pragma profile for SQLite connections (default: default)")
+    parser.add_argument('--output', '-o', help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    set_sqlite_profile(args.sqlite_profile)
+    app = make_app(args.db)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        tree = Tree(args.width, args.depth)
+        start = default_timer()
+        tree.build()
+        buildtime = default_timer() - start
+        print("Built tree of %d nodes in %.2fs" % (tree.size, buildtime), file=sys.stderr)
+
+        runner = Runner(tree, args.repeat, args.seed, args.subtree_level, args.revisions)
+        results = runner.run(args.only or BENCHMARKS)
+
+        report = OrderedDict([
+            ('meta', OrderedDict([
+                ('nodular', __version__),
+                ('python', platform.python_version()),
+                ('sqlalchemy', sqlalchemy.__version__),
+                ('dialect', db.engine.dialect.name),
+                ('sqlite_profile', args.sqlite_profile if db.engine.dialect.name == 'sqlite' else None),
+                ('width', args.width),
+                ('depth', args.depth),
+                ('nodes', tree.size),
+                ('repeat', args.repeat),
+                ('seed', args.seed),
+                ('subtree_level', runner.subtree_level),
+                ('buildtime', buildtime),
+                ('timestamp', datetime.utcnow().isoformat() + 'Z'),
+                ])),
+            ('results', results),
+            ])
+        db.session.rollback()
+        db.drop_all()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    for name, result in results.items():
+        print("%-20s median %10.6fs  min %10.6fs  queries %d" % (
+            name, result['median'], result['min'], result['queries']), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
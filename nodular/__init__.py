@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import
+import sys
 
 from ._version import *    # NOQA
 from .db import *          # NOQA
 from .node import *        # NOQA
+from .closure import *     # NOQA
 from .revisioned import *  # NOQA
+from .retention import *   # NOQA
 from .registry import *    # NOQA
 from .publisher import *   # NOQA
 from .view import *        # NOQA
+from .instrument import *  # NOQA
 from .exceptions import *  # NOQA
+
+if sys.version_info >= (3, 5):
+    from .aiopublisher import *  # NOQA
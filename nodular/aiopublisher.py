@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asynchronous publishing, for Python 3.5 and above. :class:`AsyncNodePublisher`
+awaits view functions defined with ``async def`` and runs regular view
+functions in a thread pool, so slow views do not hold up the event loop::
+
+    publisher = AsyncNodePublisher(root, registry, '/')
+
+    class MyNodeView(NodeView):
+        @NodeView.route('/')
+        async def index(self):
+            data = await fetch_from_service(self.node.name)
+            return render_template('node.html', data=data)
+
+SQLAlchemy does not support asyncio in the versions Nodular works with, so
+traversal, which is a single query, runs in the event loop's thread.
+
+Each call to :meth:`~AsyncNodePublisher.publish_async` keeps the request
+context it was made in and uses a database session of its own, so that
+several requests can be in flight on one event loop. Regular view functions
+run in the executor with the same request context and session, and can use
+``self.node`` and ``db.session`` together as in a synchronous view. The
+session is closed when the call completes or, for streaming responses, when
+the response is closed.
+"""
+
+import asyncio
+from inspect import iscoroutinefunction, isgenerator
+from flask import g, Response, _app_ctx_stack, _request_ctx_stack
+from .db import db, _set_session_scope
+from .publisher import NodePublisher, NodeDispatcher
+
+__all__ = ['AsyncNodePublisher']
+
+
+def _is_async(f):
+    """Check if a view function, or the function it wraps, is a coroutine function"""
+    while f is not None:
+        if iscoroutinefunction(f):
+            return True
+        f = getattr(f, '__wrapped__', None)
+    return False
+
+
+class _RequestScope(object):
+    """
+    The request context and database session of a request, captured where
+    the scope is made and entered with ``with``, in any thread. Internal
+    class used by :class:`AsyncNodePublisher`.
+
+    :param bool new_session: Use a new database session instead of the
+        current one. It is closed with :meth:`close`.
+    """
+    def __init__(self, new_session=False):
+        self.app_ctx = _app_ctx_stack.top
+        self.request_ctx = _request_ctx_stack.top
+        if self.request_ctx is None:
+            raise RuntimeError("Asynchronous publishing requires a request context")
+        self.new_session = new_session
+        self.key = object() if new_session else db.session.registry.scopefunc()
+        self._previous = []
+
+    def __enter__(self):
+        _app_ctx_stack.push(self.app_ctx)
+        _request_ctx_stack.push(self.request_ctx)
+        self._previous.append(_set_session_scope(self.key))
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _set_session_scope(self._previous.pop())
+        _request_ctx_stack.pop()
+        _app_ctx_stack.pop()
+
+    def close(self):
+        """Close the scope's own database session, if it has one."""
+        if self.new_session:
+            previous = _set_session_scope(self.key)
+            try:
+                db.session.remove()
+            finally:
+                _set_session_scope(previous)
+
+
+def _scoped_generator(scope, generator):
+    """Run each step of a generator with a request scope entered."""
+    try:
+        while True:
+            with scope:
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        with scope:
+            generator.close()
+
+
+class _ScopedCoroutine(object):
+    """
+    Awaitable that runs a coroutine with a request scope entered at every
+    step, so that other coroutines on the same thread do not see it. The
+    scope is closed when the coroutine completes or, if it returns a
+    streaming response, when the response is closed.
+    """
+    def __init__(self, scope, coro):
+        self.scope = scope
+        self.coro = coro
+
+    def __await__(self):
+        coro = self.coro
+        send, value = coro.send, None
+        streaming = False
+        try:
+            while True:
+                try:
+                    with self.scope:
+                        yielded = send(value)
+                except StopIteration as e:
+                    result = e.value
+                    if isinstance(result, Response) and result.is_streamed:
+                        result.call_on_close(self.scope.close)
+                        streaming = True
+                    return result
+                try:
+                    value = yield yielded
+                    send = coro.send
+                except GeneratorExit:
+                    coro.close()
+                    raise
+                except BaseException as e:
+                    # Exceptions thrown in by the event loop, such as cancellation
+                    send, value = coro.throw, e
+        finally:
+            if not streaming:
+                self.scope.close()
+
+
+class AsyncNodeDispatcher(NodeDispatcher):
+    """
+    Dispatch a view asynchronously. Internal class used by
+    :meth:`AsyncNodePublisher.publish_async`.
+
+    :param executor: Executor to run regular view functions in. Defaults to
+        the event loop's default executor.
+    :param scope: Request context and database session to run regular view
+        functions with. Defaults to those current when the view is dispatched.
+    """
+    def __init__(self, registry, node, user, permissions, instrument=None, executor=None, scope=None):
+        super(AsyncNodeDispatcher, self).__init__(registry, node, user, permissions, instrument)
+        self.executor = executor
+        self.scope = scope
+
+    def _response(self, result):
+        """Stream generators with the request scope entered at every step."""
+        if isgenerator(result):
+            result = _scoped_generator(self.scope, result)
+        return super(AsyncNodeDispatcher, self)._response(result)
+
+    async def dispatch(self, endpoint, args):
+        if self.scope is None:
+            self.scope = _RequestScope()
+        scope = self.scope
+        view, f = self._resolve(endpoint)
+        with self.instrument.stage('view'):
+            if _is_async(f):
+                # Decorators like NodeView.requires_permission run here and
+                # return the coroutine
+                return self._response(await f(view, **args))
+
+            def call():
+                with scope:
+                    g.view = view
+                    return f(view, **args)
+            return self._response(await asyncio.get_event_loop().run_in_executor(self.executor, call))
+
+
+class AsyncNodePublisher(NodePublisher):
+    """
+    NodePublisher with an asynchronous :meth:`publish_async` method. Takes the
+    same parameters as :class:`~nodular.publisher.NodePublisher`, and:
+
+    :param executor: Executor to run regular view functions in (optional).
+        Defaults to the event loop's default executor.
+    :type executor: :class:`concurrent.futures.Executor`
+    """
+    def __init__(self, root, registry, basepath, urlpath=None, instrument=None, executor=None):
+        super(AsyncNodePublisher, self).__init__(root, registry, basepath, urlpath, instrument)
+        self.executor = executor
+
+    def publish_async(self, path, user=None, permissions=None):
+        """
+        Publish a path using views from the registry, awaiting coroutine view
+        functions and running others in the executor. Parameters and return
+        value are the same as for :meth:`~nodular.publisher.NodePublisher.publish`.
+        Must be called with a request context, which is used until the
+        returned awaitable completes, even if other requests are handled on
+        the same thread in the meantime.
+        """
+        scope = _RequestScope(new_session=True)
+        return _ScopedCoroutine(scope, self._publish_async(scope, path, user, permissions))
+
+    async def _publish_async(self, scope, path, user, permissions):
+        response, node, endpoint, args = self._match(path)
+        if response is not None:
+            return response
+        return await AsyncNodeDispatcher(self.registry, node, user, permissions, self.instrument,
+            self.executor, scope).dispatch(endpoint, args)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+An optional closure table for nodes, with a row for every pair of a node
+and one of its ancestors (including the node itself, at depth 0). It answers
+"descendants of", "descendants at depth k", "ancestors of" and "is A under
+B" with indexed lookups, at the cost of a row per ancestor per node.
+
+The table is created along with your other tables but is only filled in once
+maintenance is turned on at startup::
+
+    from nodular import NodeClosure
+    NodeClosure.maintain()
+
+and, for a database that already has nodes, rebuilt once::
+
+    NodeClosure.rebuild()
+    db.session.commit()
+
+Rows are added for new nodes and updated for moved nodes with set-based
+statements after each flush. Rows for deleted nodes are removed by the
+database, with ``ON DELETE CASCADE``. Nodes moved or deleted with statements
+that bypass the ORM require a :meth:`~NodeClosure.rebuild`.
+"""
+
+from sqlalchemy import (Column, Integer, ForeignKey, Index, event, select, func, literal, and_, or_,
+    exists, inspect)
+from sqlalchemy.orm import Session
+
+from .db import db
+from .node import Node
+
+__all__ = ['NodeClosure']
+
+
+class NodeClosure(db.Model):
+    """
+    A node and one of its ancestors, with the number of levels between them.
+    """
+    __tablename__ = 'node_closure'
+    #: Ancestor node id
+    ancestor_id = Column(None, ForeignKey('node.id', ondelete='CASCADE'), primary_key=True)
+    #: Descendant node id
+    descendant_id = Column(None, ForeignKey('node.id', ondelete='CASCADE'), primary_key=True)
+    #: Levels between the ancestor and descendant (0 for a node's own row)
+    depth = Column(Integer, nullable=False)
+    __table_args__ = (Index('ix_node_closure_ancestor_depth', 'ancestor_id', 'depth'),
+        Index('ix_node_closure_descendant', 'descendant_id', 'depth'))
+
+    @classmethod
+    def maintain(cls, enable=True):
+        """
+        Maintain the closure table as nodes are added and moved (or stop,
+        with ``enable=False``).
+        """
+        if enable:
+            if not event.contains(Session, 'after_flush', _closure_flush_listener):
+                event.listen(Session, 'after_flush', _closure_flush_listener)
+        elif event.contains(Session, 'after_flush', _closure_flush_listener):
+            event.remove(Session, 'after_flush', _closure_flush_listener)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Replace the contents of the closure table with rows made from node
+        paths, with a single INSERT ... SELECT statement. Pending changes
+        are flushed first.
+        """
+        db.session.flush()
+        table = cls.__table__
+        ancestor = Node.__table__.alias('ancestor')
+        descendant = Node.__table__.alias('descendant')
+        under = or_(
+            ancestor.c.path == u'/',
+            ancestor.c.path == descendant.c.path,
+            func.substr(descendant.c.path, 1, func.length(ancestor.c.path) + 1) == ancestor.c.path + u'/')
+        query = select([ancestor.c.id, descendant.c.id, descendant.c.depth - ancestor.c.depth]).where(
+            and_(ancestor.c.root_id == descendant.c.root_id, under))
+        db.session.execute(table.delete())
+        db.session.execute(table.insert().from_select(['ancestor_id', 'descendant_id', 'depth'], query))
+
+    @classmethod
+    def descendants(cls, node, depth=None, include_self=False):
+        """
+        Return a query for the nodes under a node.
+
+        :param node: Node to look under.
+        :param int depth: Only return nodes this many levels below.
+        :param bool include_self: Include the node itself (unless ``depth`` is given).
+        """
+        query = Node.query.join(cls, cls.descendant_id == Node.id).filter(cls.ancestor_id == node.id)
+        if depth is not None:
+            query = query.filter(cls.depth == depth)
+        elif not include_self:
+            query = query.filter(cls.depth > 0)
+        return query
+
+    @classmethod
+    def ancestors(cls, node, include_self=False):
+        """
+        Return a query for the nodes above a node, from the root down.
+
+        :param node: Node to look above.
+        :param bool include_self: Include the node itself.
+        """
+        query = Node.query.join(cls, cls.ancestor_id == Node.id).filter(cls.descendant_id == node.id)
+        if not include_self:
+            query = query.filter(cls.depth > 0)
+        return query.order_by(cls.depth.desc())
+
+    @classmethod
+    def is_under(cls, node, ancestor):
+        """
+        Check if a node is under another node, with a single lookup.
+        """
+        return db.session.query(exists().where(and_(cls.ancestor_id == ancestor.id,
+            cls.descendant_id == node.id, cls.depth > 0))).scalar()
+
+
+def _closure_flush_listener(session, flush_context):
+    table = NodeClosure.__table__
+    connection = session.connection()
+    new = [obj for obj in session.new if isinstance(obj, Node)]
+    # Parents before children, so that a child can copy its parent's rows
+    new.sort(key=lambda node: node.depth)
+    for node in new:
+        connection.execute(table.insert().values(ancestor_id=node.id, descendant_id=node.id, depth=0))
+        if node.parent_id is not None:
+            connection.execute(table.insert().from_select(['ancestor_id', 'descendant_id', 'depth'],
+                select([table.c.ancestor_id, literal(node.id, table.c.descendant_id.type), table.c.depth + 1]
+                    ).where(table.c.descendant_id == node.parent_id)))
+
+    new = set(new)
+    for node in session.dirty:
+        if isinstance(node, Node) and node not in new and inspect(node).attrs.parent.history.has_changes():
+            subtree = select([table.c.descendant_id]).where(table.c.ancestor_id == node.id)
+            above = select([table.c.ancestor_id]).where(
+                (table.c.descendant_id == node.id) & (table.c.ancestor_id != node.id))
+            # Unlink the subtree from its old ancestors...
+            connection.execute(table.delete().where(
+                table.c.descendant_id.in_(subtree) & table.c.ancestor_id.in_(above)))
+            # ...and link it to the new ones
+            if node.parent_id is not None:
+                upper = table.alias('upper')
+                lower = table.alias('lower')
+                connection.execute(table.insert().from_select(['ancestor_id', 'descendant_id', 'depth'],
+                    select([upper.c.ancestor_id, lower.c.descendant_id, upper.c.depth + lower.c.depth + 1]).where(
+                        (upper.c.descendant_id == node.parent_id) & (lower.c.ancestor_id == node.id))))
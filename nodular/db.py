@@ -24,22 +24,177 @@ this line to your init sequence::
 This makes your app the default app for this database object and removes
 the need to use ``app.test_request_context()`` when querying the database
 outside a request context.
+
+SQLite connections are made with foreign key support enabled. Other
+pragmas can be applied to new connections with :func:`set_sqlite_profile`,
+such as to let readers work alongside a writer on read-heavy sites::
+
+    from nodular import set_sqlite_profile
+    set_sqlite_profile('read_heavy')
+
+Call it before the first connection is made, as pooled connections keep the
+pragmas they were made with. ``python -m benchmarks.tree --sqlite-profile``
+compares profiles; see ``benchmarks/README.rst`` for results.
+
+Read-only queries on hot paths (traversal, URL generation, listing a
+node's children, subtree walks and revision history) can be sent to a
+read replica. Add the replica to ``SQLALCHEMY_BINDS`` and name it in the
+``NODULAR_READ_BIND`` config key::
+
+    app.config['SQLALCHEMY_BINDS'] = {'replica': 'postgresql://replica/myapp'}
+    app.config['NODULAR_READ_BIND'] = 'replica'
+
+Once a session has written to the database, all its queries go to the
+primary database, so that a request sees its own changes even if the
+replica lags behind. Your own read-only queries can use the replica with
+:func:`read_replica`.
 """
 
+import re
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.sql.expression import Select, CompoundSelect
 from coaster.db import db
 
-__all__ = ['db']
+__all__ = ['db', 'SQLITE_PROFILES', 'set_sqlite_profile', 'RoutingSession', 'read_replica']
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends SELECT statements made in a :func:`read_replica`
+    block to the bind named in the ``NODULAR_READ_BIND`` config key, until
+    the session writes to the database. Nodular replaces ``db.session``
+    with a scoped session of this class.
+    """
+    def get_bind(self, mapper=None, clause=None):
+        readbind = self.app.config.get('NODULAR_READ_BIND')
+        if readbind and not self.info.get('nodular_primary'):
+            if clause is not None and not isinstance(clause, (Select, CompoundSelect)):
+                # Stick to the primary after INSERT, UPDATE and DELETE statements
+                self.info['nodular_primary'] = True
+            elif (self.info.get('nodular_read') and not self._flushing
+                    and isinstance(clause, (Select, CompoundSelect))
+                    and (mapper is None or 'bind_key' not in mapper.mapped_table.info)):
+                return get_state(self.app).db.get_engine(self.app, bind=readbind)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _routing_session_flushed(session, flush_context):
+    session.info['nodular_primary'] = True
+
+
+@contextmanager
+def read_replica():
+    """
+    Context manager that sends read-only queries made within it to the
+    read replica, if one is configured and the session has not written
+    to the database::
+
+        with read_replica():
+            documents = MyDocument.query.filter_by(...).all()
+    """
+    session = db.session()
+    previous = session.info.get('nodular_read', False)
+    session.info['nodular_read'] = True
+    try:
+        yield session
+    finally:
+        session.info['nodular_read'] = previous
+
+
+_default_scopefunc = db.session.registry.scopefunc
+_session_scope = threading.local()
+
+
+def _scopefunc():
+    """Scope for db.session: the one set with _set_session_scope, or Flask-SQLAlchemy's."""
+    key = getattr(_session_scope, 'key', None)
+    return _default_scopefunc() if key is None else key
+
+
+def _set_session_scope(key):
+    """
+    Make ``db.session`` in this thread use the session for ``key`` (or the
+    default scope, if ``None``), and return the previous key.
+    """
+    previous = getattr(_session_scope, 'key', None)
+    _session_scope.key = key
+    return previous
+
+
+db.session = scoped_session(sessionmaker(class_=RoutingSession, db=db, query_cls=db.Query),
+    scopefunc=_scopefunc)
 
 
 # To enable foreign key support in SQLite3
-from sqlalchemy import event
 from sqlalchemy.engine import Engine
 from sqlite3 import Connection as SQLite3Connection
 
+#: Pragmas that a profile may set, in the order they are applied
+SQLITE_PRAGMAS = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store')
+
+#: Named pragma profiles for :func:`set_sqlite_profile`. ``default`` leaves
+#: SQLite's defaults alone (rollback journal, full sync). ``read_heavy``
+#: uses a write-ahead log so readers are not blocked by a writer, syncs
+#: less often (a power loss may lose the last transactions, but not corrupt
+#: the database), and uses 256 MB of memory-mapped I/O, a 64 MB page cache
+#: and in-memory temporary tables. ``durable`` uses a write-ahead log with
+#: a sync on every commit.
+SQLITE_PROFILES = {
+    'default': OrderedDict(),
+    'read_heavy': OrderedDict([
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('mmap_size', 268435456),
+        ('cache_size', -65536),
+        ('temp_store', 'MEMORY'),
+        ]),
+    'durable': OrderedDict([
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'FULL'),
+        ]),
+    }
+
+_sqlite_pragmas = OrderedDict()
+_pragma_value = re.compile(r'^-?\w+$')
+
+
+def set_sqlite_profile(profile='default', **pragmas):
+    """
+    Set pragmas for new SQLite connections from a named profile in
+    :data:`SQLITE_PROFILES`, with overrides given as keyword arguments::
+
+        set_sqlite_profile('read_heavy', cache_size=-16384)
+
+    :param string profile: Name of the profile.
+    :raises ValueError: If the profile or a pragma is unknown, or a value
+        is not a name or number.
+    """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError("Unknown SQLite profile: %s" % profile)
+    values = dict(SQLITE_PROFILES[profile])
+    for name, value in pragmas.items():
+        if name not in SQLITE_PRAGMAS:
+            raise ValueError("Unknown SQLite pragma: %s" % name)
+        if not _pragma_value.match(str(value)):
+            raise ValueError("Invalid value for SQLite pragma %s: %r" % (name, value))
+        values[name] = value
+    _sqlite_pragmas.clear()
+    for name in SQLITE_PRAGMAS:
+        if name in values:
+            _sqlite_pragmas[name] = values[name]
+
 
 @event.listens_for(Engine, "connect")
 def _set_sqlite_pragma(dbapi_connection, connection_record):
     if isinstance(dbapi_connection, SQLite3Connection):  # pragma: no cover
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON;")
+        for name, value in _sqlite_pragmas.items():
+            cursor.execute("PRAGMA %s=%s;" % (name, value))
         cursor.close()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+Instrumentation hooks for the publishing pipeline. An instrument receives
+per-stage timings and SQL query counts from :class:`~nodular.publisher.NodePublisher`
+and :class:`~nodular.publisher.NodeDispatcher`, along with cache hit/miss
+counters. Typical usage::
+
+    from nodular import NodePublisher, InstrumentCollector
+
+    collector = InstrumentCollector()
+    publisher = NodePublisher(root, registry, '/', instrument=collector)
+
+    # ... publish some paths, then:
+    collector.stages['traverse'].time      # Total seconds spent in traversal
+    collector.stages['traverse'].queries   # Total SQL statements issued
+    collector.counters['urlmap.hit']       # Cache hit counter
+
+To forward measurements to an external metrics system, pass callbacks to
+:class:`Instrument` or subclass it and override :meth:`~Instrument.timing`
+and :meth:`~Instrument.count`::
+
+    instrument = Instrument(
+        timing=lambda stage, duration, queries: statsd.timing('nodular.' + stage, duration * 1000),
+        count=lambda counter, value: statsd.incr('nodular.' + counter, value))
+
+Stages reported by the publisher are ``traverse`` (loading nodes along the
+path), ``alias`` (looking up a :class:`~nodular.node.NodeAlias` on a partial
+match), ``urlmatch`` (matching the remaining path against the URL map),
+``viewinit`` (constructing the view) and ``view`` (calling the view handler).
+
+Counters are ``urlmap.found`` and ``urlmap.notfound`` (whether the node's
+type has views), and hits and misses of the registry's caches:
+``nodetype.hit``/``nodetype.miss`` (the nodetype whose views render a node),
+``urlmap.hit``/``urlmap.miss`` (URL maps compiled on first use after loading
+a snapshot) and ``viewclass.hit``/``viewclass.miss`` (view classes imported
+on first use when registered by dotted name).
+"""
+
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = ['Instrument', 'InstrumentCollector', 'StageStats', 'querycount']
+
+
+_local = threading.local()
+
+
+def querycount():
+    """
+    Return the number of SQL statements executed in the current thread since
+    the process started. Take the difference between two calls to count the
+    statements issued in between.
+    """
+    return getattr(_local, 'count', 0)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _local.count = getattr(_local, 'count', 0) + 1
+
+
+class Instrument(object):
+    """
+    Receiver for publishing pipeline measurements. The base class does
+    nothing with measurements besides passing them to the optional callbacks.
+
+    :param timing: Callable that receives ``(stage, duration, queries)``
+        for each completed stage. ``duration`` is in seconds.
+    :param count: Callable that receives ``(counter, value)`` for each
+        counter increment.
+    """
+    def __init__(self, timing=None, count=None):
+        self._timing = timing
+        self._count = count
+
+    def timing(self, stage, duration, queries):
+        """
+        Record the duration and number of SQL statements of a completed stage.
+        """
+        if self._timing is not None:
+            self._timing(stage, duration, queries)
+
+    def count(self, counter, value=1):
+        """
+        Increment a counter, such as a cache hit or miss.
+        """
+        if self._count is not None:
+            self._count(counter, value)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager that measures the wrapped block and reports it
+        as stage ``name``.
+        """
+        start = default_timer()
+        startcount = querycount()
+        try:
+            yield
+        finally:
+            self.timing(name, default_timer() - start, querycount() - startcount)
+
+
+class _NullStage(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+class NullInstrument(Instrument):
+    """
+    Instrument that skips measurement entirely. Used when no instrument
+    is provided.
+    """
+    _nullstage = _NullStage()
+
+    def stage(self, name):
+        return self._nullstage
+
+    def count(self, counter, value=1):
+        pass
+
+
+#: Shared instance of :class:`NullInstrument`
+null_instrument = NullInstrument()
+
+
+class StageStats(object):
+    """Aggregated measurements for a stage in :class:`InstrumentCollector`."""
+    def __init__(self):
+        #: Number of times this stage was run
+        self.calls = 0
+        #: Total time spent in this stage, in seconds
+        self.time = 0.0
+        #: Longest run of this stage, in seconds
+        self.maxtime = 0.0
+        #: Total SQL statements issued in this stage
+        self.queries = 0
+
+    def add(self, duration, queries):
+        self.calls += 1
+        self.time += duration
+        self.queries += queries
+        if duration > self.maxtime:
+            self.maxtime = duration
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'time': self.time,
+            'maxtime': self.maxtime,
+            'queries': self.queries,
+            }
+
+
+class InstrumentCollector(Instrument):
+    """
+    In-process collector that aggregates measurements by stage and counter.
+    Callbacks passed to the constructor are still called, so a collector can
+    also forward measurements elsewhere.
+    """
+    def __init__(self, timing=None, count=None):
+        super(InstrumentCollector, self).__init__(timing, count)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discard all collected measurements."""
+        with self._lock:
+            #: Dictionary of stage name to :class:`StageStats`
+            self.stages = {}
+            #: Dictionary of counter name to value
+            self.counters = {}
+
+    def timing(self, stage, duration, queries):
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.add(duration, queries)
+        super(InstrumentCollector, self).timing(stage, duration, queries)
+
+    def count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+        super(InstrumentCollector, self).count(counter, value)
+
+    def as_dict(self):
+        """Export collected measurements as a dictionary."""
+        with self._lock:
+            return {
+                'stages': dict((name, stats.as_dict()) for name, stats in self.stages.items()),
+                'counters': dict(self.counters),
+                }
@@ -9,22 +9,54 @@ import weakref
 from collections import MutableMapping
 from werkzeug.utils import cached_property
 
-from sqlalchemy import Column, Unicode, DateTime
-from sqlalchemy import ForeignKey, UniqueConstraint, Index
-from sqlalchemy import event
-from sqlalchemy.orm import validates, mapper, relationship, backref
+from sqlalchemy import Column, Integer, Unicode, DateTime, Boolean
+from sqlalchemy import ForeignKey, UniqueConstraint, Index, DDL
+from sqlalchemy import event, select, or_, inspect
+from sqlalchemy.orm import validates, mapper, relationship, backref, object_session
 from sqlalchemy.orm.collections import InstrumentedList
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
 from coaster.sqlalchemy import TimestampMixin, PermissionMixin, BaseScopedNameMixin, JsonDict, UuidMixin
 
-from .db import db
+from .db import db, read_replica
 
 __all__ = ['Node', 'NodeAlias', 'NodeMixin', 'ProxyDict', 'pathjoin']
 
 _marker = []
 
 
+def _escape_like(value, escape=u'\\'):
+    """Escape LIKE wildcards in a string that will be used as a literal prefix."""
+    return value.replace(escape, escape + escape).replace(u'%', escape + u'%').replace(u'_', escape + u'_')
+
+
+class _PathUnder(ColumnElement):
+    """
+    SQL condition for paths under (but not equal to) a path, compiled to a
+    range scan on the ``(root_id, path)`` index: paths starting with
+    ``path + '/'`` sort from there up to ``path + '0'``, as ``'0'`` follows
+    ``'/'``. On PostgreSQL, where strings sort by locale, this is a LIKE
+    prefix match on the ``text_pattern_ops`` index instead.
+    """
+    type = Boolean()
+
+    def __init__(self, column, path):
+        self.column = column
+        self.path = path
+
+
+@compiles(_PathUnder)
+def _compile_path_under(element, compiler, **kw):
+    return compiler.process((element.column >= element.path + u'/') & (element.column < element.path + u'0'), **kw)
+
+
+@compiles(_PathUnder, 'postgresql')
+def _compile_path_under_postgresql(element, compiler, **kw):
+    return compiler.process(element.column.like(_escape_like(element.path) + u'/%', escape=u'\\'), **kw)
+
+
 def pathjoin(a, *p):
     """
     Join two or more pathname components, inserting '/' as needed.
@@ -46,6 +78,10 @@ def pathjoin(a, *p):
     return path
 
 
+#: Marker for keys that have no primed item in a ProxyDict
+_unprimed = object()
+
+
 # Adapted from
 # https://bitbucket.org/sqlalchemy/sqlalchemy/src/0d2e6fb5410e/examples/dynamic_dict/dynamic_dict.py?at=default
 class ProxyDict(MutableMapping):
@@ -61,6 +97,11 @@ class ProxyDict(MutableMapping):
     :param childclass: The model referred to in the relationship.
     :param keyname: Attribute in childclass that will be the dictionary key.
     :param parentkey: Attribute in childclass that refers back to this parent.
+
+    Items for known keys can be supplied in advance with :meth:`prime` to
+    save a query per lookup, such as when items for many parents are loaded
+    together. Primed items are forgotten when the transaction they were
+    loaded in ends.
     """
     def __init__(self, parent, collection_name, childclass, keyname, parentkey):
         self.parent = weakref.ref(parent)
@@ -68,6 +109,8 @@ class ProxyDict(MutableMapping):
         self.childclass = childclass
         self.keyname = keyname
         self.parentkey = parentkey
+        self._primed = {}
+        self._primed_in = None
 
         collection = self.collection
         if isinstance(collection, InstrumentedList):
@@ -79,46 +122,91 @@ class ProxyDict(MutableMapping):
     def collection(self):
         return getattr(self.parent(), self.collection_name)
 
+    def _transaction(self):
+        """Return the outermost transaction of the parent's session, or None."""
+        session = object_session(self.parent())
+        transaction = session.transaction if session is not None else None
+        while transaction is not None and transaction.parent is not None:
+            transaction = transaction.parent
+        return transaction
+
+    def prime(self, key, value):
+        """
+        Remember the item for a key, or ``None`` if there is no item, so that
+        lookups don't query the database. A primed item is used until the
+        transaction ends, for as long as its key attribute still matches.
+        """
+        transaction = self._transaction()
+        if self._primed_in is None or self._primed_in() is not transaction:
+            self._primed.clear()
+            self._primed_in = weakref.ref(transaction) if transaction is not None else None
+        if transaction is not None:
+            self._primed[key] = value
+
+    def forget(self, key=None):
+        """Forget the primed item for a key, or all primed items."""
+        if key is None:
+            self._primed.clear()
+        else:
+            self._primed.pop(key, None)
+
+    def _find(self, key):
+        """Return the item for a key, or None."""
+        if self.islist:  # pragma: no cover
+            for item in self.collection:
+                if getattr(item, self.keyname) == key:
+                    return item
+            return None
+        item = self._get_primed(key)
+        if item is _unprimed:
+            item = self.collection.filter_by(**{self.keyname: key}).first()
+        return item
+
+    def _get_primed(self, key):
+        """Return the primed item for a key, None if primed as missing, or _unprimed."""
+        if key not in self._primed:
+            return _unprimed
+        if self._primed_in() is not self._transaction():
+            # Primed in a transaction that has since ended
+            self._primed.clear()
+            return _unprimed
+        item = self._primed[key]
+        if item is not None and getattr(item, self.keyname) != key:
+            del self._primed[key]
+            return _unprimed
+        return item
+
     def keys(self):
         if self.islist:  # pragma: no cover
             return [getattr(x, self.keyname) for x in self.collection]
         else:
             descriptor = getattr(self.childclass, self.keyname)
-            return [x[0] for x in self.collection.values(descriptor)]
+            with read_replica():
+                return [x[0] for x in self.collection.values(descriptor)]
 
     def __getitem__(self, key):
-        if self.islist:  # pragma: no cover
-            try:
-                return (i for i in self.collection if getattr(i, self.keyname) == key).next()
-            except StopIteration:
-                raise KeyError(key)
+        with read_replica():
+            item = self._find(key)
+        if item is not None:
+            return item
         else:
-            item = self.collection.filter_by(**{self.keyname: key}).first()
-            if item is not None:
-                return item
-            else:
-                raise KeyError(key)
+            raise KeyError(key)
 
     def get(self, key, default=None):
-        if self.islist:  # pragma: no cover
-            try:
-                return self[key]
-            except KeyError:
-                return default
+        with read_replica():
+            retval = self._find(key)
+        # Watch out for retval being falsy. Return default iff retval is None.
+        if retval is None:
+            return default
         else:
-            retval = self.collection.filter_by(**{self.keyname: key}).first()
-            # Watch out for retval being falsy. Return default iff retval is None.
-            if retval is None:
-                return default
-            else:
-                return retval
+            return retval
 
     def __setitem__(self, key, value):
-        try:
-            existing = self[key]
+        self._primed.pop(key, None)
+        # Look for an existing item in the primary database
+        existing = self._find(key)
+        if existing is not None:
             self.collection.remove(existing)
-        except KeyError:
-            pass
         setattr(value, self.keyname, key)
         if self.islist:  # pragma: no cover
             self.collection.append(value)
@@ -126,7 +214,10 @@ class ProxyDict(MutableMapping):
             setattr(value, self.parentkey, self.parent())
 
     def __delitem__(self, key):
-        existing = self[key]
+        existing = self._find(key)
+        if existing is None:
+            raise KeyError(key)
+        self._primed.pop(key, None)
         if self.islist:  # pragma: no cover
             self.collection.remove(existing)
         else:
@@ -137,7 +228,11 @@ class ProxyDict(MutableMapping):
             default = []
             return self.get(key, default) is not default
         else:
-            return self.collection.filter_by(**{self.keyname: key}).count() > 0
+            item = self._get_primed(key)
+            if item is not _unprimed:
+                return item is not None
+            with read_replica():
+                return self.collection.filter_by(**{self.keyname: key}).count() > 0
 
     def __iter__(self):
         return iter(self.keys())
@@ -146,13 +241,15 @@ class ProxyDict(MutableMapping):
         if self.islist:  # pragma: no cover
             return len(self.collection)
         else:
-            return self.collection.count()
+            with read_replica():
+                return self.collection.count()
 
     def __bool__(self):
         if self.islist:  # pragma: no cover
             return bool(self.collection)
         else:
-            return self.collection.session.query(self.collection.exists()).first()[0]
+            with read_replica():
+                return self.collection.session.query(self.collection.exists()).first()[0]
 
 
 class Node(UuidMixin, BaseScopedNameMixin, db.Model):
@@ -165,6 +262,8 @@ class Node(UuidMixin, BaseScopedNameMixin, db.Model):
     __type__ = u'node'
     #: Full path to this node for URL traversal
     _path = Column('path', Unicode(1000), nullable=False, default=u'')
+    #: Number of levels below the root (0 for root nodes), updated with the path
+    _depth = Column('depth', Integer, nullable=False, default=0)
     #: Id of the user who made this node, empty for auto-generated nodes
     user_id = Column(None, ForeignKey('user.id'), nullable=True)
     #: User who made this node, empty for auto-generated nodes
@@ -192,6 +291,7 @@ class Node(UuidMixin, BaseScopedNameMixin, db.Model):
     #: Instance type, for user-customizable types
     itype = Column(Unicode(30), nullable=True, index=True)
     __table_args__ = (UniqueConstraint('parent_id', 'name'), UniqueConstraint('root_id', 'path'),
+        Index('ix_node_root_id_depth', 'root_id', 'depth'),
         Index('ix_node_properties', 'properties',
             postgresql_using='gin', postgresql_ops={'properties': 'jsonb_path_ops'}))
     __mapper_args__ = {'polymorphic_on': type, 'polymorphic_identity': u'node'}
@@ -249,30 +349,59 @@ class Node(UuidMixin, BaseScopedNameMixin, db.Model):
         """Path to this node for URL traversal."""
         return self._path
 
-    def _update_path(self, newparent=_marker, newname=None):
-        if newparent is not _marker:
-            useparent = newparent
-        else:
-            useparent = self.parent
-        if not useparent:
-            self._path = u'/'  # We're root. Our name is irrelevant
-        else:
-            path = pathjoin(useparent.path, (newname or self.name or u''))
-            if len(path) > 1000:
-                raise ValueError("Path is too long")
-            self._path = path
+    @hybrid_property
+    def depth(self):
+        """Number of levels below the root node (0 for root nodes)."""
+        return self._depth
+
+    def _subtree_nodes(self):
+        """
+        Return the nodes under this node, parents before children. Nodes in
+        the database are loaded with a single range scan, unless their paths
+        in the database may be out of date.
+        """
+        state = inspect(self)
+        if state.has_identity and not any(state.attrs[attr].history.has_changes()
+                for attr in ('name', 'parent', '_path')):
+            session = state.session
+            if session is None or session.autoflush or not any(
+                    isinstance(obj, Node) for obj in list(session.new) + list(session.dirty)):
+                return sorted(self.descendants_query(), key=lambda node: node.depth)
+        nodes = []
         for child in self._nodes:
-            child._update_path()
+            nodes.append(child)
+            nodes.extend(child._subtree_nodes())
+        return nodes
+
+    def _path_under(self, parent, name):
+        """Return this node's path with the given parent and name."""
+        if not parent:
+            return u'/'  # We're root. Our name is irrelevant
+        path = pathjoin(parent.path, name or u'')
+        if len(path) > 1000:
+            raise ValueError("Path is too long")
+        return path
+
+    def _update_path(self, newparent=_marker, newname=None, subtree=None):
+        path = self._path_under(self.parent if newparent is _marker else newparent, newname or self.name)
+        if subtree is None:
+            # Find the subtree by the current path
+            subtree = self._subtree_nodes()
+        self._path = path
+        self._depth = _path_depth(path)
+        for node in subtree:
+            node._path = node._path_under(node.parent, node.name)
+            node._depth = _path_depth(node._path)
 
     @hybrid_property
     def root(self):
         """The root node for this node's tree."""
         return self._root
 
-    def _update_root(self, root):
+    def _update_root(self, root, subtree=None):
         self._root = root
-        for child in self._nodes:
-            child._update_root(root)
+        for node in (self._subtree_nodes() if subtree is None else subtree):
+            node._root = root
 
     @cached_property
     def nodes(self):
@@ -284,6 +413,18 @@ class Node(UuidMixin, BaseScopedNameMixin, db.Model):
         """Dictionary of all aliases for renamed, moved or deleted sub-nodes."""
         return ProxyDict(self, '_aliases', NodeAlias, 'name', 'parent')
 
+    def iter_nodes(self, batch_size=100):
+        """
+        Iterate over child nodes in order of name, fetching ``batch_size``
+        rows at a time instead of loading all of them at once. Use this for
+        large containers, such as when streaming a listing.
+
+        :param int batch_size: Number of rows to fetch at a time.
+        """
+        # The query is executed when iteration starts
+        with read_replica():
+            return iter(self._nodes.yield_per(batch_size))
+
     def getnode(self, name, default=None):
         node = self.nodes.get(name)
         if node is not None:
@@ -294,13 +435,129 @@ class Node(UuidMixin, BaseScopedNameMixin, db.Model):
 
     def getprop(self, key, default=None):
         """Return the inherited value of a property from the closest parent node on which it was set."""
-        node = self
-        while node is not None:
-            if key in node.properties:
-                return node.properties[key]
-            node = node.parent
+        with read_replica():
+            node = self
+            while node is not None:
+                if key in node.properties:
+                    return node.properties[key]
+                node = node.parent
         return default
 
+    def _subtree_clause(self, include_self=True):
+        """SQL clause matching nodes under this node, and this node itself."""
+        if self.path == u'/':
+            clause = Node._root_id == self._root_id
+            if not include_self:
+                clause = clause & (Node._path != u'/')
+            return clause
+        under = _PathUnder(Node._path, self.path)
+        if include_self:
+            under = or_(Node._path == self.path, under)
+        return (Node._root_id == self._root_id) & under
+
+    def descendants_query(self, include_self=False, levels=None):
+        """
+        Return a query for all nodes under this node, in order of path. The
+        query is a range scan on the ``(root_id, path)`` index (or, on
+        PostgreSQL, a prefix match on a ``text_pattern_ops`` index).
+
+        With ``levels``, only nodes that many levels below this node or
+        fewer are returned, such as to build a navigation menu with the top
+        three levels of a site in one query::
+
+            menu = root.descendants_query(levels=3).all()
+
+        For a root node, this is a range scan on the ``(root_id, depth)``
+        index.
+
+        :param bool include_self: Include this node in the results.
+        :param int levels: Maximum number of levels below this node.
+        """
+        query = Node.query.filter(self._subtree_clause(include_self))
+        if levels is not None:
+            query = query.filter(Node._depth <= self.depth + levels)
+        return query.order_by(Node._path)
+
+    def ancestors_query(self, include_self=False):
+        """
+        Return a query for the nodes above this node, from the root down. The
+        paths of ancestors are known from this node's path, so they are found
+        with lookups on the ``(root_id, path)`` index.
+
+        :param bool include_self: Include this node in the results.
+        """
+        paths = [u'/']
+        parts = self.path.split(u'/')[1:-1] if self.path != u'/' else []
+        for part in parts:
+            paths.append(pathjoin(paths[-1], part))
+        if include_self:
+            paths.append(self.path)
+        elif self.path == u'/':
+            paths = []
+        return Node.query.filter(Node._root_id == self._root_id, Node._path.in_(paths)).order_by(Node._path)
+
+    def delete_subtree(self):
+        """
+        Delete this node and all nodes under it with database-level statements,
+        without loading the subtree into the session. A :class:`NodeAlias`
+        is made for this node to indicate that it is gone, as when a node is
+        deleted with ``db.session.delete``. Aliases elsewhere that redirect to
+        a deleted node will now indicate that it is gone.
+
+        Rows in joined subclass tables and revisions are removed by the
+        ``ON DELETE CASCADE`` rules of their foreign keys. Tables in your app that
+        refer to nodes must have similar rules or this will fail with an
+        IntegrityError. Pending changes in the session are flushed first. Deleted
+        nodes and their loaded aliases and revisions are expunged from the session
+        and loaded aliases that redirect to them are expired.
+        """
+        session = db.session
+        session.flush()
+        if self.parent_id is not None:
+            alias = NodeAlias.query.get((self.parent_id, self.name))
+            if alias is None:
+                session.add(NodeAlias(parent_id=self.parent_id, name=self.name, node=None))
+            else:
+                alias.node = None
+            session.flush()
+
+        # Find loaded nodes in the subtree. Paths are compared in Python
+        # and the database is asked only about expired nodes
+        rootid = self._root_id
+        prefix = self.path.rstrip(u'/') + u'/'
+        deleted = set()
+        expired = []
+        for obj in session.identity_map.values():
+            if isinstance(obj, Node):
+                state = inspect(obj)
+                if '_root_id' in state.dict and state.dict['_root_id'] != rootid:
+                    continue
+                if '_path' in state.dict and '_root_id' in state.dict:
+                    if state.dict['_path'] == self.path or state.dict['_path'].startswith(prefix):
+                        deleted.add(state.identity[0])
+                else:
+                    expired.append(state.identity[0])
+        clause = self._subtree_clause()
+        for start in range(0, len(expired), SUBTREE_BATCH_SIZE):
+            deleted.update(row[0] for row in session.execute(select([Node.__table__.c.id]).where(
+                clause & Node.__table__.c.id.in_(expired[start:start + SUBTREE_BATCH_SIZE]))))
+
+        session.execute(Node.__table__.delete().where(clause))
+
+        for obj in list(session.identity_map.values()):
+            state = inspect(obj)
+            if isinstance(obj, Node):
+                if state.identity[0] in deleted:
+                    session.expunge(obj)
+            elif isinstance(obj, NodeAlias):
+                if state.identity[0] in deleted:
+                    session.expunge(obj)
+                elif state.dict.get('node_id') in deleted:
+                    session.expire(obj, ['node_id', 'node'])
+            elif hasattr(obj, '__parent_model__') and state.dict.get('node_id') in deleted:
+                # Revisions of a deleted node
+                session.expunge(obj)
+
     def as_dict(self):
         """Export the node as a dictionary."""
         return {
@@ -341,17 +598,32 @@ class Node(UuidMixin, BaseScopedNameMixin, db.Model):
         return cls.query.filter_by(buid=buid).one_or_none()
 
 
+def _path_depth(path):
+    """Return the depth of a node from its path."""
+    return 0 if path == u'/' else path.count(u'/')
+
+
+# On PostgreSQL, descendant queries are LIKE prefix matches, which need an
+# index with text_pattern_ops unless the database uses the C locale
+event.listen(Node.__table__, 'after_create', DDL(
+    'CREATE INDEX ix_node_root_id_path_pattern ON node (root_id, path text_pattern_ops)'
+    ).execute_if(dialect='postgresql'))
+
+
 def _node_parent_listener(target, value, oldvalue, initiator):
     """Listen for Node.parent being modified and update path"""
     if value != oldvalue:
+        newparent = value if value is not None else target
+        # Check the new path before finding the subtree, which may flush the session
+        target._path_under(newparent, target.name)
+        subtree = target._subtree_nodes()
         if value is not None:
             if target._root != (value._root or value):
-                target._update_root(value._root or value)
-            target._update_path(newparent=value)
+                target._update_root(value._root or value, subtree)
         else:
             # This node just got orphaned. It's a new root
-            target._update_root(target)
-            target._update_path(newparent=target)
+            target._update_root(target, subtree)
+        target._update_path(newparent=newparent, subtree=subtree)
     return value
 
 
@@ -369,21 +641,40 @@ def _node_mapper_listener(mapper, class_):
         event.listen(class_.name, 'set', _node_name_listener, retval=True)
 
 
+#: Maximum number of deleted nodes to look up aliases for in a single query
+#: (keeps the number of bound parameters within database limits)
+ALIAS_BATCH_SIZE = 400
+
+#: Maximum number of expired nodes to check in a single query when deleting
+#: a subtree
+SUBTREE_BATCH_SIZE = 400
+
+
 @event.listens_for(db.Session, "before_flush")
 def _node_flush_listener(session, flush_context, instances=None):
     """
     When a node is deleted, make an alias that sits on the old
     name and indicates that the node has been deleted.
     """
-    for obj in session._deleted.values():
-        if isinstance(obj, Node) and obj.parent_id is not None:
-            # Make an alias if it's a Node and it's not a root node.
-            alias = NodeAlias.query.get((obj.parent_id, obj.name))
+    # Make an alias if it's a Node and it's not a root node.
+    keys = list(set((obj.parent_id, obj.name) for obj in session._deleted.values()
+        if isinstance(obj, Node) and obj.parent_id is not None))
+    newaliases = []
+    for start in range(0, len(keys), ALIAS_BATCH_SIZE):
+        batch = keys[start:start + ALIAS_BATCH_SIZE]
+        # Load existing aliases for the entire batch in a single query. Filtering on
+        # parent ids and names separately may return a few extra aliases, which are ignored
+        existing = dict(((alias.parent_id, alias.name), alias) for alias in NodeAlias.query.filter(
+            NodeAlias.parent_id.in_(set(k[0] for k in batch)),
+            NodeAlias.name.in_(set(k[1] for k in batch))))
+        for parent_id, name in batch:
+            alias = existing.get((parent_id, name))
             if alias is None:
-                alias = NodeAlias(parent_id=obj.parent_id, name=obj.name, node=None)
-                session.add(alias)
+                newaliases.append(NodeAlias(parent_id=parent_id, name=name, node=None))
             else:
                 alias.node = None
+    if newaliases:
+        session.add_all(newaliases)
 
 
 class NodeAlias(TimestampMixin, db.Model):
@@ -17,10 +17,14 @@ Typical usage::
 """
 
 from __future__ import unicode_literals
+from inspect import isgenerator
 from six.moves.urllib.parse import urlencode, urljoin
-from flask import request, redirect, g
+from werkzeug.routing import RequestRedirect
+from flask import request, redirect, g, Response, stream_with_context
+from .db import read_replica
 from .node import pathjoin, Node, NodeAlias
 from .exceptions import RootNotFound, NodeGone, ViewNotFound
+from .instrument import null_instrument
 
 __all__ = ['NodePublisher', 'TRAVERSE_STATUS']
 
@@ -99,22 +103,46 @@ class NodeDispatcher(object):
     :param node: Node for which we are dispatching views.
     :param user: User for which we are rendering the view.
     :param permissions: Externally-granted permissions for this user.
+    :param instrument: Receiver for stage timings (optional).
+    :type instrument: :class:`~nodular.instrument.Instrument`
 
-    The view instance is made available as ``flask.g.view``.
+    The view instance is made available as ``flask.g.view``. If the view
+    returns a generator, it is sent as a streaming response, with the request
+    context and database session kept open until the response is consumed.
     """
-    def __init__(self, registry, node, user, permissions):
+    def __init__(self, registry, node, user, permissions, instrument=None):
         self.registry = registry
         self.node = node
         self.user = user
         self.permissions = permissions
+        self.instrument = instrument or null_instrument
 
-    def __call__(self, endpoint, args):
+    def _resolve(self, endpoint):
+        """Return a view instance and view function for an endpoint."""
         if '/' not in endpoint:  # pragma: no cover
             raise ViewNotFound(endpoint)  # We don't know about endpoints that aren't in 'view/function' syntax
         viewname, endpointname = endpoint.split('/', 1)
-        view = self.registry.viewlist[viewname](self.node, self.user, self.permissions)
+        with self.instrument.stage('viewinit'):
+            view = self.registry.viewlist.lookup(viewname, self.instrument)(self.node, self.user, self.permissions)
         g.view = view
-        return view.view_functions[endpointname](view, **args)
+        return view, view.view_functions[endpointname]
+
+    def _response(self, result):
+        """Wrap generators returned by views in a streaming response."""
+        if not isgenerator(result):
+            return result
+        # Load the node's ancestors into parent attributes (from the identity
+        # map, without queries) so they stay referenced and usable until the
+        # stream has been consumed
+        node = self.node
+        while node is not None:
+            node = node.parent
+        return Response(stream_with_context(result))
+
+    def __call__(self, endpoint, args):
+        view, f = self._resolve(endpoint)
+        with self.instrument.stage('view'):
+            return self._response(f(view, **args))
 
 
 class NodePublisher(object):
@@ -126,15 +154,19 @@ class NodePublisher(object):
     :param string basepath: Base path to publish from, typically ``'/'``.
     :param string urlpath: URL path to publish to, typically also ``'/'``.
         Defaults to the :obj:`basepath` value.
+    :param instrument: Receiver for stage timings, query counts and cache
+        counters (optional).
     :type registry: :class:`~nodular.registry.NodeRegistry`
+    :type instrument: :class:`~nodular.instrument.Instrument`
 
     NodePublisher may be instantiated either globally or per request, but requires a root node
     to query against. Depending on your setup, this may be available only at request time.
     """
 
-    def __init__(self, root, registry, basepath, urlpath=None):
+    def __init__(self, root, registry, basepath, urlpath=None, instrument=None):
         self.root = root
         self.registry = registry
+        self.instrument = instrument or null_instrument
         if not basepath.startswith('/'):
             raise ValueError("Parameter ``basepath`` must be an absolute path starting with '/'")
         if basepath != '/' and basepath.endswith('/'):
@@ -182,6 +214,10 @@ class NodePublisher(object):
         :class:`NodePublisher` may be initialized with ``registry=None`` if only used for
         traversal.
         """
+        with read_replica():
+            return self._traverse(path, redirect)
+
+    def _traverse(self, path, redirect):
         if not path.startswith('/'):
             path = '/' + path
         if not path.startswith(self.urlpath):
@@ -191,7 +227,8 @@ class NodePublisher(object):
         nodepath, searchpaths = _make_path_tree(self.basepath, path)
         # Load nodes into the SQLAlchemy identity map so that node.parent does not
         # require a database roundtrip
-        nodes = Node.query.filter(Node._root_id == self.root_id, Node.path.in_(searchpaths)).order_by('path').all()
+        with self.instrument.stage('traverse'):
+            nodes = Node.query.filter(Node._root_id == self.root_id, Node.path.in_(searchpaths)).order_by('path').all()
 
         # Is there an exact matching node? Return it
         if len(nodes) > 0 and nodes[-1].path == nodepath:
@@ -218,7 +255,8 @@ class NodePublisher(object):
 
         if redirect:
             aliasname = pathfragment.split('/', 1)[0]
-            alias = NodeAlias.query.filter_by(parent=lastnode, name=aliasname).first()
+            with self.instrument.stage('alias'):
+                alias = NodeAlias.query.filter_by(parent=lastnode, name=aliasname).first()
             if alias is None:
                 # No alias, but the remaining path may be handled by the node,
                 # so return a partial match
@@ -262,22 +300,44 @@ class NodePublisher(object):
 
         :meth:`publish` uses :meth:`traverse` to find a node to publish.
         """
+        response, node, endpoint, args = self._match(path)
+        if response is not None:
+            return response
+        return NodeDispatcher(self.registry, node, user, permissions, self.instrument)(endpoint, args)
+
+    def _match(self, path):
+        """
+        Traverse to a node and match the remaining path against its views.
+        Returns a tuple of (response, node, endpoint, args), where response is
+        set instead of the others if the path redirects elsewhere.
+        """
         status, node, pathfragment = self.traverse(path)
         if status == TRAVERSE_STATUS.REDIRECT:
-            return redirect(pathfragment, code=302)  # Use 302 until we're sure we want to use 301
+            return redirect(pathfragment, code=302), None, None, None  # Use 302 until we're sure we want to use 301
         elif status == TRAVERSE_STATUS.NOROOT:
             raise RootNotFound
         elif status == TRAVERSE_STATUS.GONE:
             raise NodeGone
         else:
-            urls = self.registry.urlmaps[node.etype].bind_to_environ(request)
+            nodetype = self.registry.view_nodetype(node, self.instrument)
+            if nodetype is None:
+                self.instrument.count('urlmap.notfound')
+                raise ViewNotFound("No views registered for node type '%s'" % node.etype)
+            self.instrument.count('urlmap.found')
+            urls = self.registry.urlmap(nodetype, self.instrument).bind_to_environ(request)
             if status == TRAVERSE_STATUS.MATCH:
                 # Find '/' path handler. If none, return 404
-                return urls.dispatch(NodeDispatcher(self.registry, node, user, permissions), path_info='/')
+                path_info = '/'
             elif status == TRAVERSE_STATUS.PARTIAL:
-                return urls.dispatch(NodeDispatcher(self.registry, node, user, permissions), path_info=pathfragment)
+                path_info = pathfragment
             else:
                 raise NotImplementedError("Unknown traversal status")  # pragma: no cover
+            try:
+                with self.instrument.stage('urlmatch'):
+                    endpoint, args = urls.match(path_info=path_info)
+            except RequestRedirect as e:
+                return e, None, None, None
+            return None, node, endpoint, args
 
     def url_for(self, node, action='view', _external=False, **kwargs):
         """
@@ -291,14 +351,12 @@ class NodePublisher(object):
         def basepath2urlpath(x):
             return x.replace(self.basepath, self.urlpath, 1).replace('//', '/')
 
-        node_urlmap = self.registry.urlmaps.get(node.etype)
-        for rule in node_urlmap.iter_rules():
-            viewname, endpointname = rule.endpoint.split('/', 1)
-            if action == endpointname:
-                path = node.path + rule.rule
-                break
-        else:
-            raise ViewNotFound("Action '%s' does not exist for node type '%s'" % (action, node.etype))
+        with read_replica():
+            nodetype = self.registry.view_nodetype(node)
+            rule = self.registry.endpoint_rule(nodetype, action) if nodetype is not None else None
+            if rule is None:
+                raise ViewNotFound("Action '%s' does not exist for node type '%s'" % (action, node.etype))
+            path = node.path + rule
 
         url = basepath2urlpath(path)
 
@@ -6,16 +6,42 @@ and their views.
 
 Nodular does *not* provide a global instance of :class:`NodeRegistry`. Since
 the registry determines what is available in an app, registries should be
-constructed as app-level globals.
+constructed as app-level globals. Once all nodes and views are registered,
+call :meth:`NodeRegistry.freeze` to compile the URL maps in one pass::
+
+    registry = NodeRegistry()
+    registry.register_node(MyDocument, view=MyDocumentView)
+    ...
+    registry.freeze()
+
+A frozen registry can be saved as a snapshot and loaded in worker processes
+with :meth:`NodeRegistry.load`, which skips rebuilding URL maps from view
+classes and imports view modules only when a view is first dispatched::
+
+    with open('registry.json', 'w') as f:
+        registry.dump(f)
 """
 
+import json
 from inspect import isclass
 from collections import OrderedDict, defaultdict
-from werkzeug.routing import Map as UrlMap
+import six
+from werkzeug.routing import Map as UrlMap, Rule as UrlRule
+from werkzeug.utils import import_string
+from sqlalchemy import event
 from .node import Node
+from .instrument import null_instrument
 
 __all__ = ['NodeRegistry']
 
+#: Version of the registry snapshot format written by :meth:`NodeRegistry.snapshot`
+SNAPSHOT_VERSION = 1
+
+#: Maximum number of node classes and instance types to cache view nodetypes for
+NODETYPE_CACHE_SIZE = 1024
+
+_empty = frozenset()
+
 
 def dottedname(entity):
     """Return a dotted name to the given named entity"""
@@ -27,6 +53,40 @@ class RegistryItem(object):
     pass
 
 
+class _ViewList(dict):
+    """
+    Dictionary of dotted view names to view classes. Values may be dotted
+    names, which are imported when the view is first looked up and checked
+    against the endpoints declared for them in :attr:`declared`.
+    """
+    def __init__(self, *args, **kwargs):
+        super(_ViewList, self).__init__(*args, **kwargs)
+        #: Endpoints declared for views that have not been imported yet
+        self.declared = defaultdict(set)
+
+    def __getitem__(self, key):
+        return self.lookup(key)
+
+    def lookup(self, key, instrument=null_instrument):
+        """
+        Return the view class for a dotted name, counting ``viewclass.hit``
+        if it was already imported or ``viewclass.miss`` if not.
+        """
+        view = dict.__getitem__(self, key)
+        if not isinstance(view, six.string_types):
+            instrument.count('viewclass.hit')
+        else:
+            instrument.count('viewclass.miss')
+            view = import_string(view)
+            missing = self.declared.get(key, _empty) - set(view.view_functions)
+            if missing:
+                raise ValueError("View %s has no view functions for declared endpoints: %s" % (
+                    key, u', '.join(sorted(missing))))
+            self.declared.pop(key, None)
+            self[key] = view
+        return view
+
+
 class NodeRegistry(object):
     """
     Registry for node types and node views.
@@ -35,8 +95,23 @@ class NodeRegistry(object):
         self.nodes = OrderedDict()
         self.child_nodetypes = defaultdict(set)
         self.nodeviews = defaultdict(list)
-        self.viewlist = {}
-        self.urlmaps = defaultdict(lambda: UrlMap(strict_slashes=False))
+        self.viewlist = _ViewList()
+        self.urlmaps = {}
+        # URL rules loaded from a snapshot, compiled into URL maps on first use
+        self._rulespecs = {}
+        # Effective child nodetypes with wildcards resolved, computed on first use
+        self._allowed_children = None
+        self._enforcing = False
+        # (itype, type, model) to the nodetype whose views render it
+        self._nodetype_cache = {}
+        #: Dictionary of nodetype to a dictionary of endpoint names and URL rules, for building URLs
+        self.endpoints = {}
+        #: True if the registry has been frozen with :meth:`freeze`
+        self.frozen = False
+
+    def _check_frozen(self):
+        if self.frozen:
+            raise RuntimeError("This registry is frozen and cannot be modified")
 
     def register_node(self, model, view=None, itype=None, title=None,
             child_nodetypes=None, parent_nodetypes=None):
@@ -59,6 +134,7 @@ class NodeRegistry(object):
         ``child_nodetypes``.
         """
 
+        self._check_frozen()
         item = RegistryItem()
         item.model = model
         item.nodetype = itype or model.__type__
@@ -73,26 +149,316 @@ class NodeRegistry(object):
     def _register_parentchild(self, regitem, child_nodetypes=None, parent_nodetypes=None):
         if child_nodetypes is not None:
             self.child_nodetypes[regitem.nodetype].update(
-                [c.__type__ if isinstance(c, Node) else c for c in child_nodetypes])
+                [c.__type__ if isclass(c) else c for c in child_nodetypes])
         for ptype in parent_nodetypes or []:
-            self.child_nodetypes[ptype.__type__ if isinstance(ptype, Node) else ptype].add(regitem.nodetype)
+            self.child_nodetypes[ptype.__type__ if isclass(ptype) else ptype].add(regitem.nodetype)
+        self._allowed_children = None
+
+    def _compile_children(self):
+        generic = frozenset(self.child_nodetypes.get('*', ()))
+        allowed = {}
+        for nodetype, childtypes in self.child_nodetypes.items():
+            if nodetype == '*':
+                continue
+            if '*' in childtypes:
+                allowed[nodetype] = frozenset(childtypes - set(['*'])) | generic
+            else:
+                allowed[nodetype] = frozenset(childtypes)
+        self._allowed_children = allowed
+        return allowed
 
-    def register_view(self, nodetype, view):
+    def allowed_children(self, nodetype):
+        """
+        Return a frozenset of the nodetypes that can be children of the given
+        nodetype, with the ``'*'`` wildcard resolved: a generic container can
+        contain nodetypes that list ``'*'`` in ``parent_nodetypes``, in addition
+        to the nodetypes it names.
+
+        :param string nodetype: Node type of the parent.
+        """
+        allowed = self._allowed_children
+        if allowed is None:
+            allowed = self._compile_children()
+        return allowed.get(nodetype, _empty)
+
+    def allows_child(self, parent_nodetype, child_nodetype):
+        """
+        Check if a node of type ``parent_nodetype`` can contain a node of type
+        ``child_nodetype``. Node types are effective types, as in
+        :attr:`Node.etype <nodular.node.Node.etype>`.
+
+        :param string parent_nodetype: Node type of the parent.
+        :param string child_nodetype: Node type of the child.
+        """
+        return child_nodetype in self.allowed_children(parent_nodetype)
+
+    def _parent_listener(self, target, value, oldvalue, initiator):
+        if value is not None and value is not oldvalue and not self.allows_child(value.etype, target.etype):
+            raise ValueError("%s cannot contain %s" % (value.etype, target.etype))
+
+    def enforce_child_nodetypes(self, enforce=True):
+        """
+        Reject nodes that are placed in a parent that does not allow their
+        nodetype, raising :exc:`ValueError` when :attr:`Node.parent
+        <nodular.node.Node.parent>` is set. Enforcement applies to all nodes
+        in the process, so only one registry should enforce at a time. Nodes
+        with an instance type must have :attr:`~nodular.node.Node.itype` set
+        before their parent.
+
+        :param bool enforce: Pass ``False`` to stop enforcing.
+        """
+        if enforce and not self._enforcing:
+            event.listen(Node.parent, 'set', self._parent_listener, propagate=True)
+        elif not enforce and self._enforcing:
+            event.remove(Node.parent, 'set', self._parent_listener)
+        self._enforcing = enforce
+
+    def register_view(self, nodetype, view, routes=None):
         """
         Register a view.
 
         :param string nodetype: Node type that this view renders for.
-        :param view: View class.
+        :param view: View class, or the dotted name of a view class.
+        :param list routes: Routes of the view, required if the view is given
+            by dotted name.
         :type view: :class:`~nodular.view.NodeView`
+
+        Views registered by dotted name are not imported until they are first
+        dispatched. Their routes must be declared here, as a list of dictionaries
+        with the parameters to :meth:`~nodular.view.NodeView.route` (``rule``,
+        ``endpoint``, ``methods`` and ``defaults``), including routes inherited
+        from base classes. ``endpoint`` is required, and :exc:`ValueError` is
+        raised when the view is imported if it has no view function for one::
+
+            registry.register_view('document', 'myapp.views.DocumentView', routes=[
+                {'rule': '/', 'endpoint': 'view'},
+                {'rule': '/edit', 'endpoint': 'edit', 'methods': ['GET', 'POST']},
+                ])
         """
+        self._check_frozen()
         if isclass(nodetype):
             nodetype = nodetype.__type__
+        if isinstance(view, six.string_types):
+            if routes is None:
+                raise TypeError("Routes must be declared for views registered by dotted name")
+            dotted_view_name = view
+            self.viewlist.setdefault(dotted_view_name, view)
+            rules = [self._route_rule(route) for route in routes]
+            if isinstance(self.viewlist.get(dotted_view_name), six.string_types):
+                self.viewlist.declared[dotted_view_name].update(rule.endpoint for rule in rules)
+        else:
+            if routes is not None:
+                raise TypeError("Routes can only be declared for views registered by dotted name")
+            dotted_view_name = dottedname(view)
+            self.viewlist[dotted_view_name] = view
+            rules = [self._route_rule(route) for route in view.__routes__]
         self.nodeviews[nodetype].append(view)
-        dotted_view_name = dottedname(view)
-        self.viewlist[dotted_view_name] = view
-        # Combine URL rules from across views for the same nodetype
-        for rule in view.url_map.iter_rules():
-            rule = rule.empty()
+        # Combine URL rules from across views for the same nodetype. Rules are sorted
+        # when the URL map is first used or when the registry is frozen, not here
+        urlmap = self.urlmaps.get(nodetype)
+        if urlmap is None:
+            urlmap = self.urlmaps[nodetype] = UrlMap(strict_slashes=False)
+        for rule in rules:
             rule.endpoint = dotted_view_name + '/' + rule.endpoint
-            self.urlmaps[nodetype].add(rule)
-        self.urlmaps[nodetype].update()
+            urlmap.add(rule)
+        self.endpoints.pop(nodetype, None)
+        self._nodetype_cache.clear()
+
+    @staticmethod
+    def _route_rule(route):
+        # Mirrors the defaults in NodeView.route
+        methods = set(route.get('methods') or ('GET',))
+        methods.add('OPTIONS')
+        return UrlRule(route['rule'], endpoint=route['endpoint'], methods=methods,
+            defaults=route.get('defaults'))
+
+    def _compile(self, nodetype):
+        urlmap = self.urlmaps[nodetype]
+        urlmap.update()
+        endpoints = {}
+        # Rules are in matching order. The first rule for an endpoint is used to build URLs
+        for rule in urlmap.iter_rules():
+            viewname, endpointname = rule.endpoint.split('/', 1)
+            endpoints.setdefault(endpointname, rule.rule)
+        self.endpoints[nodetype] = endpoints
+        return endpoints
+
+    def urlmap(self, nodetype, instrument=null_instrument):
+        """
+        Return the URL map for a nodetype, or ``None`` if there are no views
+        registered for it.
+
+        :param string nodetype: Node type to look up.
+        :param instrument: Receives ``urlmap.hit`` if the map was compiled
+            already, or ``urlmap.miss`` if it is compiled now from the rules
+            of a snapshot.
+        """
+        urlmap = self.urlmaps.get(nodetype)
+        if urlmap is not None:
+            instrument.count('urlmap.hit')
+        else:
+            specs = self._rulespecs.get(nodetype)
+            if specs is None:
+                # Another thread may have compiled it since we looked
+                urlmap = self.urlmaps.get(nodetype)
+                if urlmap is not None:
+                    instrument.count('urlmap.hit')
+                return urlmap
+            instrument.count('urlmap.miss')
+            urlmap = UrlMap(strict_slashes=False)
+            for spec in specs:
+                urlmap.add(UrlRule(spec['rule'], endpoint=spec['endpoint'],
+                    methods=spec['methods'], defaults=spec['defaults']))
+            urlmap.update()
+            # Forget the rules only once the map is visible to other threads
+            self.urlmaps[nodetype] = urlmap
+            self._rulespecs.pop(nodetype, None)
+        return urlmap
+
+    def view_nodetype(self, node, instrument=null_instrument):
+        """
+        Return the nodetype whose views render the given node, or ``None`` if
+        there are none. Candidates are tried in order: the node's
+        :attr:`~nodular.node.Node.itype`, its :attr:`~nodular.node.Node.type`,
+        then the nodetypes of its model's base classes, so that instance types
+        without views of their own use the views of their model. Results are
+        cached per instance type and model.
+
+        :param node: Node to find views for.
+        :param instrument: Receives ``nodetype.hit`` or ``nodetype.miss``
+            for the cache lookup.
+        :type node: :class:`~nodular.node.Node`
+        """
+        key = (node.itype, node.type, node.__class__)
+        try:
+            nodetype = self._nodetype_cache[key]
+        except KeyError:
+            instrument.count('nodetype.miss')
+        else:
+            instrument.count('nodetype.hit')
+            return nodetype
+        candidates = [node.itype, node.type] + [
+            cls.__type__ for cls in node.__class__.__mro__ if isclass(cls) and issubclass(cls, Node)]
+        nodetype = None
+        for candidate in candidates:
+            if candidate is not None and (candidate in self.urlmaps or candidate in self._rulespecs):
+                nodetype = candidate
+                break
+        if len(self._nodetype_cache) < NODETYPE_CACHE_SIZE:
+            self._nodetype_cache[key] = nodetype
+        return nodetype
+
+    def endpoint_rule(self, nodetype, endpointname):
+        """
+        Return the URL rule for an endpoint name, or ``None`` if the nodetype
+        has no such endpoint.
+
+        :param string nodetype: Node type to look up.
+        :param string endpointname: Name of the endpoint, without the view name.
+        """
+        endpoints = self.endpoints.get(nodetype)
+        if endpoints is None:
+            if nodetype not in self.urlmaps:
+                return None
+            endpoints = self._compile(nodetype)
+        return endpoints.get(endpointname)
+
+    def freeze(self):
+        """
+        Compile URL maps, URL building tables and allowed child nodetypes for
+        all nodetypes in one pass. Call this after all nodes and views are
+        registered. A frozen registry cannot be modified. Registries that are
+        not frozen compile each URL map when it is first used.
+        """
+        if not self.frozen:
+            for nodetype in self.urlmaps:
+                self._compile(nodetype)
+            self._compile_children()
+            self.frozen = True
+
+    def snapshot(self):
+        """
+        Return a JSON-serializable snapshot of this registry, with compiled URL
+        rules, URL building tables and dotted names for models and views. The
+        registry must be frozen.
+        """
+        if not self.frozen:
+            raise RuntimeError("Only a frozen registry can be saved as a snapshot")
+        rules = {}
+        for nodetype in set(self.urlmaps) | set(self._rulespecs):
+            if nodetype in self._rulespecs:
+                rules[nodetype] = self._rulespecs[nodetype]
+            else:
+                rules[nodetype] = [{
+                    'rule': rule.rule,
+                    'endpoint': rule.endpoint,
+                    'methods': sorted(rule.methods) if rule.methods is not None else None,
+                    'defaults': rule.defaults,
+                    } for rule in self.urlmaps[nodetype].iter_rules()]
+        return {
+            'version': SNAPSHOT_VERSION,
+            'nodes': [{
+                'nodetype': item.nodetype,
+                'model': dottedname(item.model),
+                'title': item.title,
+                } for item in self.nodes.values()],
+            'child_nodetypes': dict((nodetype, sorted(childtypes))
+                for nodetype, childtypes in self.child_nodetypes.items()),
+            'nodeviews': dict((nodetype, [v if isinstance(v, six.string_types) else dottedname(v)
+                for v in views]) for nodetype, views in self.nodeviews.items()),
+            'rules': rules,
+            'endpoints': self.endpoints,
+            }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Construct a frozen registry from a snapshot made with :meth:`snapshot`.
+        Node models are imported immediately. View classes are imported when
+        first looked up in :attr:`viewlist` and URL maps are compiled when
+        first used, so :attr:`nodeviews` lists dotted view names and
+        :attr:`urlmaps` only contains URL maps that have been used.
+
+        :param dict snapshot: Registry snapshot.
+        """
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported registry snapshot version: %r" % snapshot.get('version'))
+        registry = cls()
+        for data in snapshot['nodes']:
+            item = RegistryItem()
+            item.model = import_string(data['model'])
+            item.nodetype = data['nodetype']
+            item.title = data['title']
+            registry.nodes[item.nodetype] = item
+        for nodetype, childtypes in snapshot['child_nodetypes'].items():
+            registry.child_nodetypes[nodetype].update(childtypes)
+        for nodetype, viewnames in snapshot['nodeviews'].items():
+            registry.nodeviews[nodetype].extend(viewnames)
+            for viewname in viewnames:
+                registry.viewlist.setdefault(viewname, viewname)
+        registry._rulespecs = dict(snapshot['rules'])
+        for specs in registry._rulespecs.values():
+            for spec in specs:
+                viewname, endpointname = spec['endpoint'].split('/', 1)
+                registry.viewlist.declared[viewname].add(endpointname)
+        registry.endpoints = dict(snapshot['endpoints'])
+        registry._compile_children()
+        registry.frozen = True
+        return registry
+
+    def dump(self, fp):
+        """
+        Write a snapshot of this registry as JSON to a file.
+
+        :param fp: File-like object opened for writing.
+        """
+        json.dump(self.snapshot(), fp, sort_keys=True)
+
+    @classmethod
+    def load(cls, fp):
+        """
+        Load a registry from a JSON snapshot written by :meth:`dump`.
+
+        :param fp: File-like object opened for reading.
+        """
+        return cls.from_snapshot(json.load(fp))
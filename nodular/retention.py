@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pruning of old revisions for :class:`~nodular.revisioned.RevisionedNodeMixin`
+models. A :class:`RetentionPolicy` decides which revisions of a node to keep
+and :func:`prune_revisions` removes the rest::
+
+    from datetime import timedelta
+    from nodular import RetentionPolicy, prune_revisions
+
+    policy = RetentionPolicy(keep_last=20, keep_within=timedelta(days=30),
+        daily_after=timedelta(days=30))
+    report = prune_revisions(MyDocument, policy)
+
+Labelled revisions and revisions that no other revision is based on (the
+latest revision of each line of edits) are always kept. Kept revisions whose
+previous revision is removed are linked to their nearest kept ancestor.
+
+:func:`prune_revisions` commits as it goes, in short transactions, so that it
+can run while editors are at work. Revisions that are labelled or revised
+while it runs are left in place and counted as skipped.
+"""
+
+from datetime import datetime
+from sqlalchemy import select, func, String, LargeBinary
+from sqlalchemy.exc import IntegrityError
+
+from .db import db
+from .revisioned import _delta_values
+
+__all__ = ['RetentionPolicy', 'PruneReport', 'prune_revisions']
+
+
+class RetentionPolicy(object):
+    """
+    Rules for which revisions of a node to keep. A revision is kept if any
+    rule keeps it.
+
+    :param int keep_last: Keep this many of the most recent revisions.
+    :param keep_within: Keep all revisions made within this period.
+    :type keep_within: :class:`~datetime.timedelta`
+    :param daily_after: For revisions older than this, keep the most recent
+        revision of each day.
+    :type daily_after: :class:`~datetime.timedelta`
+    :param bool keep_labeled: Keep revisions with a workflow label (default
+        ``True``).
+    """
+    def __init__(self, keep_last=None, keep_within=None, daily_after=None, keep_labeled=True):
+        self.keep_last = keep_last
+        self.keep_within = keep_within
+        self.daily_after = daily_after
+        self.keep_labeled = keep_labeled
+
+    def keep(self, revisions, now):
+        """
+        Return the set of ids of revisions to keep.
+
+        :param revisions: Rows with ``id``, ``created_at`` and ``workflow_label``.
+        :param now: Current time, as a naive UTC datetime.
+        """
+        revisions = sorted(revisions, key=lambda r: (r.created_at, r.id), reverse=True)
+        keep = set()
+        if self.keep_labeled:
+            keep.update(r.id for r in revisions if r.workflow_label is not None)
+        if self.keep_last:
+            keep.update(r.id for r in revisions[:self.keep_last])
+        if self.keep_within is not None:
+            keep.update(r.id for r in revisions if r.created_at >= now - self.keep_within)
+        if self.daily_after is not None:
+            days = set()
+            for r in revisions:
+                if r.created_at < now - self.daily_after and r.created_at.date() not in days:
+                    days.add(r.created_at.date())
+                    keep.add(r.id)
+        return keep
+
+
+class PruneReport(object):
+    """Summary of a :func:`prune_revisions` run."""
+    def __init__(self):
+        #: Number of nodes examined
+        self.nodes = 0
+        #: Number of revisions examined
+        self.revisions = 0
+        #: Number of revisions deleted
+        self.deleted = 0
+        #: Number of kept revisions linked to a new previous revision
+        self.relinked = 0
+        #: Number of revisions that were to be deleted, but changed while pruning
+        self.skipped = 0
+        #: Approximate space reclaimed, as the length of text and binary columns
+        self.reclaimed = 0
+
+    def as_dict(self):
+        return {
+            'nodes': self.nodes,
+            'revisions': self.revisions,
+            'deleted': self.deleted,
+            'relinked': self.relinked,
+            'skipped': self.skipped,
+            'reclaimed': self.reclaimed,
+            }
+
+
+def _size(table, condition):
+    """Total length of text and binary columns in matching rows"""
+    columns = [c for c in table.c if isinstance(c.type, (String, LargeBinary))]
+    if not columns:
+        return 0
+    total = sum(func.coalesce(func.length(c), 0) for c in columns)
+    return db.session.execute(select([func.coalesce(func.sum(total), 0)]).where(condition)).scalar()
+
+
+def _prune_node(revmodel, node_id, policy, batch_size, now, report):
+    table = revmodel.__table__
+    rows = db.session.execute(select([table.c.id, table.c.previous_id, table.c.created_at,
+        table.c.workflow_label]).where(table.c.node_id == node_id)).fetchall()
+    report.nodes += 1
+    report.revisions += len(rows)
+
+    previous = dict((r.id, r.previous_id) for r in rows)
+    based = set(r.previous_id for r in rows if r.previous_id is not None)
+    # Revisions that others are not based on are always kept
+    keep = policy.keep(rows, now) | (set(previous) - based)
+    delete = set(previous) - keep
+    if not delete:
+        return
+
+    # Link kept revisions to their nearest kept ancestor before deleting
+    delta = getattr(revmodel, '__delta_columns__', None)
+    relink = []
+    for revid in keep:
+        ancestor = previous[revid]
+        while ancestor in delete:
+            ancestor = previous.get(ancestor)
+        if ancestor != previous[revid]:
+            relink.append((revid, ancestor))
+    for revid, ancestor in relink:
+        values = {'previous_id': ancestor}
+        if delta:
+            # Diffs against a deleted revision can't be decoded, so store a full copy
+            before = _size(table, table.c.id == revid)
+            values.update(_delta_values(db.session.connection(), revmodel, revid))
+            values['delta_depth'] = 0
+        db.session.execute(table.update().where(table.c.id == revid).values(**values))
+        if delta:
+            report.reclaimed -= _size(table, table.c.id == revid) - before
+    db.session.commit()
+    report.relinked += len(relink)
+
+    # Delete the newest revisions first, so that each batch only refers to
+    # revisions that remain
+    delete = sorted(delete, reverse=True)
+    for index in range(0, len(delete), batch_size):
+        batch = delete[index:index + batch_size]
+        # Don't delete revisions that were labelled since we looked
+        condition = table.c.id.in_(batch) & (table.c.workflow_label == None)  # NOQA
+        try:
+            size = _size(table, condition)
+            deleted = db.session.execute(table.delete().where(condition)).rowcount
+            db.session.commit()
+        except IntegrityError:
+            # A new revision is based on one of these
+            db.session.rollback()
+            report.skipped += len(batch)
+        else:
+            report.deleted += deleted
+            report.skipped += len(batch) - deleted
+            report.reclaimed += size
+
+
+def prune_revisions(model, policy, batch_size=500, now=None):
+    """
+    Delete revisions of all nodes of a revisioned model that the retention
+    policy does not keep, one node at a time, committing after each batch of
+    at most ``batch_size`` deletions.
+
+    :param model: Node model using :class:`~nodular.revisioned.RevisionedNodeMixin`.
+    :param policy: Retention policy to apply.
+    :type policy: :class:`RetentionPolicy`
+    :param int batch_size: Maximum number of revisions to delete in a transaction.
+    :param now: Time to apply the policy at (defaults to the current UTC time).
+    :returns: :class:`PruneReport`
+    """
+    if now is None:
+        now = datetime.utcnow()
+    revmodel = model.__revision_model__
+    table = revmodel.__table__
+    report = PruneReport()
+    last = None
+    while True:
+        query = select([table.c.node_id]).group_by(table.c.node_id).order_by(table.c.node_id).limit(batch_size)
+        if last is not None:
+            query = query.where(table.c.node_id > last)
+        node_ids = [r[0] for r in db.session.execute(query)]
+        db.session.commit()
+        if not node_ids:
+            break
+        for node_id in node_ids:
+            _prune_node(revmodel, node_id, policy, batch_size, now, report)
+        last = node_ids[-1]
+    return report
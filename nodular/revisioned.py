@@ -7,14 +7,359 @@ content.
 
 __all__ = ['RevisionedNodeMixin']
 
+import json
+import hashlib
+from difflib import SequenceMatcher
+import six
 from werkzeug.utils import cached_property
-from sqlalchemy import Column, ForeignKey, UniqueConstraint, Unicode
+from sqlalchemy import (Column, ForeignKey, UniqueConstraint, Index, Unicode, String, Integer, inspect,
+    event, select, literal, literal_column, desc, func, case, null)
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, mapper, defer
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
 from coaster.sqlalchemy import BaseMixin
 
-from .db import db
-from .node import NodeMixin, ProxyDict
+from .db import db, read_replica
+from .node import Node, NodeMixin, ProxyDict
+
+#: Maximum number of ids in a single workflow label UPDATE statement
+#: (keeps the number of bound parameters within database limits)
+LABEL_BATCH_SIZE = 400
+
+
+def _batches(items):
+    items = list(items)
+    for index in range(0, len(items), LABEL_BATCH_SIZE):
+        yield items[index:index + LABEL_BATCH_SIZE]
+
+
+def _ident(instance):
+    """Primary key of an instance, without loading it if expired."""
+    state = inspect(instance)
+    if state.key is not None:
+        return state.key[1][0]
+    return instance.id
+
+
+def _label_in_sync(revision):
+    """Check if a revision's workflow label matches its database row."""
+    state = inspect(revision)
+    return state.persistent and not state.attrs.workflow_label.history.has_changes()
+
+
+def _set_label(revision, workflow_label):
+    """
+    Update a revision's workflow label in the session after the database row
+    was updated directly, without marking it as modified.
+    """
+    if _label_in_sync(revision):
+        set_committed_value(revision, 'workflow_label', workflow_label)
+        # The database set a new timestamp
+        db.session.expire(revision, ['updated_at'])
+    else:
+        revision.workflow_label = workflow_label
+
+
+def _forget_label(node, workflow_label):
+    """Forget a node's primed revision for a label that is being moved."""
+    proxy = node.__dict__.get('workflow_revision')
+    if proxy is not None:
+        proxy.forget(workflow_label)
+
+
+def _label_node(revision):
+    """Return a revision's node if it is in the session, without loading the node."""
+    state = inspect(revision)
+    node = state.dict.get('node')
+    if node is None and state.session is not None:
+        node_id = revision.node_id
+        if node_id is not None:
+            node = state.session.identity_map.get(identity_key(revision.__parent_model__, node_id))
+    return node
+
+
+def _label_set(target, value, oldvalue, initiator):
+    """Forget the primed revision for a label that a revision is given."""
+    node = _label_node(target)
+    if value is not None and node is not None:
+        _forget_label(node, value)
+
+
+def _node_set(target, value, oldvalue, initiator):
+    """Forget the primed revision for the label of a revision added to a node."""
+    workflow_label = inspect(target).dict.get('workflow_label')
+    if value is not None and workflow_label is not None:
+        _forget_label(value, workflow_label)
+
+
+def _clear_workflow_labels(revmodel, nodes, workflow_label, exclude=(), node_ids=()):
+    """
+    Remove a workflow label from all revisions of the given nodes (or node
+    ids), except those in ``exclude``, with UPDATE statements instead of a
+    session flush, so that the label can be assigned to another revision
+    without violating the ``(node_id, workflow_label)`` unique constraint
+    when the session is flushed. Revisions in the session are updated to match.
+    """
+    node_ids = (set(node_ids) | set(_ident(node) for node in nodes)) - set([None])
+    exclude_ids = [_ident(r) for r in exclude if _ident(r) is not None]
+    table = revmodel.__table__
+    for batch in _batches(node_ids):
+        statement = table.update().where(
+            (table.c.node_id.in_(batch)) & (table.c.workflow_label == workflow_label))
+        if exclude_ids:
+            statement = statement.where(~table.c.id.in_(exclude_ids))
+        db.session.execute(statement.values(workflow_label=None))
+
+    nodes = set(nodes)
+    exclude = set(exclude)
+    session = db.session()
+    for revision in list(session.identity_map.values()) + list(session.new):
+        if isinstance(revision, revmodel) and revision not in exclude:
+            # Look at loaded values only. Unloaded labels will be loaded from
+            # the updated rows
+            values = inspect(revision).dict
+            if values.get('workflow_label') != workflow_label:
+                continue
+            node = values.get('node')
+            if node is not None:
+                matches = node in nodes or _ident(node) in node_ids
+            else:
+                # Loads node_id if this revision was expired
+                matches = revision.node_id in node_ids
+            if matches:
+                _set_label(revision, None)
+
+
+#: Default number of revisions between full copies of delta-stored columns
+DELTA_INTERVAL = 20
+
+
+def _lines(text):
+    return text.splitlines(True) if text else []
+
+
+def delta_encode(old, new):
+    """
+    Return a line-based diff that turns text ``old`` into ``new``, as a list
+    of ``["=", start, end]`` (copy lines ``start:end`` of ``old``, where an
+    ``end`` of ``null`` copies the rest) and ``["+", text]`` (insert text)
+    operations.
+    """
+    oldlines = _lines(old)
+    newlines = _lines(new)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, oldlines, newlines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append(['=', i1, i2])
+        elif tag in ('replace', 'insert'):
+            ops.append(['+', u''.join(newlines[j1:j2])])
+    return ops
+
+
+def delta_decode(old, ops):
+    """Apply a diff made by :func:`delta_encode` to text ``old``."""
+    oldlines = _lines(old)
+    return u''.join(u''.join(oldlines[op[1]:op[2]]) if op[0] == '=' else op[1] for op in ops)
+
+
+#: Stored diff that copies the previous revision's text unchanged
+DELTA_UNCHANGED = json.dumps([['=', 0, None]], separators=(',', ':'))
+
+
+def _delta_detach(connection, target):
+    """
+    Store the revisions that are diffs against a revision in full, so that
+    they keep their content when the revision is edited in place.
+    """
+    revmodel = type(target)
+    table = revmodel.__table__
+    state = inspect(target)
+    revision_id = state.key[1][0]
+    rows = connection.execute(select([table.c.id]).where(
+        (table.c.previous_id == revision_id) & (table.c.delta_depth > 0))).fetchall()
+    for dependent_id, in rows:
+        # Diffs are decoded against the revision's text as stored, before this update
+        values = _delta_values(connection, revmodel, dependent_id)
+        connection.execute(table.update().where(table.c.id == dependent_id).values(
+            delta_depth=0, updated_at=table.c.updated_at, **values))
+        dependent = state.session.identity_map.get(identity_key(revmodel, dependent_id))
+        if dependent is not None and not inspect(dependent).attrs.delta_depth.history.has_changes():
+            set_committed_value(dependent, 'delta_depth', 0)
+
+
+def _delta_before_write(mapper, connection, target):
+    """Encode delta columns against the previous revision before they are written."""
+    columns = target.__delta_columns__
+    state = inspect(target)
+    if state.persistent:
+        if not any(state.attrs[c].history.has_changes() for c in columns):
+            return
+        _delta_detach(connection, target)
+    values = dict((c, getattr(target, c)) for c in columns)
+    previous = target.previous
+    interval = getattr(target, '__delta_interval__', DELTA_INTERVAL)
+    depth = 0
+    if previous is not None and previous.delta_depth + 1 < interval:
+        encoded = dict((c, None if values[c] is None else json.dumps(
+            delta_encode(getattr(previous, c), values[c]), separators=(',', ':'))) for c in columns)
+        # Use a full copy if the diffs are no smaller
+        if sum(len(v or u'') for v in encoded.values()) < sum(len(v or u'') for v in values.values()):
+            depth = previous.delta_depth + 1
+            for c in columns:
+                setattr(target, c, encoded[c])
+    target.delta_depth = depth
+    target._delta_values = values
+
+
+def _delta_after_write(mapper, connection, target):
+    """Restore full text after the diffs have been written."""
+    values = target.__dict__.pop('_delta_values', None)
+    if values:
+        for c, value in values.items():
+            set_committed_value(target, c, value)
+
+
+def _revision_chain(revmodel, revision_id, columns=(), limit=None, follow=None):
+    """
+    Return a SELECT for the chain of revisions from ``revision_id`` back along
+    ``previous_id``, using a recursive query. Rows have ``id``, ``previous_id``,
+    ``level`` (0 for the given revision, 1 for its previous, and so on) and
+    the given columns.
+
+    :param int limit: Maximum number of revisions to return.
+    :param follow: Function that is given the chain and returns a condition
+        that must be true of a revision for the chain to continue past it.
+    """
+    table = revmodel.__table__
+    cols = [table.c.id, table.c.previous_id] + [table.c[c] for c in columns if c not in ('id', 'previous_id')]
+    chain = select(cols + [literal_column('0').label('level')]).where(
+        table.c.id == revision_id).cte('revision_chain', recursive=True)
+    condition = table.c.id == chain.c.previous_id
+    if limit is not None:
+        condition = condition & (chain.c.level < limit - 1)
+    if follow is not None:
+        condition = condition & follow(chain)
+    chain = chain.union_all(select(cols + [(chain.c.level + 1).label('level')]).where(condition))
+    return select([chain])
+
+
+def _delta_values(connection, revmodel, revision_id):
+    """
+    Return a dictionary of the full text of a revision's delta columns, using
+    one query for the revisions back to the nearest full copy.
+    """
+    columns = revmodel.__delta_columns__
+    rows = connection.execute(_revision_chain(revmodel, revision_id,
+        ['delta_depth'] + list(columns), follow=lambda chain: chain.c.delta_depth > 0
+        ).order_by(desc('level'))).fetchall()
+    values = dict((c, rows[0][c]) for c in columns)
+    for row in rows[1:]:
+        for c in columns:
+            if row[c] is not None:
+                values[c] = delta_decode(values[c], json.loads(row[c]))
+            else:
+                values[c] = None
+    return values
+
+
+def _delta_load(target, context, attrs=None):
+    """Rebuild full text for delta columns after they are loaded."""
+    columns = target.__delta_columns__
+    state = inspect(target)
+    if attrs is not None and not set(attrs) & set(columns):
+        return
+    if state.dict.get('delta_depth') == 0 or not set(columns) & set(state.dict):
+        return
+    revmodel = type(target)
+    session = context.session
+    # If the previous revision is in the session with full text, such as when
+    # loading a revision history in order, apply this revision's diffs to it
+    previous_id = state.dict.get('previous_id')
+    if state.dict.get('delta_depth') and previous_id is not None:
+        previous = session.identity_map.get(identity_key(revmodel, previous_id))
+        if previous is not None:
+            values = inspect(previous).dict
+            if all(c in values for c in columns) and not any(
+                    inspect(previous).attrs[c].history.has_changes() for c in columns):
+                for c in columns:
+                    if c in state.dict:
+                        raw = state.dict[c]
+                        set_committed_value(target, c, None if raw is None else delta_decode(
+                            values[c], json.loads(raw)))
+                return
+    # Otherwise walk back along previous_id to the nearest full copy in one query
+    values = _delta_values(session.connection(), revmodel, state.key[1][0])
+    for c in columns:
+        if c in state.dict:
+            set_committed_value(target, c, values[c])
+
+
+def content_fingerprint(revmodel, values):
+    """
+    Return a fingerprint (SHA-1 hex digest) of the values of a revision
+    model's ``__fingerprint_columns__``, given as a dictionary.
+    """
+    data = json.dumps([values.get(c) for c in revmodel.__fingerprint_columns__],
+        separators=(',', ':'), default=six.text_type)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _fingerprint_values(revision):
+    """
+    Return the values of a revision's fingerprinted columns, with the scalar
+    defaults of unset columns in revisions that have not been saved yet.
+    """
+    values = {}
+    state = inspect(revision)
+    for c in revision.__fingerprint_columns__:
+        value = getattr(revision, c)
+        if value is None and not state.persistent:
+            default = getattr(type(revision), c).property.columns[0].default
+            if default is not None and default.is_scalar:
+                value = default.arg
+        values[c] = value
+    return values
+
+
+def _revision_fingerprint(revision):
+    """
+    Return the fingerprint of a revision: the stored one if its content has
+    not changed since it was saved, or one made from its values.
+    """
+    state = inspect(revision)
+    if state.persistent and revision.fingerprint is not None and not any(
+            state.attrs[c].history.has_changes() for c in revision.__fingerprint_columns__):
+        return revision.fingerprint
+    return content_fingerprint(type(revision), _fingerprint_values(revision))
+
+
+def _fingerprint_before_write(mapper, connection, target):
+    """Update the fingerprint column when fingerprinted columns change."""
+    columns = target.__fingerprint_columns__
+    state = inspect(target)
+    if state.persistent and not any(state.attrs[c].history.has_changes() for c in columns):
+        return
+    target.fingerprint = content_fingerprint(type(target), _fingerprint_values(target))
+
+
+@event.listens_for(mapper, 'mapper_configured')
+def _revision_mapper_listener(mapper, class_):
+    if not hasattr(class_, '__parent_model__'):
+        return
+    event.listen(class_.workflow_label, 'set', _label_set)
+    event.listen(class_.node, 'set', _node_set)
+    # Fingerprints are made from full text, before delta columns are encoded
+    if getattr(class_, '__fingerprint_columns__', None):
+        event.listen(class_, 'before_insert', _fingerprint_before_write)
+        event.listen(class_, 'before_update', _fingerprint_before_write)
+    if getattr(class_, '__delta_columns__', None):
+        event.listen(class_, 'before_insert', _delta_before_write)
+        event.listen(class_, 'before_update', _delta_before_write)
+        event.listen(class_, 'after_insert', _delta_after_write)
+        event.listen(class_, 'after_update', _delta_after_write)
+        event.listen(class_, 'load', _delta_load)
+        event.listen(class_, 'refresh', _delta_load)
 
 
 class RevisionedNodeMixin(NodeMixin):
@@ -24,7 +369,13 @@ class RevisionedNodeMixin(NodeMixin):
     simultaneously active versions (each with a label) or archived versions
     (label=None).
 
-    Revisions are stored as distinct table rows with full content, not as diffs.
+    Revisions are stored as distinct table rows with full content, not as diffs,
+    unless the revision model opts into delta storage (see below).
+
+    Workflow labels are moved between revisions with UPDATE statements issued
+    right away, so they never clash with the ``(node_id, workflow_label)``
+    unique constraint when the session is flushed.
+
     All columns that need revisioning must be in the :class:`RevisionMixin`
     model, not in the :class:`RevisionedNodeMixin` model. Usage::
 
@@ -36,6 +387,35 @@ class RevisionedNodeMixin(NodeMixin):
             # __tablename__ is auto-generated
             content = db.Column(db.UnicodeText)
             ...
+
+    Text columns listed in ``__delta_columns__`` on the revision model are
+    stored as line-based diffs against the previous revision, with a full
+    copy every ``__delta_interval__`` revisions (default 20) and whenever a
+    diff would not be smaller. The model gains a ``delta_depth`` column, and
+    loading a revision costs one extra query over at most
+    ``__delta_interval__`` rows. Attribute values are always the full text.
+    Editing a revision in place stores the revisions made from it in full::
+
+        class MyDocumentRevision(MyDocument.RevisionMixin, db.Model):
+            __delta_columns__ = ('content',)
+            __delta_interval__ = 20
+            content = db.Column(db.UnicodeText)
+
+    Revision models can list columns in ``__fingerprint_columns__`` to gain
+    an indexed ``fingerprint`` column, a hash of those columns that is
+    updated when the revision is saved. :meth:`revise` then returns the
+    given revision instead of an identical copy when the content passed to
+    it has not changed, and :meth:`revision_with_content` finds an earlier
+    revision with the same content::
+
+        class MyDocumentRevision(MyDocument.RevisionMixin, db.Model):
+            __fingerprint_columns__ = ('title', 'content')
+            title = db.Column(db.Unicode(250))
+            content = db.Column(db.UnicodeText)
+
+        revision = document.revise(revision, title=title, content=content)
+
+    Revisions that later revisions are based on must not be modified.
     """
 
     #: Current primary revision for web publishing (to regular unauthenticated users)
@@ -80,7 +460,7 @@ class RevisionedNodeMixin(NodeMixin):
                 Link back to node
                 """
                 parentclass.workflow_revision = cached_property(lambda self: ProxyDict(
-                    self, 'revisions', cls, 'workflow_label', 'node'))
+                    self, 'revisions', cls, 'workflow_label', 'node'), name='workflow_revision')
                 return relationship(parentclass, backref=backref('revisions', lazy='dynamic', cascade='all, delete-orphan'))
 
             @declared_attr
@@ -112,11 +492,33 @@ class RevisionedNodeMixin(NodeMixin):
                 """
                 return relationship(cls,
                     primaryjoin=cls.__name__ + '.previous_id == ' + cls.__name__ + '.id',
+                    remote_side=cls.__name__ + '.id',
                     uselist=False)
 
+            @declared_attr
+            def delta_depth(cls):
+                """
+                Number of revisions since the last full copy of the
+                ``__delta_columns__``, if the model uses delta storage.
+                """
+                if getattr(cls, '__delta_columns__', None):
+                    return Column(Integer, nullable=False, default=0)
+
+            @declared_attr
+            def fingerprint(cls):
+                """
+                Fingerprint of the ``__fingerprint_columns__``, if the model
+                lists any.
+                """
+                if getattr(cls, '__fingerprint_columns__', None):
+                    return Column(String(40), nullable=True)
+
             @declared_attr
             def __table_args__(cls):
-                return (UniqueConstraint('node_id', 'workflow_label'),)
+                args = (UniqueConstraint('node_id', 'workflow_label'),)
+                if getattr(cls, '__fingerprint_columns__', None):
+                    args += (Index('ix_' + cls.__tablename__ + '_fingerprint', 'node_id', 'fingerprint'),)
+                return args
 
             def copy(self):
                 """
@@ -132,20 +534,48 @@ class RevisionedNodeMixin(NodeMixin):
 
         return RevisionMixin
 
-    def revise(self, revision=None, user=None, workflow_label=None):
+    def revise(self, revision=None, user=None, workflow_label=None, **content):
         """
         Clone the given revision or make a new blank revision.
 
+        Content for the new revision may be given as keyword arguments. If
+        the revision model has ``__fingerprint_columns__``, the given
+        revision's content with the new content applied has the same
+        fingerprint as the given revision, and any other columns given are
+        unchanged, no new revision is made and the given revision is returned
+        instead (with the workflow label, if one is given).
+
         :returns: New revision object
         """
+        revmodel = self.__revision_model__
+        if not (content and revision is not None and getattr(revmodel, '__fingerprint_columns__', None)):
+            newrevision = self._revise(revision, user, workflow_label)
+            for key, value in content.items():
+                setattr(newrevision, key, value)
+            return newrevision
+
+        # Fingerprint the content the new revision would have, without making it
+        values = _fingerprint_values(revision)
+        values.update((key, value) for key, value in content.items() if key in revmodel.__fingerprint_columns__)
+        unchanged = content_fingerprint(revmodel, values) == _revision_fingerprint(revision) and all(
+            getattr(revision, key) == value for key, value in content.items()
+            if key not in revmodel.__fingerprint_columns__)
+        if not unchanged:
+            newrevision = self._revise(revision, user, workflow_label)
+            for key, value in content.items():
+                setattr(newrevision, key, value)
+            return newrevision
+        if workflow_label is not None and revision.workflow_label != workflow_label:
+            self.set_workflow_label(revision, workflow_label)
+        return revision
+
+    def _revise(self, revision, user, workflow_label):
         if workflow_label is not None:
-            rev = self.workflow_revision.get(workflow_label)
-            if rev is not None:
-                rev.workflow_label = None
-                # We have to flush here or the SQL UPDATE statement
-                # for the above line gets called *after* the INSERT statement
-                # for the new revision below, resulting in an IntegrityError
-                db.session.flush()
+            # Remove the label from the current revision in the database right
+            # away, or the INSERT statement for the new revision below may
+            # be issued first, resulting in an IntegrityError
+            _clear_workflow_labels(self.__revision_model__, [self], workflow_label)
+            _forget_label(self, workflow_label)
         if revision is not None:
             assert isinstance(revision, self.__revision_model__)
             newrevision = revision.copy()
@@ -160,7 +590,232 @@ class RevisionedNodeMixin(NodeMixin):
         Set the workflow label for the given revision.
         """
         if workflow_label is not None:
-            rev = self.workflow_revision.get(workflow_label)
-            if rev is not None:
-                rev.workflow_label = None
+            _clear_workflow_labels(self.__revision_model__, [self], workflow_label, exclude=[revision])
+            _forget_label(self, workflow_label)
         revision.workflow_label = workflow_label
+
+    def revision_with_content(self, **content):
+        """
+        Return the most recent revision of this node with the given content
+        in its ``__fingerprint_columns__``, or ``None``. The lookup uses the
+        index on the fingerprint column.
+        """
+        revmodel = self.__revision_model__
+        return revmodel.query.filter_by(node_id=self.id,
+            fingerprint=content_fingerprint(revmodel, content)).order_by(revmodel.id.desc()).first()
+
+    @classmethod
+    def set_workflow_labels(cls, revisions, workflow_label):
+        """
+        Set the workflow label for many revisions at once, such as when
+        publishing several documents together. Revisions must belong to
+        different nodes. The label is removed from other revisions of the
+        same nodes and assigned with one UPDATE statement each (per batch of
+        revisions), without flushing the session.
+
+        :param revisions: Revisions to label.
+        :param string workflow_label: Label to set.
+        """
+        revisions = list(revisions)
+        if workflow_label is not None:
+            nodes = []
+            node_ids = []
+            for revision in revisions:
+                # Avoid loading nodes when the revision has a node id
+                node_id = inspect(revision).dict.get('node_id')
+                if node_id is not None:
+                    node_ids.append(node_id)
+                else:
+                    nodes.append(revision.node)
+            _clear_workflow_labels(cls.__revision_model__, nodes, workflow_label,
+                exclude=revisions, node_ids=node_ids)
+            for node in nodes:
+                _forget_label(node, workflow_label)
+            for node_id in node_ids:
+                node = db.session.identity_map.get(identity_key(cls, node_id))
+                if node is not None:
+                    _forget_label(node, workflow_label)
+        table = cls.__revision_model__.__table__
+        updated = []
+        for revision in revisions:
+            if _label_in_sync(revision):
+                updated.append(revision)
+            else:
+                revision.workflow_label = workflow_label
+        for batch in _batches(updated):
+            db.session.execute(table.update().where(table.c.id.in_([_ident(r) for r in batch])).values(
+                workflow_label=workflow_label))
+            for revision in batch:
+                _set_label(revision, workflow_label)
+
+    @classmethod
+    def load_revisions(cls, nodes, workflow_label):
+        """
+        Load the revisions with a workflow label for many nodes at once,
+        with one query per batch of nodes, and prime each node's
+        ``workflow_revision`` so that ``node.workflow_revision[label]``
+        does not query the database again::
+
+            MyDocument.load_revisions(documents, u'published')
+            for document in documents:
+                print(document.workflow_revision.get(u'published'))
+
+        :param nodes: Nodes to load revisions for.
+        :param string workflow_label: Label of the revisions to load.
+        :returns: List of revisions in the order of the nodes, with ``None``
+            for nodes that have no revision with the label.
+        """
+        revmodel = cls.__revision_model__
+        nodes = list(nodes)
+        found = {}
+        for batch in _batches(nodes):
+            with read_replica():
+                rows = revmodel.query.filter(
+                    revmodel.node_id.in_([_ident(node) for node in batch]),
+                    revmodel.workflow_label == workflow_label).all()
+            for revision in rows:
+                found[revision.node_id] = revision
+        revisions = []
+        for node in nodes:
+            revision = found.get(_ident(node))
+            if revision is not None:
+                set_committed_value(revision, 'node', node)
+            node.workflow_revision.prime(workflow_label, revision)
+            revisions.append(revision)
+        return revisions
+
+    @classmethod
+    def promote_subtree(cls, node, source_label, target_label, copy=True, user=None, dry_run=False):
+        """
+        Give the revision labelled ``source_label`` of every node of this
+        model in the subtree under (and including) ``node`` the label
+        ``target_label``, with set-based statements, such as to publish the
+        drafts of a whole section at once::
+
+            counts = MyDocument.promote_subtree(section, u'draft', u'published')
+
+        The label is first removed from revisions that have it. If ``copy``
+        is true (the default), each source revision is copied to a new
+        revision that gets the target label and the source revision keeps
+        its label. Otherwise the source revision is relabelled. Copies follow
+        their source revision in :attr:`previous`. With delta storage they
+        are stored as unchanged diffs against it, or as full copies where a
+        diff would exceed the model's ``__delta_interval__``.
+
+        Statements are issued in the session's transaction, which the caller
+        must commit. Pending changes are flushed first, and loaded revisions
+        have their labels expired.
+
+        :param node: Root of the subtree.
+        :param string source_label: Label of the revisions to promote.
+        :param string target_label: Label to give them.
+        :param bool copy: Copy revisions instead of relabelling them.
+        :param user: User to record as the maker of copies (default: the
+            maker of the source revision).
+        :param bool dry_run: Only count the revisions that would change.
+        :returns: Dictionary with counts of ``revisions`` with the source
+            label, ``unlabelled`` revisions that lose the target label,
+            and ``copied`` or ``relabelled`` revisions.
+        """
+        if source_label == target_label:
+            raise ValueError("Source and target labels are the same")
+        revmodel = cls.__revision_model__
+        table = revmodel.__table__
+        session = db.session
+        session.flush()
+        subtree = select([Node.__table__.c.id]).where(node._subtree_clause())
+        sources = (table.c.node_id.in_(subtree)) & (table.c.workflow_label == source_label)
+        # Nodes that have a revision with the source label
+        promoted = select([table.c.node_id]).where(sources)
+        targets = (table.c.node_id.in_(promoted)) & (table.c.workflow_label == target_label)
+
+        counts = {
+            'revisions': session.execute(select([func.count()]).where(sources)).scalar(),
+            'unlabelled': session.execute(select([func.count()]).where(targets)).scalar(),
+            'copied': 0,
+            'relabelled': 0,
+            }
+        counts['copied' if copy else 'relabelled'] = counts['revisions']
+        if dry_run or not counts['revisions']:
+            return counts
+
+        session.execute(table.update().where(targets).values(workflow_label=None))
+        if copy:
+            overrides = {
+                'workflow_label': literal(target_label, Unicode),
+                'previous_id': table.c.id,
+                }
+            if user is not None:
+                overrides['user_id'] = literal(user.id)
+            names = [c.name for c in table.c if c.name not in ('id', 'created_at', 'updated_at')]
+
+            def copy_revisions(condition, **values):
+                columns = dict(overrides, **values)
+                session.execute(table.insert().from_select(names, select(
+                    [columns[name].label(name) if name in columns else table.c[name] for name in names]
+                    ).where(condition)))
+
+            delta_columns = getattr(revmodel, '__delta_columns__', None)
+            if delta_columns:
+                interval = getattr(revmodel, '__delta_interval__', DELTA_INTERVAL)
+                shallow = table.c.delta_depth + 1 < interval
+                copy_revisions(sources & shallow, delta_depth=table.c.delta_depth + 1, **dict(
+                    (c, case([(table.c[c] == None, null())], else_=literal(DELTA_UNCHANGED, table.c[c].type)))  # NOQA
+                    for c in delta_columns))
+                # Sources at the end of a chain of diffs are copied in full
+                for revision_id, in session.execute(select([table.c.id]).where(sources & ~shallow)).fetchall():
+                    values = _delta_values(session.connection(), revmodel, revision_id)
+                    copy_revisions(table.c.id == revision_id, delta_depth=literal(0), **dict(
+                        (c, literal(values[c], table.c[c].type)) for c in delta_columns))
+            else:
+                copy_revisions(sources)
+        else:
+            session.execute(table.update().where(sources).values(workflow_label=target_label))
+
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, revmodel):
+                session.expire(obj, ['workflow_label'])
+            elif isinstance(obj, cls):
+                _forget_label(obj, source_label)
+                _forget_label(obj, target_label)
+        return counts
+
+    def history(self, revision, limit=None, columns=()):
+        """
+        Return the history of a revision, following :attr:`previous` links
+        with a single recursive query. Rows are lightweight tuples with
+        ``id``, ``previous_id``, ``level`` (0 for the given revision),
+        ``created_at``, ``user_id`` and ``workflow_label``, newest first.
+
+        :param revision: Revision (or revision id) to start from.
+        :param int limit: Maximum number of revisions to return.
+        :param columns: Names of additional columns to include, such as
+            content columns. Columns with delta storage are returned as stored.
+        """
+        revmodel = self.__revision_model__
+        if isinstance(revision, revmodel):
+            revision = _ident(revision)
+        chain = _revision_chain(revmodel, revision,
+            ['created_at', 'user_id', 'workflow_label'] + list(columns), limit=limit)
+        with read_replica():
+            return db.session.execute(chain.order_by('level')).fetchall()
+
+    def ancestry(self, revision, defer_columns=()):
+        """
+        Return the revisions leading up to and including the given revision,
+        oldest first, with a single recursive query. :attr:`previous` links
+        between them do not require further queries.
+
+        :param revision: Revision (or revision id) to start from.
+        :param defer_columns: Names of columns to load only when accessed,
+            such as large content columns.
+        """
+        revmodel = self.__revision_model__
+        if isinstance(revision, revmodel):
+            revision = _ident(revision)
+        chain = _revision_chain(revmodel, revision).alias('revision_ancestry')
+        query = revmodel.query.join(chain, revmodel.id == chain.c.id).order_by(chain.c.level.desc())
+        if defer_columns:
+            query = query.options(*[defer(c) for c in defer_columns])
+        with read_replica():
+            return query.all()
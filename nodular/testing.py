@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+Test helpers for apps built on Nodular. :class:`QueryBudget` keeps hot paths
+from quietly regressing into N+1 query patterns by failing when a block of
+code issues more SQL statements than expected::
+
+    from nodular.testing import QueryBudget
+
+    with QueryBudget(1):
+        publisher.traverse('/path/to/node')
+
+    @QueryBudget(2)
+    def test_publish(self):
+        ...
+"""
+
+import threading
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = ['QueryBudget', 'QueryBudgetExceeded']
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a :class:`QueryBudget` is exceeded. The exception message
+    lists the offending statements.
+    """
+    pass
+
+
+class QueryBudget(object):
+    """
+    Context manager and decorator that counts SQL statements issued in the
+    current thread and raises :exc:`QueryBudgetExceeded` if there are more
+    than ``budget`` of them. Statements are counted at the engine level, so
+    they include statements issued by autoflush and lazy loads.
+
+    :param int budget: Maximum number of SQL statements allowed.
+    :param string label: Description of the code under test, for the error message.
+
+    The recorded statements are available as :attr:`statements` after the block
+    completes.
+    """
+    def __init__(self, budget, label=None):
+        self.budget = budget
+        self.label = label
+        #: List of (statement, parameters) tuples issued in the block
+        self.statements = []
+        self._thread = None
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread() is self._thread:
+            self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        self.statements = []
+        self._thread = threading.current_thread()
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+        if exc_type is None and len(self.statements) > self.budget:
+            raise QueryBudgetExceeded(self.report())
+
+    @property
+    def count(self):
+        """Number of statements issued in the block."""
+        return len(self.statements)
+
+    def report(self):
+        """Describe the budget overrun along with the offending statements."""
+        lines = ["%s issued %d SQL statements, exceeding the budget of %d:" % (
+            self.label or "Code block", len(self.statements), self.budget)]
+        for counter, (statement, parameters) in enumerate(self.statements, 1):
+            lines.append("%d. %s %r" % (counter, ' '.join(statement.split()), parameters))
+        return '\n'.join(lines)
+
+    def __call__(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with self.__class__(self.budget, self.label or f.__name__):
+                return f(*args, **kwargs)
+        return decorated_function
@@ -27,15 +27,15 @@ class _NodeRoute(object):
 class _NodeViewMeta(type):
     """Metaclass for NodeView."""
     def __new__(cls, name, bases, attrs):
-        # Add a url_map to the class
-        url_map = UrlMap(strict_slashes=False)
+        # Collect route definitions, starting with those of base classes. URL rules
+        # are made from these when the view is registered or url_map is first used
+        routes = []
         # Add a collection of (unbound) view functions
         view_functions = {}
         for base in bases:
-            # Extend from url_map of base class
-            if hasattr(base, 'url_map') and isinstance(base.url_map, UrlMap):
-                for rule in base.url_map.iter_rules():
-                    url_map.add(rule.empty())
+            # Extend from routes of base class
+            if isinstance(base, _NodeViewMeta):
+                routes.extend(base.__routes__)
             # Extend from view_functions of base class
             if hasattr(base, 'view_functions') and isinstance(base.view_functions, dict):
                 view_functions.update(base.view_functions)
@@ -46,24 +46,43 @@ class _NodeViewMeta(type):
                 while isinstance(route, _NodeRoute):
                     # Save the endpoint name
                     endpoints.append(route.endpoint)
-                    # Construct the url rule
-                    url_rule = UrlRule(route.rule, endpoint=route.endpoint, methods=route.methods, defaults=route.defaults)
-                    url_rule.provide_automatic_options = True
-                    url_map.add(url_rule)
+                    # Save the route definition
+                    routes.append({'rule': route.rule, 'endpoint': route.endpoint,
+                        'methods': route.methods, 'defaults': route.defaults})
                     route = route.f
                 # Make a list of endpoints
                 for e in endpoints:
                     view_functions[e] = route
                 # Restore the original function
                 attrs[routeattr] = route
-        # Finally, update the URL map and insert it into the class
-        url_map.update()
-        attrs['url_map'] = url_map
+        # Finally, insert the routes into the class. Route definitions are shared
+        # with subclasses, which extend this tuple
+        attrs['__routes__'] = tuple(routes)
+        attrs['_url_map'] = None
         attrs['view_functions'] = view_functions
 
         return type.__new__(cls, name, bases, attrs)
 
 
+class _NodeViewUrlMap(object):
+    """
+    URL map of a view class's routes, compiled when first used and cached on
+    the class. Available on both the class and its instances.
+    """
+    def __get__(self, obj, cls):
+        url_map = cls.__dict__['_url_map']
+        if url_map is None:
+            url_map = UrlMap(strict_slashes=False)
+            for route in cls.__routes__:
+                url_rule = UrlRule(route['rule'], endpoint=route['endpoint'],
+                    methods=route['methods'], defaults=route['defaults'])
+                url_rule.provide_automatic_options = True
+                url_map.add(url_rule)
+            url_map.update()
+            cls._url_map = url_map
+        return url_map
+
+
 class NodeView(with_metaclass(_NodeViewMeta, object)):
     """
     Base class for node view handlers, to be initialized once per view render.
@@ -90,6 +109,9 @@ class NodeView(with_metaclass(_NodeViewMeta, object)):
     :param user: User that the view is being rendered for.
     :type node: :class:`~nodular.node.Node`
     """
+    #: URL map of this view's routes, compiled when first used
+    url_map = _NodeViewUrlMap()
+
     def __init__(self, node, user=None, permissions=None):
         self.node = node
         self.user = user
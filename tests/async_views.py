@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Views for the async publisher tests. ``async def`` is a syntax error before
+Python 3.5, so these are only imported on newer versions.
+"""
+
+import asyncio
+import threading
+from flask import g, request
+from sqlalchemy.orm import object_session
+from nodular import Node, NodeView, db
+
+#: Set by the ``/flag`` view, which waits for :data:`sync_done`
+flag_set = threading.Event()
+#: Set by the ``/session`` view when it is done
+sync_done = threading.Event()
+
+
+class AsyncNodeView(NodeView):
+    @NodeView.route('/')
+    async def index(self):
+        await asyncio.sleep(0)
+        return u'async-' + self.node.name
+
+    @NodeView.route('/sync')
+    def sync(self):
+        return threading.current_thread(), g.view
+
+    @NodeView.route('/restricted')
+    @NodeView.requires_permission('admin')
+    async def restricted(self):
+        await asyncio.sleep(0)
+        return u'restricted'
+
+    @NodeView.route('/session')
+    def session(self):
+        # Run while another request is in flight on the event loop
+        flag_set.wait(5)
+        try:
+            sibling = Node.query.filter_by(name=u'node2').one()
+            return {
+                'path': request.path,
+                'session': db.session(),
+                'attached': object_session(self.node) is db.session(),
+                # Lazy loads use the same session as other queries
+                'parent': self.node.parent is sibling.parent,
+                'children': self.node._nodes.count(),
+                }
+        finally:
+            sync_done.set()
+
+    @NodeView.route('/flag')
+    async def flag(self):
+        flag_set.set()
+        await asyncio.get_event_loop().run_in_executor(None, sync_done.wait, 5)
+        return {
+            'path': request.path,
+            'session': db.session(),
+            'attached': object_session(self.node) is db.session(),
+            }
+
+    @NodeView.route('/stream')
+    async def stream(self):
+        await asyncio.sleep(0)
+        return (part for part in (u'async', u'-', self.node.name))
+
+    @NodeView.route('/syncstream')
+    def syncstream(self):
+        yield u'%s in %s:' % (self.node.title, self.node.parent.title)
+        for node in self.node.iter_nodes():
+            yield u' ' + node.name
+        yield u' (%d)' % Node.query.count()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+import unittest
+from flask import Response
+from werkzeug.exceptions import Forbidden, NotFound
+from nodular import Node, NodeRegistry
+from .test_db import db, TestDatabaseFixture
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from nodular import AsyncNodePublisher
+    from . import async_views
+    from .async_views import AsyncNodeView
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "Requires Python 3.5 or above")
+class TestAsyncPublisher(TestDatabaseFixture):
+    def setUp(self):
+        super(TestAsyncPublisher, self).setUp()
+        self.registry = NodeRegistry()
+        self.registry.register_node(Node, view=AsyncNodeView)
+        self.root = Node(name=u'root', title=u'Root Node')
+        self.node1 = Node(name=u'node1', title=u'Node 1', parent=self.root)
+        self.node2 = Node(name=u'node2', title=u'Node 2', parent=self.root)
+        db.session.add_all([self.root, self.node1, self.node2])
+        db.session.commit()
+        self.publisher = AsyncNodePublisher(self.root, self.registry, u'/')
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super(TestAsyncPublisher, self).tearDown()
+
+    def publish(self, path):
+        return self.loop.run_until_complete(self.publisher.publish_async(path))
+
+    def test_async_view(self):
+        """Coroutine view functions are awaited."""
+        with self.app.test_request_context():
+            self.assertEqual(self.publish(u'/node1'), u'async-node1')
+
+    def test_sync_view(self):
+        """Regular view functions run in the executor with the view in g."""
+        node1_id = self.node1.id
+        with self.app.test_request_context():
+            thread, view = self.publish(u'/node1/sync')
+        self.assertFalse(thread is threading.current_thread())
+        self.assertTrue(isinstance(view, AsyncNodeView))
+        self.assertEqual(view.node.id, node1_id)
+
+    def test_async_stream(self):
+        """Generators returned by coroutine view functions are streamed."""
+        with self.app.test_request_context():
+            response = self.publish(u'/node1/stream')
+        self.assertTrue(isinstance(response, Response))
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.get_data(as_text=True), u'async-node1')
+        response.close()
+
+    def test_sync_stream(self):
+        """Streams from regular view functions use the call's session until the response is closed."""
+        db.session.add(Node(name=u'child', title=u'Child', parent=self.node1))
+        db.session.commit()
+        sessions = db.session.registry.registry
+        with self.app.test_request_context():
+            before = set(sessions)
+            response = self.publish(u'/node1/syncstream')
+            scopes = set(sessions) - before
+        self.assertEqual(len(scopes), 1)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.get_data(as_text=True), u'Node 1 in Root Node: child (4)')
+        self.assertTrue(scopes <= set(sessions))
+        response.close()
+        self.assertFalse(scopes & set(sessions))
+
+    def test_concurrent_requests(self):
+        """Requests in flight on one event loop have their own request context and session."""
+        async_views.flag_set.clear()
+        async_views.sync_done.clear()
+        contexts = []
+        requests = []
+        for path in (u'/node1/session', u'/node2/flag'):
+            ctx = self.app.test_request_context(path)
+            ctx.push()
+            contexts.append(ctx)
+            requests.append(self.publisher.publish_async(path))
+        try:
+            sync, coro = self.loop.run_until_complete(asyncio.gather(*requests, loop=self.loop))
+        finally:
+            for ctx in reversed(contexts):
+                ctx.pop()
+        self.assertEqual(sync['path'], u'/node1/session')
+        self.assertTrue(sync['attached'])
+        self.assertTrue(sync['parent'])
+        self.assertEqual(sync['children'], 0)
+        self.assertEqual(coro['path'], u'/node2/flag')
+        self.assertTrue(coro['attached'])
+        self.assertFalse(sync['session'] is coro['session'])
+        self.assertFalse(sync['session'] is db.session())
+
+    def test_permission(self):
+        """Permission checks work for coroutine view functions."""
+        with self.app.test_request_context():
+            self.assertRaises(Forbidden, self.publish, u'/node1/restricted')
+            self.assertEqual(self.loop.run_until_complete(
+                self.publisher.publish_async(u'/node1/restricted', permissions=set(['admin']))), u'restricted')
+
+    def test_not_found(self):
+        """Paths that don't match a view raise NotFound."""
+        with self.app.test_request_context():
+            self.assertRaises(NotFound, self.publish, u'/node1/random')
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from nodular import Node, NodeClosure
+from nodular.testing import QueryBudget
+from .test_db import db, TestDatabaseFixture
+
+
+class TestNodeClosure(TestDatabaseFixture):
+    def setUp(self):
+        super(TestNodeClosure, self).setUp()
+        NodeClosure.maintain()
+        self.root = Node(name=u'root', title=u'Root Node')
+        self.node1 = Node(name=u'node1', title=u'Node 1', parent=self.root)
+        self.node2 = Node(name=u'node2', title=u'Node 2', parent=self.node1)
+        self.node3 = Node(name=u'node3', title=u'Node 3', parent=self.node2)
+        self.node4 = Node(name=u'node4', title=u'Node 4', parent=self.root)
+        self.node1_ = Node(name=u'node1_', title=u'Node 1_', parent=self.root)
+        db.session.add(self.root)
+        db.session.commit()
+
+    def tearDown(self):
+        NodeClosure.maintain(False)
+        super(TestNodeClosure, self).tearDown()
+
+    def test_queries(self):
+        """Closure rows answer ancestor and descendant queries."""
+        self.assertEqual(set(NodeClosure.descendants(self.node1)), set([self.node2, self.node3]))
+        self.assertEqual(set(NodeClosure.descendants(self.node1, include_self=True)),
+            set([self.node1, self.node2, self.node3]))
+        self.assertEqual(set(NodeClosure.descendants(self.root, depth=1)),
+            set([self.node1, self.node4, self.node1_]))
+        self.assertEqual(NodeClosure.descendants(self.root, depth=3).all(), [self.node3])
+        self.assertEqual(NodeClosure.ancestors(self.node3).all(), [self.root, self.node1, self.node2])
+        self.assertEqual(NodeClosure.ancestors(self.node3, include_self=True).all(),
+            [self.root, self.node1, self.node2, self.node3])
+        with QueryBudget(1):
+            self.assertTrue(NodeClosure.is_under(self.node3, self.node1))
+        self.assertFalse(NodeClosure.is_under(self.node1, self.node3))
+        self.assertFalse(NodeClosure.is_under(self.node1_, self.node1))
+        self.assertFalse(NodeClosure.is_under(self.node1, self.node1))
+
+    def test_move(self):
+        """Moving a subtree relinks it to its new ancestors."""
+        self.node1.parent = self.node4
+        db.session.commit()
+        self.assertEqual(NodeClosure.ancestors(self.node3).all(), [self.root, self.node4, self.node1, self.node2])
+        self.assertEqual(set(NodeClosure.descendants(self.node4)), set([self.node1, self.node2, self.node3]))
+        self.assertEqual(NodeClosure.descendants(self.node4, depth=3).all(), [self.node3])
+        # Moves and additions in the same flush
+        node5 = Node(name=u'node5', title=u'Node 5', parent=self.node1_)
+        self.node2.parent = node5
+        node6 = Node(name=u'node6', title=u'Node 6', parent=self.node3)
+        db.session.commit()
+        self.assertEqual(NodeClosure.ancestors(node6).all(),
+            [self.root, self.node1_, node5, self.node2, self.node3])
+        self.assertEqual(NodeClosure.descendants(self.node4).all(), [self.node1])
+
+    def test_delete_rebuild(self):
+        """Deleted nodes lose their rows, and the table can be rebuilt from paths."""
+        self.assertEqual(NodeClosure.query.count(), 14)
+        self.node2.delete_subtree()
+        db.session.commit()
+        expected = set((r.ancestor_id, r.descendant_id, r.depth) for r in NodeClosure.query.all())
+        self.assertEqual(len(expected), 7)
+        self.assertEqual(set(NodeClosure.descendants(self.root)), set([self.node1, self.node4, self.node1_]))
+
+        db.session.execute(NodeClosure.__table__.delete())
+        root2 = Node(name=u'root2', title=u'Root 2')
+        db.session.add(Node(name=u'node', title=u'Node', parent=root2))
+        NodeClosure.maintain(False)
+        db.session.commit()
+        NodeClosure.rebuild()
+        db.session.commit()
+        self.assertEqual(NodeClosure.query.count(), 10)
+        self.assertTrue(expected <= set((r.ancestor_id, r.descendant_id, r.depth) for r in NodeClosure.query.all()))
+        self.assertEqual(NodeClosure.ancestors(self.node1).all(), [self.root])
+        self.assertEqual(NodeClosure.descendants(root2).one().name, u'node')
@@ -6,6 +6,7 @@ from flask import Flask
 from coaster.utils import buid
 from coaster.sqlalchemy import BaseMixin
 from nodular.db import db
+from nodular.testing import QueryBudget
 
 
 class User(BaseMixin, db.Model):
@@ -35,3 +36,7 @@ class TestDatabaseFixture(unittest.TestCase):
         db.session.rollback()
         db.drop_all()
         db.session.remove()
+
+    def assertQueryBudget(self, budget, label=None):
+        """Fail if the wrapped block issues more than ``budget`` SQL statements."""
+        return QueryBudget(budget, label)
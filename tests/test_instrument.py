@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from werkzeug.exceptions import NotFound
+from nodular import Node, NodePublisher, NodeRegistry, Instrument, InstrumentCollector, querycount
+from .test_db import db, TestDatabaseFixture
+from .test_publish_view import MyNodeView, ExpandedNodeView
+
+
+class TestInstrument(unittest.TestCase):
+    def test_callbacks(self):
+        """Instrument passes measurements to callbacks."""
+        timings = []
+        counts = []
+        instrument = Instrument(
+            timing=lambda stage, duration, queries: timings.append((stage, duration, queries)),
+            count=lambda counter, value: counts.append((counter, value)))
+        with instrument.stage('test'):
+            pass
+        instrument.count('test.hit')
+        instrument.count('test.miss', 2)
+        self.assertEqual(len(timings), 1)
+        self.assertEqual(timings[0][0], 'test')
+        self.assertTrue(timings[0][1] >= 0)
+        self.assertEqual(timings[0][2], 0)
+        self.assertEqual(counts, [('test.hit', 1), ('test.miss', 2)])
+
+    def test_collector(self):
+        """InstrumentCollector aggregates measurements."""
+        collector = InstrumentCollector()
+        collector.timing('test', 0.5, 2)
+        collector.timing('test', 1.5, 1)
+        collector.count('test.hit')
+        collector.count('test.hit')
+        self.assertEqual(collector.stages['test'].calls, 2)
+        self.assertEqual(collector.stages['test'].time, 2.0)
+        self.assertEqual(collector.stages['test'].maxtime, 1.5)
+        self.assertEqual(collector.stages['test'].queries, 3)
+        self.assertEqual(collector.counters['test.hit'], 2)
+        data = collector.as_dict()
+        self.assertEqual(data['stages']['test']['calls'], 2)
+        self.assertEqual(data['counters'], {'test.hit': 2})
+        collector.reset()
+        self.assertEqual(collector.stages, {})
+        self.assertEqual(collector.counters, {})
+
+
+class TestPublishInstrument(TestDatabaseFixture):
+    def setUp(self):
+        super(TestPublishInstrument, self).setUp()
+        self.registry = NodeRegistry()
+        self.registry.register_node(Node, view=MyNodeView, child_nodetypes=['*'])
+        self.registry.register_view('node', ExpandedNodeView)
+        self.root = Node(name=u'root', title=u'Root Node')
+        self.node1 = Node(name=u'node1', title=u'Node 1', parent=self.root)
+        self.node2 = Node(name=u'node2', title=u'Node 2', parent=self.node1)
+        db.session.add_all([self.root, self.node1, self.node2])
+        db.session.commit()
+        self.collector = InstrumentCollector()
+        self.publisher = NodePublisher(self.root, self.registry, u'/', instrument=self.collector)
+
+    def test_querycount(self):
+        """querycount counts statements executed in this thread."""
+        before = querycount()
+        Node.query.all()
+        self.assertEqual(querycount() - before, 1)
+
+    def test_publish_stages(self):
+        """Publishing a path reports each stage."""
+        with self.app.test_request_context():
+            response = self.publisher.publish(u'/node1/node2/edit')
+        self.assertEqual(response, u'edit-GET')
+        for stage in ['traverse', 'alias', 'urlmatch', 'viewinit', 'view']:
+            self.assertEqual(self.collector.stages[stage].calls, 1)
+        self.assertEqual(self.collector.stages['traverse'].queries, 1)
+        self.assertEqual(self.collector.stages['alias'].queries, 1)
+        self.assertEqual(self.collector.stages['urlmatch'].queries, 0)
+        self.assertEqual(self.collector.counters['urlmap.found'], 1)
+        self.assertEqual(self.collector.counters['urlmap.hit'], 1)
+        self.assertEqual(self.collector.counters['nodetype.miss'], 1)
+        self.assertEqual(self.collector.counters['viewclass.hit'], 1)
+
+    def test_exact_match_skips_alias(self):
+        """An exact match does not look up aliases."""
+        with self.app.test_request_context():
+            self.publisher.publish(u'/node1')
+        self.assertTrue('alias' not in self.collector.stages)
+        self.assertEqual(self.collector.stages['view'].calls, 1)
+
+    def test_urlmap_notfound(self):
+        """Nodes without registered views are counted."""
+        self.publisher.registry = NodeRegistry()
+        with self.app.test_request_context():
+            self.assertRaises(NotFound, self.publisher.publish, u'/node1')
+        self.assertEqual(self.collector.counters['urlmap.notfound'], 1)
+
+    def test_cache_counters(self):
+        """Registry caches report hits and misses."""
+        self.registry.freeze()
+        self.publisher.registry = NodeRegistry.from_snapshot(self.registry.snapshot())
+        for counter in range(2):
+            with self.app.test_request_context():
+                self.publisher.publish(u'/node1/node2/edit')
+        counters = self.collector.counters
+        self.assertEqual((counters['nodetype.miss'], counters['nodetype.hit']), (1, 1))
+        self.assertEqual((counters['urlmap.miss'], counters['urlmap.hit']), (1, 1))
+        self.assertEqual((counters['viewclass.miss'], counters['viewclass.hit']), (1, 1))
+
+    def test_traverse_without_instrument(self):
+        """Traversal works without an instrument."""
+        publisher = NodePublisher(self.root, None, u'/')
+        status, node, path = publisher.traverse(u'/node1')
+        self.assertEqual(node, self.node1)
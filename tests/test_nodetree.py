@@ -4,6 +4,7 @@ import unittest
 from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError
 from nodular import Node, NodeMixin, NodeAlias
+from nodular.testing import QueryBudget
 from .test_db import db, TestDatabaseFixture
 
 
@@ -134,6 +135,35 @@ class TestNodeTree(TestDatabaseFixture):
         self.assertEqual(node3.path, u'/node3')
         self.assertEqual(node4.path, u'/node1/nodeX/node4')
 
+    def test_rename_twice(self):
+        """
+        Renaming and moving nodes again before a flush still updates paths of children.
+        """
+        node1 = self.nodetype(name=u'node1', title=u'Node 1', parent=self.root)
+        node2 = self.nodetype(name=u'node2', title=u'Node 2', parent=node1)
+        node3 = self.nodetype(name=u'node3', title=u'Node 3', parent=node2)
+        node4 = self.nodetype(name=u'node4', title=u'Node 4', parent=self.root)
+        db.session.add_all([node1, node4])
+        db.session.commit()
+
+        with db.session.no_autoflush:
+            node1.name = u'nodeX'
+            node1.name = u'nodeY'
+            self.assertEqual(node3.path, u'/nodeY/node2/node3')
+            node2.name = u'nodeZ'
+            self.assertEqual(node3.path, u'/nodeY/nodeZ/node3')
+            node2.parent = node4
+            self.assertEqual(node3.path, u'/node4/nodeZ/node3')
+            node3.parent = node1
+            node1.name = u'node1'
+            self.assertEqual(node3.path, u'/node1/node3')
+        node2.name = u'node2'
+        node2.name = u'nodeW'
+        self.assertEqual(node2.path, u'/node4/nodeW')
+        db.session.commit()
+        self.assertEqual([n.path for n in (node1, node2, node3)], [u'/node1', u'/node4/nodeW', u'/node1/node3'])
+        self.assertEqual([n.depth for n in (node1, node2, node3)], [1, 2, 2])
+
     def test_rename_alias(self):
         """
         Test that renaming a node will create a NodeAlias instance.
@@ -193,6 +223,217 @@ class TestNodeTree(TestDatabaseFixture):
         self.assertEqual(len(self.root.aliases), 2)
         self.assertEqual(self.root.aliases[u'node2'].node, None)
 
+    def test_bulk_delete_alias(self):
+        """
+        Deleting many nodes in one flush looks up existing aliases in a single query.
+        """
+        nodes = [self.nodetype(name=u'node%d' % i, title=u'Node %d' % i, parent=self.root) for i in range(10)]
+        db.session.add_all(nodes)
+        db.session.commit()
+        # An existing alias for one of the names is reused
+        nodes[0].name = u'renamed'
+        db.session.commit()
+        self.assertEqual(self.root.aliases[u'node0'].node, nodes[0])
+
+        for node in nodes:
+            db.session.delete(node)
+        with self.assertQueryBudget(40, 'bulk delete') as budget:
+            db.session.commit()
+        # Aliases of the deleted names are found with one query, not one per node
+        aliasqueries = [statement for statement, params in budget.statements
+            if statement.startswith('SELECT') and 'FROM node_alias' in statement
+            and ('node_alias.name IN' in statement or 'node_alias.name = ' in statement)]
+        self.assertEqual(len(aliasqueries), 1)
+        self.assertTrue('node_alias.name IN' in aliasqueries[0])
+        self.assertEqual(len(self.root.aliases), 11)
+        self.assertEqual(self.root.aliases[u'node0'].node, None)
+        self.assertEqual(self.root.aliases[u'renamed'].node, None)
+        for i in range(1, 10):
+            self.assertEqual(self.root.aliases[u'node%d' % i].node, None)
+
+    def test_bulk_delete_alias_batches(self):
+        """
+        Alias lookups are batched to limit the number of bound parameters.
+        """
+        from nodular import node as nodemodule
+        nodes = [self.nodetype(name=u'node%d' % i, title=u'Node %d' % i, parent=self.root) for i in range(5)]
+        db.session.add_all(nodes)
+        db.session.commit()
+        batchsize = nodemodule.ALIAS_BATCH_SIZE
+        nodemodule.ALIAS_BATCH_SIZE = 2
+        try:
+            for node in nodes:
+                db.session.delete(node)
+            db.session.commit()
+        finally:
+            nodemodule.ALIAS_BATCH_SIZE = batchsize
+        self.assertEqual(len(self.root.aliases), 5)
+
+    def test_delete_subtree(self):
+        """
+        Deleting a subtree removes all nodes under it without loading them.
+        """
+        node1 = self.nodetype(name=u'node1', title=u'Node 1', parent=self.root)
+        node2 = self.nodetype(name=u'node2', title=u'Node 2', parent=node1)
+        node3 = self.nodetype(name=u'node3', title=u'Node 3', parent=node2)
+        node4 = self.nodetype(name=u'node_4', title=u'Node 4', parent=self.root)
+        node5 = self.nodetype(name=u'node1_x', title=u'Node 5', parent=self.root)
+        db.session.add_all([node1, node2, node3, node4, node5])
+        db.session.commit()
+        # Rename node4 so that an alias redirects to it, then move it into node1
+        node4.name = u'node4'
+        db.session.commit()
+        node4.parent = node1
+        db.session.commit()
+        node4id = node4.id
+        node1id = node1.id
+        extra = [self.nodetype(name=u'extra%d' % i, title=u'Extra', parent=node3) for i in range(10)]
+        db.session.add_all(extra)
+        db.session.commit()
+        db.session.expunge(node3)
+        for node in extra:
+            db.session.expunge(node)
+
+        with self.assertQueryBudget(5, 'delete_subtree'):
+            node1.delete_subtree()
+        db.session.commit()
+
+        self.assertEqual(Node.query.get(node1id), None)
+        self.assertEqual(Node.query.get(node4id), None)
+        self.assertEqual(Node.query.filter(Node.name.like(u'extra%')).count(), 0)
+        if self.nodetype is not Node:
+            self.assertEqual(self.nodetype.query.count(), 1)
+        self.assertFalse(inspect(node2).persistent)
+        # The sibling with a similar name is untouched
+        self.assertEqual(Node.query.get(node5.id), node5)
+        self.assertEqual(set(self.root.nodes), set([u'node1_x']))
+        # node1 is gone and so is node4, which node_4 redirected to
+        self.assertEqual(self.root.aliases[u'node1'].node, None)
+        self.assertEqual(self.root.aliases[u'node_4'].node, None)
+
+    def test_delete_subtree_batches(self):
+        """
+        Expired nodes are checked in batches to limit the number of bound parameters.
+        """
+        from nodular import node as nodemodule
+        node1 = self.nodetype(name=u'node1', title=u'Node 1', parent=self.root)
+        inside = [self.nodetype(name=u'in%d' % i, title=u'In', parent=node1) for i in range(5)]
+        outside = [self.nodetype(name=u'out%d' % i, title=u'Out', parent=self.root) for i in range(3)]
+        db.session.add_all([node1] + inside + outside)
+        db.session.flush()
+        nodeids = set(node.id.hex for node in inside + outside)
+        db.session.commit()
+        # All loaded nodes are now expired
+        batchsize = nodemodule.SUBTREE_BATCH_SIZE
+        nodemodule.SUBTREE_BATCH_SIZE = 2
+        try:
+            with self.assertQueryBudget(10, 'delete_subtree') as budget:
+                node1.delete_subtree()
+        finally:
+            nodemodule.SUBTREE_BATCH_SIZE = batchsize
+        db.session.commit()
+        lookups = [[p for p in params if p in nodeids] for statement, params in budget.statements
+            if statement.startswith('SELECT node.id') and ' IN (' in statement]
+        # Eight expired nodes and the root, two at a time
+        self.assertEqual(len(lookups), 5)
+        self.assertEqual(sum(len(ids) for ids in lookups), 8)
+        self.assertTrue(all(len(ids) <= 2 for ids in lookups))
+        for node in [node1] + inside:
+            self.assertFalse(inspect(node).persistent)
+        for node in outside:
+            self.assertTrue(inspect(node).persistent)
+        self.assertEqual(set(self.root.nodes), set(u'out%d' % i for i in range(3)))
+
+    def test_delete_subtree_root(self):
+        """
+        Deleting a root node's subtree removes the entire tree.
+        """
+        root2 = self.nodetype(name=u'root2', title=u'Root 2')
+        node1 = self.nodetype(name=u'node1', title=u'Node 1', parent=self.root)
+        node2 = self.nodetype(name=u'node2', title=u'Node 2', parent=root2)
+        db.session.add_all([root2, node1, node2])
+        db.session.commit()
+        self.root.delete_subtree()
+        db.session.commit()
+        self.assertEqual(NodeAlias.query.count(), 0)
+        self.assertEqual(Node.query.all(), [root2, node2])
+
+    def test_descendants_ancestors(self):
+        """
+        Descendants and ancestors are found by path, without walking the tree.
+        """
+        node1 = self.nodetype(name=u'node1', title=u'Node 1', parent=self.root)
+        node2 = self.nodetype(name=u'node2', title=u'Node 2', parent=node1)
+        node3 = self.nodetype(name=u'node3', title=u'Node 3', parent=node2)
+        # Paths that share a prefix but are not under node1
+        node1a = self.nodetype(name=u'node1a', title=u'Node 1a', parent=self.root)
+        node1_ = self.nodetype(name=u'node1_', title=u'Node 1_', parent=self.root)
+        node1b = self.nodetype(name=u'node1.b', title=u'Node 1.b', parent=self.root)
+        root2 = self.nodetype(name=u'root2', title=u'Root 2')
+        node4 = self.nodetype(name=u'node1', title=u'Node 1 in root 2', parent=root2)
+        db.session.add_all([node1, node2, node3, node1a, node1_, node1b, root2, node4])
+        db.session.commit()
+
+        self.assertEqual(node1.descendants_query().all(), [node2, node3])
+        self.assertEqual(node1.descendants_query(include_self=True).all(), [node1, node2, node3])
+        self.assertEqual(node3.descendants_query().all(), [])
+        self.assertEqual(self.root.descendants_query().count(), 6)
+        self.assertEqual(self.root.descendants_query(include_self=True).count(), 7)
+        self.assertEqual(node3.ancestors_query().all(), [self.root, node1, node2])
+        self.assertEqual(node3.ancestors_query(include_self=True).all(), [self.root, node1, node2, node3])
+        self.assertEqual(node4.ancestors_query().all(), [root2])
+        self.assertEqual(self.root.ancestors_query().all(), [])
+        self.assertEqual(self.root.ancestors_query(include_self=True).all(), [self.root])
+
+    def test_move_subtree_queries(self):
+        """
+        Moving a node loads its subtree with one query.
+        """
+        node1 = self.nodetype(name=u'node1', title=u'Node 1', parent=self.root)
+        node2 = self.nodetype(name=u'node2', title=u'Node 2', parent=self.root)
+        parent = node1
+        for counter in range(10):
+            parent = self.nodetype(name=u'node%d' % counter, title=u'Node', parent=parent)
+        db.session.add_all([node1, node2])
+        db.session.commit()
+        path = parent.path
+        ids = node1.id, node2.id
+        db.session.expunge_all()
+        node1, node2 = Node.query.get(ids[0]), Node.query.get(ids[1])
+        with QueryBudget(3):
+            node1.parent = node2
+        db.session.commit()
+        self.assertEqual(Node.query.filter_by(name=u'node9').one().path, u'/node2' + path)
+
+    def test_depth(self):
+        """
+        Nodes record their depth, which is updated when they are moved.
+        """
+        node1 = self.nodetype(name=u'node1', title=u'Node 1', parent=self.root)
+        node2 = self.nodetype(name=u'node2', title=u'Node 2', parent=node1)
+        node3 = self.nodetype(name=u'node3', title=u'Node 3', parent=node2)
+        node4 = self.nodetype(name=u'node4', title=u'Node 4', parent=self.root)
+        db.session.add_all([node1, node4])
+        db.session.commit()
+        self.assertEqual([n.depth for n in (self.root, node1, node2, node3, node4)], [0, 1, 2, 3, 1])
+        self.assertEqual(self.root.descendants_query(levels=1).all(), [node1, node4])
+        self.assertEqual(self.root.descendants_query(levels=2, include_self=True).all(),
+            [self.root, node1, node2, node4])
+        self.assertEqual(node1.descendants_query(levels=1).all(), [node2])
+
+        node2.parent = node4
+        db.session.commit()
+        self.assertEqual([n.depth for n in (node2, node3)], [2, 3])
+        node1.parent = node3
+        db.session.commit()
+        self.assertEqual(node1.depth, 4)
+        self.assertEqual(self.root.descendants_query(levels=3).all(), [node4, node2, node3])
+        root2 = self.nodetype(name=u'root2', title=u'Root 2')
+        node2.parent = root2
+        db.session.commit()
+        self.assertEqual([n.depth for n in (root2, node2, node3, node1)], [0, 1, 2, 3])
+        self.assertEqual(Node.query.filter(Node.depth == 3).all(), [node1])
+
     def test_long_path(self):
         """
         Test that having really long names will cause path to fail gracefully.
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import json
 import unittest
 from werkzeug.exceptions import NotFound, Forbidden, Gone
 from flask import Response
@@ -54,6 +55,14 @@ class RestrictedView(MyNodeView):
         return u'admin'
 
 
+class StreamingView(NodeView):
+    @NodeView.route('/')
+    def listing(self):
+        yield u'%s in %s:' % (self.node.title, self.node.parent.title)
+        for node in self.node.iter_nodes(batch_size=2):
+            yield u' ' + node.name
+
+
 def viewcallable(data):
     return Response(repr(data), mimetype='text/plain')
 
@@ -68,6 +77,33 @@ class TestNodeView(unittest.TestCase):
         self.assertEqual(type(MyNodeView.index), type(MyNodeView.dummy))
         self.assertEqual(len(list(MyNodeView.url_map.iter_rules())), 1)
 
+    def test_lazy_url_map(self):
+        """URL maps are compiled on first use, and route definitions are shared with subclasses."""
+        class BaseView(NodeView):
+            @NodeView.route('/')
+            def index(self):
+                return u'index'
+
+        class SubView(BaseView):
+            @NodeView.route('/edit', methods=['GET', 'POST'])
+            def edit(self):
+                return u'edit'
+
+        self.assertEqual(BaseView._url_map, None)
+        self.assertEqual(SubView._url_map, None)
+        self.assertTrue(SubView.__routes__[0] is BaseView.__routes__[0])
+        self.assertEqual([r['endpoint'] for r in SubView.__routes__], ['index', 'edit'])
+        registry = NodeRegistry()
+        registry.register_node(Node, view=SubView)
+        self.assertEqual(SubView._url_map, None)
+        self.assertEqual(sorted(r.rule for r in SubView.url_map.iter_rules()), ['/', '/edit'])
+        self.assertTrue(SubView.url_map is SubView.url_map)
+        self.assertEqual(BaseView._url_map, None)
+        # Instances share the class's map
+        self.assertTrue(SubView(None).url_map is SubView.url_map)
+        self.assertEqual([r.rule for r in BaseView(None).url_map.iter_rules()], ['/'])
+        self.assertTrue(BaseView._url_map is BaseView.url_map)
+
 
 class TestPublishViews(TestDatabaseFixture):
     def setUp(self):
@@ -192,6 +228,15 @@ class TestPublishViews(TestDatabaseFixture):
         with self.app.test_request_context(method='GET'):
             self.assertRaises(NotFound, newpub.publish, '/')
 
+    def test_itype_fallback(self):
+        """Nodes with an instance type that has no views use their type's views."""
+        self.node2.itype = u'unregistered'
+        db.session.commit()
+        with self.app.test_request_context(method='POST'):
+            self.assertEqual(self.rootpub.publish(u'/node2/edit'), u'edit-POST')
+            self.assertEqual(self.rootpub.url_for(self.node2, 'editget'), '/node2/edit')
+        self.assertFalse('unregistered' in self.registry.urlmaps)
+
     def test_urlfor(self):
         """Test the publisher's url making functionality"""
         with self.app.test_request_context(method='GET'):
@@ -226,6 +271,99 @@ class TestTypeViews(TestPublishViews):
         super(TestTypeViews, self).setUp()
 
 
+class TestFrozenRegistryViews(TestPublishViews):
+    def setUp(self):
+        super(TestFrozenRegistryViews, self).setUp()
+        self.registry.freeze()
+
+
+class TestSnapshotRegistryViews(TestPublishViews):
+    def setUp(self):
+        super(TestSnapshotRegistryViews, self).setUp()
+        self.registry.freeze()
+        self.registry = NodeRegistry.from_snapshot(json.loads(json.dumps(self.registry.snapshot())))
+        for publisher in [self.rootpub, self.nodepub, self.nodepub_differenturl, self.nodepub_defaulturl]:
+            publisher.registry = self.registry
+
+
+class TestDottedNameRegistryViews(TestPublishViews):
+    def setUp(self):
+        super(TestDottedNameRegistryViews, self).setUp()
+        myroutes = [{'rule': '/', 'endpoint': 'index'}]
+        expandedroutes = myroutes + [
+            {'rule': '/', 'endpoint': 'index', 'methods': ['GET', 'POST']},
+            {'rule': '/', 'endpoint': 'view'},
+            {'rule': '/edit', 'endpoint': 'editget'},
+            {'rule': '/edit', 'endpoint': 'editpost', 'methods': ['POST']},
+            {'rule': '/multimethod', 'endpoint': 'multimethod', 'methods': ['GET', 'POST']},
+            {'rule': '/multimethod', 'endpoint': 'multimethod', 'methods': ['PUT']},
+            ]
+        self.registry = NodeRegistry()
+        self.registry.register_node(Node, child_nodetypes=['*'])
+        self.registry.register_node(TestType, child_nodetypes=['*'], parent_nodetypes=['*'])
+        for nodetype in [Node, TestType]:
+            self.registry.register_view(nodetype, 'tests.test_publish_view.MyNodeView', routes=myroutes)
+            self.registry.register_view(nodetype, 'tests.test_publish_view.ExpandedNodeView',
+                routes=expandedroutes)
+        for publisher in [self.rootpub, self.nodepub, self.nodepub_differenturl, self.nodepub_defaulturl]:
+            publisher.registry = self.registry
+
+    def test_lazy_import(self):
+        """Views registered by dotted name are resolved when first dispatched."""
+        viewname = 'tests.test_publish_view.ExpandedNodeView'
+        self.assertEqual(dict.__getitem__(self.registry.viewlist, viewname), viewname)
+        self.assertEqual(self.registry.nodeviews['node'], ['tests.test_publish_view.MyNodeView', viewname])
+        with self.app.test_request_context('/edit', method='POST'):
+            self.assertEqual(self.rootpub.publish(u'/edit'), u'edit-POST')
+        self.assertEqual(dict.__getitem__(self.registry.viewlist, viewname), ExpandedNodeView)
+
+    def test_register_errors(self):
+        """Routes are required for dotted names and only allowed for them."""
+        self.assertRaises(TypeError, self.registry.register_view, Node, 'tests.test_publish_view.MyNodeView')
+        self.assertRaises(TypeError, self.registry.register_view, Node, MyNodeView,
+            routes=[{'rule': '/', 'endpoint': 'index'}])
+
+
+    def test_declared_endpoints(self):
+        """Endpoints declared for a dotted name are checked when the view is imported."""
+        registry = NodeRegistry()
+        registry.register_node(Node)
+        registry.register_view(Node, 'tests.test_publish_view.MyNodeView', routes=[
+            {'rule': '/', 'endpoint': 'index'},
+            {'rule': '/missing', 'endpoint': 'missing'},
+            ])
+        self.rootpub.registry = registry
+        with self.app.test_request_context():
+            with self.assertRaises(ValueError) as cm:
+                self.rootpub.publish(u'/')
+        self.assertTrue('missing' in str(cm.exception))
+        # The view is checked again on the next lookup
+        self.assertRaises(ValueError, registry.viewlist.__getitem__, 'tests.test_publish_view.MyNodeView')
+
+
+class TestStreamingViews(TestDatabaseFixture):
+    def setUp(self):
+        super(TestStreamingViews, self).setUp()
+        self.registry = NodeRegistry()
+        self.registry.register_node(Node, view=StreamingView)
+        self.root = Node(name=u'root', title=u'Root Node')
+        self.node1 = Node(name=u'node1', title=u'Node 1', parent=self.root)
+        db.session.add_all([self.root, self.node1] + [
+            Node(name=u'child%d' % i, title=u'Child %d' % i, parent=self.node1) for i in range(5)])
+        db.session.commit()
+        self.publisher = NodePublisher(self.root, self.registry, u'/')
+
+    def test_stream(self):
+        """Views that return generators get a streaming response."""
+        with self.app.test_request_context():
+            response = self.publisher.publish(u'/node1')
+        self.assertTrue(isinstance(response, Response))
+        self.assertTrue(response.is_streamed)
+        # The node and its ancestors remain usable after the request context is gone
+        self.assertEqual(response.get_data(as_text=True),
+            u'Node 1 in Root Node: child0 child1 child2 child3 child4')
+
+
 class TestPermissionViews(TestDatabaseFixture):
     def setUp(self):
         super(TestPermissionViews, self).setUp()
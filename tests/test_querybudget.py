@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+from nodular import Node, NodePublisher, NodeRegistry
+from nodular.testing import QueryBudget, QueryBudgetExceeded
+from .test_db import db, TestDatabaseFixture
+from .test_publish_view import MyNodeView, ExpandedNodeView
+
+
+class TestQueryBudget(TestDatabaseFixture):
+    """Test the query budget utility."""
+    def test_within_budget(self):
+        db.session.commit()
+        with QueryBudget(1) as budget:
+            Node.query.all()
+        self.assertEqual(budget.count, 1)
+
+    def test_exceeded(self):
+        def overrun():
+            with QueryBudget(1, 'overrun'):
+                Node.query.all()
+                Node.query.filter_by(name=u'root').all()
+        self.assertRaises(QueryBudgetExceeded, overrun)
+        try:
+            overrun()
+        except QueryBudgetExceeded as e:
+            message = str(e)
+        self.assertTrue(message.startswith("overrun issued 2 SQL statements, exceeding the budget of 1"))
+        self.assertTrue('2. SELECT' in message)
+
+    def test_decorator(self):
+        @QueryBudget(0)
+        def noqueries():
+            return 1
+
+        @QueryBudget(0)
+        def onequery():
+            return Node.query.all()
+
+        self.assertEqual(noqueries(), 1)
+        self.assertRaises(QueryBudgetExceeded, onequery)
+
+    def test_exception_passthrough(self):
+        """Exceptions inside the block are not masked by the budget."""
+        def fail():
+            with QueryBudget(0):
+                Node.query.all()
+                raise KeyError('test')
+        self.assertRaises(KeyError, fail)
+
+
+class TestHotPathBudgets(TestDatabaseFixture):
+    """Query budgets for the publisher and node hot paths."""
+    def setUp(self):
+        super(TestHotPathBudgets, self).setUp()
+        self.registry = NodeRegistry()
+        self.registry.register_node(Node, view=MyNodeView, child_nodetypes=['*'])
+        self.registry.register_view('node', ExpandedNodeView)
+        self.root = Node(name=u'root', title=u'Root Node')
+        self.node1 = Node(name=u'node1', title=u'Node 1', parent=self.root)
+        self.node2 = Node(name=u'node2', title=u'Node 2', parent=self.node1)
+        self.node3 = Node(name=u'node3', title=u'Node 3', parent=self.node2)
+        db.session.add_all([self.root, self.node1, self.node2, self.node3])
+        db.session.commit()
+        self.publisher = NodePublisher(self.root, self.registry, u'/')
+        # Load the nodes so that budgets do not count refreshes after commit
+        [n.path for n in (self.root, self.node1, self.node2, self.node3)]
+
+    def test_traverse(self):
+        with self.assertQueryBudget(1, 'traverse (match)'):
+            self.publisher.traverse(u'/node1/node2/node3')
+        with self.assertQueryBudget(2, 'traverse (partial)'):
+            self.publisher.traverse(u'/node1/node2/node3/edit')
+
+    def test_publish(self):
+        with self.app.test_request_context():
+            with self.assertQueryBudget(1, 'publish (match)'):
+                self.publisher.publish(u'/node1/node2/node3')
+            with self.assertQueryBudget(2, 'publish (partial)'):
+                self.publisher.publish(u'/node1/node2/node3/edit')
+
+    def test_url_for(self):
+        with self.app.test_request_context():
+            with self.assertQueryBudget(0, 'url_for'):
+                self.publisher.url_for(self.node3, 'editget')
+
+    def test_proxydict(self):
+        nodes = self.node1.nodes
+        with self.assertQueryBudget(1, 'ProxyDict.keys'):
+            nodes.keys()
+        with self.assertQueryBudget(1, 'ProxyDict.__getitem__'):
+            nodes[u'node2']
+        with self.assertQueryBudget(1, 'ProxyDict.get'):
+            nodes.get(u'missing')
+        with self.assertQueryBudget(1, 'ProxyDict.__contains__'):
+            u'node2' in nodes
+        with self.assertQueryBudget(1, 'ProxyDict.__len__'):
+            len(nodes)
+        with self.assertQueryBudget(1, 'ProxyDict.__bool__'):
+            nodes.__bool__()
+        with self.assertQueryBudget(2, 'ProxyDict.__delitem__'):
+            del nodes[u'node2']
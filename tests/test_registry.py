@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+from six import StringIO
 from nodular import Node, NodeRegistry
 from nodular.registry import dottedname
 from .test_db import TestDatabaseFixture
 from .test_nodetree import TestType
-from .test_publish_view import MyNodeView
+from .test_publish_view import MyNodeView, ExpandedNodeView
 
 
 class TestDottedName(unittest.TestCase):
@@ -64,3 +65,155 @@ class TestRegistry(TestDatabaseFixture):
         self.assertTrue('home' in self.registry.nodes)
         self.assertTrue(MyNodeView in self.registry.nodeviews['home'])
         self.assertFalse(MyNodeView in self.registry.nodeviews[Node.__type__])
+
+    def test_freeze(self):
+        """Freezing a registry compiles URL building tables and prevents changes."""
+        self.registry.register_node(Node, view=MyNodeView)
+        self.registry.register_view(Node, ExpandedNodeView)
+        self.assertFalse(self.registry.frozen)
+        self.registry.freeze()
+        self.assertTrue(self.registry.frozen)
+        self.assertEqual(self.registry.endpoints['node']['index'], '/')
+        self.assertEqual(self.registry.endpoints['node']['editget'], '/edit')
+        self.assertEqual(self.registry.endpoint_rule('node', 'multimethod'), '/multimethod')
+        self.assertEqual(self.registry.endpoint_rule('node', 'random'), None)
+        self.assertEqual(self.registry.endpoint_rule('unknown', 'index'), None)
+        self.assertRaises(RuntimeError, self.registry.register_node, TestType)
+        self.assertRaises(RuntimeError, self.registry.register_view, Node, MyNodeView)
+        # Unknown nodetypes don't get empty URL maps
+        self.assertRaises(KeyError, lambda: self.registry.urlmaps['unknown'])
+        self.assertFalse('unknown' in self.registry.urlmaps)
+        # Freezing again is harmless
+        self.registry.freeze()
+
+    def test_endpoint_rule_unfrozen(self):
+        """URL building tables are compiled on demand and refreshed on registration."""
+        self.registry.register_node(Node, view=MyNodeView)
+        self.assertEqual(self.registry.endpoint_rule('node', 'editget'), None)
+        self.registry.register_view(Node, ExpandedNodeView)
+        self.assertEqual(self.registry.endpoint_rule('node', 'editget'), '/edit')
+        self.assertEqual(self.registry.endpoint_rule('unknown', 'index'), None)
+        self.assertFalse('unknown' in self.registry.urlmaps)
+
+    def test_view_nodetype(self):
+        """Nodes use views of their instance type, type or base types, in that order."""
+        self.registry.register_node(Node, view=MyNodeView)
+        self.registry.register_node(Node, itype='home', view=ExpandedNodeView)
+        self.registry.register_node(TestType)
+        node = TestType(name=u'node', title=u'Node')
+        self.assertEqual(self.registry.view_nodetype(node), 'node')
+        node.itype = u'home'
+        self.assertEqual(self.registry.view_nodetype(node), 'home')
+        node.itype = u'unregistered'
+        self.assertEqual(self.registry.view_nodetype(node), 'node')
+        # Unknown types don't get URL maps
+        self.assertEqual(set(self.registry.urlmaps), set(['node', 'home']))
+        # Registering a view resets cached lookups
+        self.registry.register_view(TestType, MyNodeView)
+        self.assertEqual(self.registry.view_nodetype(node), 'test_type')
+        self.assertEqual(self.registry.view_nodetype(Node(name=u'other', title=u'Other')), 'node')
+        self.assertEqual(NodeRegistry().view_nodetype(node), None)
+
+    def test_allows_child(self):
+        """Allowed child nodetypes are resolved with wildcards."""
+        self.registry.register_node(Node, child_nodetypes=['*', 'folder'])
+        self.registry.register_node(Node, itype='folder', child_nodetypes=['page'])
+        self.registry.register_node(TestType, itype='page', parent_nodetypes=['*'])
+        self.registry.register_node(TestType, itype='widget', parent_nodetypes=[Node])
+        self.registry.register_node(TestType, child_nodetypes=[TestType])
+        self.assertEqual(self.registry.allowed_children('node'), frozenset(['folder', 'page', 'widget']))
+        self.assertEqual(self.registry.allowed_children('folder'), frozenset(['page']))
+        self.assertEqual(self.registry.allowed_children('page'), frozenset())
+        self.assertEqual(self.registry.allowed_children('unknown'), frozenset())
+        self.assertTrue(self.registry.allows_child('node', 'page'))
+        self.assertTrue(self.registry.allows_child('node', 'widget'))
+        self.assertTrue(self.registry.allows_child('test_type', 'test_type'))
+        self.assertFalse(self.registry.allows_child('folder', 'widget'))
+        self.assertFalse(self.registry.allows_child('page', 'page'))
+        self.assertFalse(self.registry.allows_child('node', 'node'))
+        self.assertFalse(self.registry.allows_child('*', 'page'))
+        # Registering a node updates the lookup
+        self.registry.register_node(Node, itype='photo', parent_nodetypes=['folder'])
+        self.assertTrue(self.registry.allows_child('folder', 'photo'))
+        self.registry.freeze()
+        self.assertTrue(self.registry.allows_child('folder', 'photo'))
+
+    def test_enforce_child_nodetypes(self):
+        """Nodes can't be placed in parents that don't allow them."""
+        self.registry.register_node(Node, child_nodetypes=[TestType])
+        self.registry.register_node(TestType)
+        self.registry.enforce_child_nodetypes()
+        try:
+            root = Node(name=u'root', title=u'Root')
+            child = TestType(name=u'child', title=u'Child', parent=root)
+            self.assertRaises(ValueError, Node, name=u'node', title=u'Node', parent=root)
+            self.assertRaises(ValueError, TestType, name=u'grandchild', title=u'Grandchild', parent=child)
+            # Orphaning a node is always allowed
+            child.parent = None
+        finally:
+            self.registry.enforce_child_nodetypes(False)
+        TestType(name=u'grandchild', title=u'Grandchild', parent=child)
+
+    def test_snapshot(self):
+        """A frozen registry can be saved and loaded, with views resolved on first use."""
+        self.registry.register_node(Node, view=MyNodeView, child_nodetypes=['*'])
+        self.registry.register_node(TestType, itype='home', title='Home page', parent_nodetypes=['*'])
+        self.registry.register_view(Node, ExpandedNodeView)
+        self.assertRaises(RuntimeError, self.registry.snapshot)
+        self.registry.freeze()
+        f = StringIO()
+        self.registry.dump(f)
+        f.seek(0)
+        registry = NodeRegistry.load(f)
+        self.assertTrue(registry.frozen)
+        self.assertRaises(RuntimeError, registry.register_node, TestType)
+        self.assertEqual(list(registry.nodes), ['node', 'home'])
+        self.assertEqual(registry.nodes['home'].model, TestType)
+        self.assertEqual(registry.nodes['home'].title, 'Home page')
+        self.assertEqual(registry.child_nodetypes['node'], set(['*']))
+        self.assertEqual(registry.child_nodetypes['*'], set(['home']))
+        self.assertEqual(registry.nodeviews['node'],
+            ['tests.test_publish_view.MyNodeView', 'tests.test_publish_view.ExpandedNodeView'])
+        self.assertEqual(registry.endpoints, self.registry.endpoints)
+        self.assertTrue(registry.allows_child('node', 'home'))
+        # URL maps are compiled and views resolved only when used
+        self.assertEqual(len(registry.urlmaps), 0)
+        self.assertEqual(dict.__getitem__(registry.viewlist, 'tests.test_publish_view.MyNodeView'),
+            'tests.test_publish_view.MyNodeView')
+        self.assertEqual(registry.viewlist['tests.test_publish_view.MyNodeView'], MyNodeView)
+        self.assertEqual(dict.__getitem__(registry.viewlist, 'tests.test_publish_view.MyNodeView'), MyNodeView)
+        self.assertEqual(
+            [r.rule for r in registry.urlmap('node').iter_rules()],
+            [r.rule for r in self.registry.urlmaps['node'].iter_rules()])
+        self.assertEqual(registry.urlmap('home'), None)
+        self.assertEqual(registry.snapshot(), self.registry.snapshot())
+
+    def test_snapshot_urlmap_race(self):
+        """A URL map compiled by another thread between lookups is still found."""
+        self.registry.register_node(Node, view=MyNodeView)
+        self.registry.freeze()
+        registry = NodeRegistry.from_snapshot(self.registry.snapshot())
+
+        class LateUrlMaps(dict):
+            """Misses on the first lookup, as if another thread compiled the map just after"""
+            missed = False
+
+            def get(self, key, default=None):
+                if not self.missed:
+                    self.missed = True
+                    registry.urlmap(key)
+                    return default
+                return dict.get(self, key, default)
+
+        registry.urlmaps = LateUrlMaps()
+        urlmap = registry.urlmap('node')
+        self.assertTrue(urlmap is not None)
+        self.assertTrue(urlmap is registry.urlmaps['node'])
+        self.assertFalse('node' in registry._rulespecs)
+
+    def test_snapshot_version(self):
+        """Snapshots from an incompatible version are rejected."""
+        self.registry.freeze()
+        snapshot = self.registry.snapshot()
+        snapshot['version'] = 0
+        self.assertRaises(ValueError, NodeRegistry.from_snapshot, snapshot)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from nodular import Node, NodePublisher, TRAVERSE_STATUS, read_replica
+from .test_db import db, app, TestDatabaseFixture
+
+
+class TestReadReplica(TestDatabaseFixture):
+    """
+    The replica is an empty database, standing in for one that lags behind,
+    so queries that go to it find nothing.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite:///' + os.path.join(self.tempdir, 'replica.db')}
+        super(TestReadReplica, self).setUp()
+        self.replica = db.get_engine(app, 'replica')
+        db.metadata.create_all(bind=self.replica)
+        root = Node(name=u'root', title=u'Root Node')
+        db.session.add(root)
+        db.session.add(Node(name=u'node', title=u'Node', parent=root))
+        db.session.commit()
+        self.root_id = root.id
+        db.session.remove()
+        app.config['NODULAR_READ_BIND'] = 'replica'
+
+    def tearDown(self):
+        del app.config['NODULAR_READ_BIND']
+        super(TestReadReplica, self).tearDown()
+        self.replica.dispose()
+        del app.config['SQLALCHEMY_BINDS']
+        shutil.rmtree(self.tempdir)
+
+    def test_hot_paths(self):
+        """Traversal and listings read from the replica."""
+        publisher = NodePublisher(self.root_id, None, '/')
+        self.assertEqual(publisher.traverse(u'/node')[0], TRAVERSE_STATUS.NOROOT)
+        # Other queries go to the primary
+        root = Node.query.get(self.root_id)
+        self.assertEqual(root.title, u'Root Node')
+        self.assertEqual(len(root.nodes), 0)
+        self.assertEqual(root.nodes.get(u'node'), None)
+        self.assertEqual(list(root.iter_nodes()), [])
+        with read_replica():
+            self.assertEqual(Node.query.filter_by(name=u'node').first(), None)
+
+    def test_sticky_primary(self):
+        """Sessions that have written read from the primary."""
+        publisher = NodePublisher(self.root_id, None, '/')
+        root = Node.query.get(self.root_id)
+        root.title = u'Changed'
+        db.session.flush()
+        self.assertEqual(publisher.traverse(u'/node')[0], TRAVERSE_STATUS.MATCH)
+        self.assertEqual(len(root.nodes), 1)
+        db.session.commit()
+        self.assertEqual(publisher.traverse(u'/node')[0], TRAVERSE_STATUS.MATCH)
+
+        # A new session starts on the replica, and moves to the primary
+        # after a statement that writes
+        db.session.remove()
+        self.assertEqual(publisher.traverse(u'/node')[0], TRAVERSE_STATUS.NOROOT)
+        db.session.execute(Node.__table__.update().where(Node.__table__.c.id == self.root_id).values(
+            title=u'Updated'))
+        self.assertEqual(publisher.traverse(u'/node')[0], TRAVERSE_STATUS.MATCH)
+
+    def test_unconfigured(self):
+        """Without a read bind, everything goes to the primary."""
+        del app.config['NODULAR_READ_BIND']
+        publisher = NodePublisher(self.root_id, None, '/')
+        self.assertEqual(publisher.traverse(u'/node')[0], TRAVERSE_STATUS.MATCH)
+        app.config['NODULAR_READ_BIND'] = 'replica'
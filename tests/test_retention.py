@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+from nodular import Node, RetentionPolicy, prune_revisions
+from .test_db import db, TestDatabaseFixture
+from .test_revisions import MyDocument, MyDocumentRevision, DeltaDocument, DeltaDocumentRevision
+
+
+class TestRetention(TestDatabaseFixture):
+    def setUp(self):
+        super(TestRetention, self).setUp()
+        self.root = Node(name=u'root', title=u'Root Node')
+        db.session.add(self.root)
+        self.now = datetime(2020, 6, 30, 12, 0)
+
+    def make_revisions(self, model, name, count, labels={}):
+        """Make a document with a revision every six hours, ending now"""
+        doc = model(name=name, title=name, parent=self.root)
+        db.session.add(doc)
+        revisions = []
+        rev = None
+        for counter in range(count):
+            rev = doc.revise(rev, workflow_label=labels.get(counter))
+            rev.content = u''.join(u'Line %d in revision %d\n' % (i, counter if i == counter % 20 else 0)
+                for i in range(20))
+            rev.created_at = self.now - timedelta(hours=6 * (count - 1 - counter))
+            db.session.commit()
+            revisions.append(rev)
+        return doc, [r.id for r in revisions], [r.content for r in revisions]
+
+    def test_policy(self):
+        """Policies keep recent, labelled and daily revisions."""
+        doc, ids, texts = self.make_revisions(MyDocument, u'doc', 12, labels={1: u'published'})
+        rows = db.session.execute(MyDocumentRevision.__table__.select()).fetchall()
+        self.assertEqual(RetentionPolicy(keep_last=2).keep(rows, self.now), set(ids[-2:] + ids[1:2]))
+        self.assertEqual(RetentionPolicy(keep_last=2, keep_labeled=False).keep(rows, self.now), set(ids[-2:]))
+        self.assertEqual(RetentionPolicy(keep_within=timedelta(hours=12), keep_labeled=False).keep(
+            rows, self.now), set(ids[-3:]))
+        # Of the revisions made more than a day ago, the last of each day is kept
+        self.assertEqual(RetentionPolicy(daily_after=timedelta(days=1), keep_labeled=False).keep(
+            rows, self.now), set([ids[0], ids[4], ids[6]]))
+
+    def test_prune(self):
+        """Pruning deletes revisions, relinks the rest and reports on it."""
+        doc, ids, texts = self.make_revisions(MyDocument, u'doc', 12, labels={1: u'published'})
+        # A branch from an old revision is kept, but not the revision it branched from
+        branch = doc.revise(MyDocumentRevision.query.get(ids[4]))
+        db.session.commit()
+        branch_id = branch.id
+        report = prune_revisions(MyDocument, RetentionPolicy(keep_last=3), batch_size=2, now=self.now)
+        db.session.expunge_all()
+        remaining = MyDocumentRevision.query.order_by('id').all()
+        self.assertEqual([r.id for r in remaining], [ids[1], ids[10], ids[11], branch_id])
+        self.assertEqual([r.previous_id for r in remaining], [None, ids[1], ids[10], ids[1]])
+        self.assertEqual([r.content for r in remaining[:3]], [texts[1], texts[10], texts[11]])
+        self.assertEqual(report.nodes, 1)
+        self.assertEqual(report.revisions, 13)
+        self.assertEqual(report.deleted, 9)
+        self.assertEqual(report.relinked, 3)
+        self.assertEqual(report.skipped, 0)
+        self.assertTrue(report.reclaimed >= 9 * len(texts[0]))
+        self.assertEqual(report.as_dict()['deleted'], 9)
+
+        # Nothing more to prune
+        report = prune_revisions(MyDocument, RetentionPolicy(keep_last=3), now=self.now)
+        self.assertEqual((report.revisions, report.deleted, report.relinked), (4, 0, 0))
+
+    def test_prune_labelled_while_running(self):
+        """Revisions labelled after the policy is applied are not deleted."""
+        from nodular.retention import _prune_node, PruneReport
+
+        class LabellingPolicy(RetentionPolicy):
+            def keep(self, revisions, now):
+                keep = super(LabellingPolicy, self).keep(revisions, now)
+                # An editor labels a revision after the pruner has looked
+                doc.set_workflow_label(MyDocumentRevision.query.get(ids[0]), u'draft')
+                db.session.commit()
+                return keep
+
+        doc, ids, texts = self.make_revisions(MyDocument, u'doc', 4)
+        report = PruneReport()
+        _prune_node(MyDocumentRevision, doc.id, LabellingPolicy(keep_last=1), 10, self.now, report)
+        self.assertEqual(report.deleted, 2)
+        self.assertEqual(report.skipped, 1)
+        self.assertEqual(sorted(r.id for r in MyDocumentRevision.query.all()), [ids[0], ids[3]])
+
+    def test_prune_delta(self):
+        """Relinked delta revisions are stored in full."""
+        doc, ids, texts = self.make_revisions(DeltaDocument, u'doc', 8)
+        table = DeltaDocumentRevision.__table__
+        prune_revisions(DeltaDocument, RetentionPolicy(keep_last=3), now=self.now)
+        rows = db.session.execute(table.select().order_by('id')).fetchall()
+        self.assertEqual([r.id for r in rows], ids[-3:])
+        self.assertEqual([r.delta_depth for r in rows], [0, 0, 1])
+        self.assertEqual(rows[0].content, texts[-3])
+        db.session.expunge_all()
+        self.assertEqual([r.content for r in DeltaDocumentRevision.query.order_by('id')], texts[-3:])
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from nodular import Node, RevisionedNodeMixin
+from nodular.testing import QueryBudget
 from .test_db import db, TestDatabaseFixture
 
 
@@ -29,6 +30,35 @@ class CustomNameDocumentRevision(CustomNameDocument.RevisionMixin, db.Model):
     content = db.Column(db.UnicodeText, nullable=False, default=u'')
 
 
+class DeltaDocument(RevisionedNodeMixin, Node):
+    __tablename__ = u'delta_document'
+
+
+class DeltaDocumentRevision(DeltaDocument.RevisionMixin, db.Model):
+    __delta_columns__ = ('content', 'summary')
+    __delta_interval__ = 3
+    content = db.Column(db.UnicodeText, nullable=False, default=u'')
+    summary = db.Column(db.UnicodeText, nullable=True)
+
+
+class FingerprintDocument(RevisionedNodeMixin, Node):
+    __tablename__ = u'fingerprint_document'
+
+
+class FingerprintDocumentRevision(FingerprintDocument.RevisionMixin, db.Model):
+    __fingerprint_columns__ = ('content', 'summary')
+    __delta_columns__ = ('content',)
+    content = db.Column(db.UnicodeText, nullable=False, default=u'')
+    #: Fingerprinted, but not copied to new revisions
+    summary = db.Column(db.UnicodeText, nullable=True)
+    note = db.Column(db.Unicode(250), nullable=True)
+
+    def copy(self):
+        revision = super(FingerprintDocumentRevision, self).copy()
+        revision.content = self.content
+        return revision
+
+
 class TestNodeRevisions(TestDatabaseFixture):
     def setUp(self):
         super(TestNodeRevisions, self).setUp()
@@ -120,3 +150,414 @@ class TestNodeRevisions(TestDatabaseFixture):
         self.assertEqual(rev1.workflow_label, None)
         self.assertEqual(rev2.workflow_label, None)
         self.assertEqual(rev3.workflow_label, u"published")
+
+    def test_revision_label_statements(self):
+        """Moving a label doesn't flush the session."""
+        doc1 = MyDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc1)
+        rev1 = doc1.revise(workflow_label=u'draft')
+        db.session.commit()
+        self.assertEqual(rev1.workflow_label, u'draft')
+        with QueryBudget(1) as budget:
+            rev2 = doc1.revise(workflow_label=u'draft')
+        self.assertTrue(budget.statements[0][0].startswith('UPDATE'))
+        self.assertEqual(rev1.workflow_label, None)
+        self.assertFalse(rev1 in db.session.dirty)
+        db.session.commit()
+        self.assertEqual(rev1.workflow_label, None)
+        self.assertEqual(rev2.workflow_label, u'draft')
+        # Labels can be moved to an unsaved revision
+        rev3 = doc1.revise(rev2)
+        doc1.set_workflow_label(rev3, u'draft')
+        self.assertEqual(rev2.workflow_label, None)
+        db.session.commit()
+        self.assertEqual(rev2.workflow_label, None)
+        self.assertEqual(rev3.workflow_label, u'draft')
+        # A label that is moved twice before a flush stays on one revision
+        doc1.set_workflow_label(rev1, u'published')
+        doc1.set_workflow_label(rev2, u'published')
+        db.session.commit()
+        self.assertEqual(rev1.workflow_label, None)
+        self.assertEqual(rev2.workflow_label, u'published')
+
+    def test_set_workflow_labels(self):
+        """Labels can be set on revisions of many nodes at once."""
+        docs = [MyDocument(name=u'doc%d' % i, title=u'Document %d' % i, parent=self.root) for i in range(3)]
+        db.session.add_all(docs)
+        old = [doc.revise(workflow_label=u'published') for doc in docs]
+        db.session.commit()
+        new = [doc.revise(rev) for doc, rev in zip(docs, old)]
+        db.session.commit()
+        for rev in old + new:
+            db.session.refresh(rev)
+        with QueryBudget(2):
+            MyDocument.set_workflow_labels(new[:2], u'published')
+        db.session.commit()
+        self.assertEqual([r.workflow_label for r in old], [None, None, u'published'])
+        self.assertEqual([r.workflow_label for r in new], [u'published', u'published', None])
+        # Unsaved revisions are labelled when the session is flushed
+        newer = docs[2].revise(new[2])
+        MyDocument.set_workflow_labels([newer], u'published')
+        db.session.commit()
+        self.assertEqual(old[2].workflow_label, None)
+        self.assertEqual(newer.workflow_label, u'published')
+
+    def test_previous(self):
+        """The previous revision link points backwards."""
+        doc1 = MyDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc1)
+        rev1 = doc1.revise()
+        db.session.commit()
+        rev2 = doc1.revise(rev1)
+        db.session.commit()
+        self.assertEqual(rev2.previous_id, rev1.id)
+        self.assertEqual(rev1.previous_id, None)
+
+    def test_delta_codec(self):
+        """Diffs turn the old text into the new text."""
+        from nodular.revisioned import delta_encode, delta_decode
+        old = u'one\ntwo\nthree\nfour\n'
+        for new in [u'one\ntwo\nthree\nfour\n', u'one\n2\nthree\nfour\nfive', u'', u'zero\n' + old]:
+            self.assertEqual(delta_decode(old, delta_encode(old, new)), new)
+        self.assertEqual(delta_encode(old, old), [['=', 0, 4]])
+        self.assertEqual(delta_decode(None, delta_encode(None, u'new')), u'new')
+
+    def test_delta_storage(self):
+        """Delta columns are stored as diffs with periodic full copies."""
+        doc = DeltaDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc)
+        lines = [u'Line %d of the document\n' % i for i in range(50)]
+        texts = []
+        rev = None
+        for counter in range(7):
+            lines[counter] = u'Changed line %d\n' % counter
+            texts.append(u''.join(lines))
+            rev = doc.revise(rev)
+            rev.content = texts[-1]
+            rev.summary = None if counter == 2 else u'Summary %d' % counter
+            db.session.commit()
+            # Values are available as full text after saving
+            self.assertEqual(rev.content, texts[-1])
+        rows = db.session.execute(DeltaDocumentRevision.__table__.select().order_by('id')).fetchall()
+        self.assertEqual([r.delta_depth for r in rows], [0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual(rows[0].content, texts[0])
+        self.assertTrue(len(rows[2].content) < len(texts[2]) / 5)
+        self.assertEqual(rows[2].summary, None)
+
+        # Loading revisions rebuilds the full text
+        db.session.expunge_all()
+        revisions = DeltaDocumentRevision.query.order_by('id').all()
+        self.assertEqual([r.content for r in revisions], texts)
+        self.assertEqual([r.summary for r in revisions],
+            [u'Summary 0', u'Summary 1', None, u'Summary 3', u'Summary 4', u'Summary 5', u'Summary 6'])
+        db.session.expunge_all()
+        rev = DeltaDocumentRevision.query.get(rows[5].id)
+        # Rebuilding takes one query in addition to loading the row
+        with QueryBudget(2):
+            db.session.expire(rev, ['content'])
+            self.assertEqual(rev.content, texts[5])
+
+    def test_history(self):
+        """Revision history is fetched with one query."""
+        doc1 = MyDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc1)
+        revisions = []
+        rev = None
+        for counter in range(5):
+            rev = doc1.revise(rev, workflow_label=u'draft' if counter == 4 else None)
+            rev.content = u'Content %d' % counter
+            db.session.commit()
+            revisions.append(rev)
+        ids = [r.id for r in revisions]
+        # A revision made from the third one is on a branch
+        branch = doc1.revise(revisions[2])
+        db.session.commit()
+        with QueryBudget(1):
+            rows = doc1.history(revisions[4])
+        self.assertEqual([r.id for r in rows], ids[::-1])
+        self.assertEqual([r.level for r in rows], [0, 1, 2, 3, 4])
+        self.assertEqual(rows[0].workflow_label, u'draft')
+        self.assertEqual(rows[1].previous_id, ids[2])
+        self.assertFalse('content' in rows[0].keys())
+        rows = doc1.history(branch.id, limit=2, columns=['content'])
+        self.assertEqual([r.id for r in rows], [branch.id, ids[2]])
+        self.assertEqual(rows[1].content, u'Content 2')
+        self.assertEqual([r.id for r in doc1.history(ids[0])], [ids[0]])
+
+        db.session.expunge_all()
+        with QueryBudget(1):
+            ancestry = doc1.ancestry(ids[4], defer_columns=['content'])
+            self.assertEqual([r.id for r in ancestry], ids)
+            # Previous links are available without queries
+            self.assertEqual([r.previous for r in ancestry], [None] + ancestry[:-1])
+        self.assertFalse('content' in ancestry[0].__dict__)
+        self.assertEqual(ancestry[0].content, u'Content 0')
+
+    def test_delta_ancestry(self):
+        """Delta storage reuses the text of earlier revisions when loading history in order."""
+        doc = DeltaDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc)
+        texts = []
+        rev = None
+        for counter in range(5):
+            texts.append(u''.join(u'Line %d in revision %d\n' % (i, counter if i == counter else 0)
+                for i in range(20)))
+            rev = doc.revise(rev)
+            rev.content = texts[-1]
+            db.session.commit()
+        last = rev.id
+        db.session.expunge_all()
+        with QueryBudget(1):
+            ancestry = doc.ancestry(last)
+            self.assertEqual([r.content for r in ancestry], texts)
+
+    def test_delta_edit_in_place(self):
+        """Editing a revision keeps the content of revisions stored as diffs against it."""
+        doc = DeltaDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc)
+        text = u''.join(u'Line %d\n' % i for i in range(20))
+        draft = doc.revise(workflow_label=u'draft')
+        draft.content = text
+        db.session.commit()
+        published = doc.revise(draft, workflow_label=u'published')
+        published.content = text
+        db.session.commit()
+        later = doc.revise(published)
+        later.content = text + u'Line 20\n'
+        db.session.commit()
+        self.assertEqual((published.delta_depth, later.delta_depth), (1, 2))
+        updated_at = published.updated_at
+        draft.content = u'Edited\n' + text
+        db.session.commit()
+        self.assertEqual(published.delta_depth, 0)
+        self.assertEqual(published.updated_at, updated_at)
+        ids = (doc.id, later.id)
+        db.session.expunge_all()
+        doc = DeltaDocument.query.get(ids[0])
+        self.assertEqual(doc.workflow_revision[u'published'].content, text)
+        self.assertEqual(doc.workflow_revision[u'draft'].content, u'Edited\n' + text)
+        self.assertEqual(DeltaDocumentRevision.query.get(ids[1]).content, text + u'Line 20\n')
+
+    def test_fingerprint(self):
+        """Revising with unchanged content returns the same revision."""
+        from nodular.revisioned import content_fingerprint
+        doc = FingerprintDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc)
+        first = u''.join(u'Line %d\n' % i for i in range(20))
+        second = first + u'Line 20\n'
+        rev1 = doc.revise(content=first)
+        db.session.commit()
+        self.assertEqual(rev1.content, first)
+        self.assertEqual(rev1.fingerprint, content_fingerprint(FingerprintDocumentRevision, {'content': first}))
+        # Saving again without changes, even with a new label, makes no new revision
+        self.assertTrue(doc.revise(rev1, content=first) is rev1)
+        self.assertTrue(doc.revise(rev1, workflow_label=u'draft', content=first) is rev1)
+        db.session.commit()
+        self.assertEqual(rev1.workflow_label, u'draft')
+        # Changes to any given column make a new revision
+        rev2 = doc.revise(rev1, content=first, note=u'Note')
+        self.assertFalse(rev2 is rev1)
+        rev3 = doc.revise(rev2, content=second)
+        db.session.commit()
+        self.assertEqual(rev2.fingerprint, rev1.fingerprint)
+        self.assertNotEqual(rev3.fingerprint, rev1.fingerprint)
+        # Fingerprints are made from full text, not diffs
+        self.assertEqual(rev3.delta_depth, 2)
+        self.assertEqual(rev3.fingerprint, content_fingerprint(FingerprintDocumentRevision, {'content': second}))
+        # Earlier content can be found
+        self.assertEqual(doc.revision_with_content(content=first), rev2)
+        self.assertEqual(doc.revision_with_content(content=second), rev3)
+        self.assertEqual(doc.revision_with_content(content=u'Third\n'), None)
+        # Changing content updates the fingerprint
+        rev3.content = u'Third\n'
+        db.session.commit()
+        self.assertEqual(doc.revision_with_content(content=u'Third\n'), rev3)
+        # Without fingerprint columns, content is set on a new revision
+        doc2 = MyDocument(name=u'doc2', title=u'Document', parent=self.root)
+        db.session.add(doc2)
+        rev = doc2.revise(content=u'Content')
+        self.assertFalse(doc2.revise(rev, content=u'Content') is rev)
+        self.assertEqual(rev.content, u'Content')
+
+    def test_fingerprint_all_columns(self):
+        """Identical content is found by the fingerprint of all fingerprinted columns."""
+        doc = FingerprintDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc)
+        # The content column's default is part of the stored fingerprint
+        rev1 = doc.revise()
+        db.session.commit()
+        self.assertEqual(rev1.content, u'')
+        self.assertTrue(doc.revise(rev1, summary=None) is rev1)
+        db.session.commit()
+        self.assertEqual(doc.revisions.count(), 1)
+        # Columns that are not given keep the revision's values
+        rev1.summary = u'Summary'
+        db.session.commit()
+        self.assertEqual(rev1.summary, u'Summary')
+        # No new revision is made to compare with
+        with QueryBudget(0):
+            self.assertTrue(doc.revise(rev1, workflow_label=None, content=u'') is rev1)
+        self.assertTrue(doc.revise(rev1, workflow_label=u'draft', content=u'') is rev1)
+        db.session.commit()
+        self.assertEqual(rev1.workflow_label, u'draft')
+        # Any changed column makes a new revision
+        rev2 = doc.revise(rev1, workflow_label=u'published', summary=u'Other')
+        self.assertFalse(rev2 is rev1)
+        db.session.commit()
+        self.assertEqual((rev2.content, rev2.summary), (u'', u'Other'))
+        self.assertNotEqual(rev2.fingerprint, rev1.fingerprint)
+        self.assertEqual(doc.revisions.count(), 2)
+
+    def test_load_revisions(self):
+        """Labelled revisions for many nodes are loaded with one query."""
+        docs = []
+        for counter in range(5):
+            doc = MyDocument(name=u'doc%d' % counter, title=u'Document', parent=self.root)
+            db.session.add(doc)
+            rev = doc.revise(workflow_label=u'draft')
+            rev.content = u'Draft %d' % counter
+            if counter != 2:
+                rev = doc.revise(rev, workflow_label=u'published')
+                rev.content = u'Published %d' % counter
+            docs.append(doc)
+        db.session.commit()
+        ids = [doc.id for doc in docs]
+        db.session.expunge_all()
+        docs = [MyDocument.query.get(i) for i in ids]
+
+        with QueryBudget(1):
+            revisions = MyDocument.load_revisions(docs, u'published')
+            self.assertEqual(revisions[2], None)
+            self.assertEqual([r.content for r in revisions if r is not None],
+                [u'Published 0', u'Published 1', u'Published 3', u'Published 4'])
+        with QueryBudget(0):
+            for doc, revision in zip(docs, revisions):
+                self.assertTrue(doc.workflow_revision.get(u'published') is revision)
+                self.assertEqual(u'published' in doc.workflow_revision, revision is not None)
+                if revision is not None:
+                    self.assertTrue(doc.workflow_revision[u'published'] is revision)
+                    self.assertTrue(revision.node is doc)
+            self.assertRaises(KeyError, lambda: docs[2].workflow_revision[u'published'])
+
+        # Other labels still come from the database
+        self.assertEqual(docs[0].workflow_revision[u'draft'].content, u'Draft 0')
+        # Moving the label is noticed
+        draft = docs[0].workflow_revision[u'draft']
+        docs[0].set_workflow_label(draft, u'published')
+        self.assertTrue(docs[0].workflow_revision[u'published'] is draft)
+        draft = docs[2].workflow_revision[u'draft']
+        MyDocument.set_workflow_labels([draft], u'published')
+        self.assertTrue(docs[2].workflow_revision[u'published'] is draft)
+        newrev = docs[1].revise(revisions[1], workflow_label=u'published')
+        db.session.flush()
+        self.assertTrue(docs[1].workflow_revision[u'published'] is newrev)
+
+    def test_load_revisions_missing(self):
+        """A node primed as having no revision with a label notices one that is given it."""
+        doc = MyDocument(name=u'doc', title=u'Document', parent=self.root)
+        db.session.add(doc)
+        rev = doc.revise(workflow_label=u'draft')
+        db.session.commit()
+        self.assertEqual(MyDocument.load_revisions([doc], u'published'), [None])
+        rev.workflow_label = u'published'
+        self.assertTrue(doc.workflow_revision.get(u'published') is rev)
+        db.session.commit()
+        self.assertTrue(doc.workflow_revision.get(u'published') is rev)
+        self.assertTrue(u'published' in doc.workflow_revision)
+        # Primes last until the transaction ends
+        self.assertEqual(MyDocument.load_revisions([doc], u'draft'), [None])
+        db.session.execute(MyDocumentRevision.__table__.update().values(workflow_label=u'draft'))
+        self.assertFalse(u'draft' in doc.workflow_revision)
+        db.session.commit()
+        self.assertTrue(u'draft' in doc.workflow_revision)
+
+    def test_promote_subtree(self):
+        """Labels are promoted across a subtree with set-based statements."""
+        section = Node(name=u'section', title=u'Section', parent=self.root)
+        other = Node(name=u'other', title=u'Other', parent=self.root)
+        docs = []
+        for counter, parent in enumerate([section, section, section, other]):
+            doc = MyDocument(name=u'doc%d' % counter, title=u'Document', parent=parent)
+            db.session.add(doc)
+            rev = doc.revise(workflow_label=u'published')
+            rev.content = u'Old %d' % counter
+            if counter != 1:
+                rev = doc.revise(rev, workflow_label=u'draft')
+                rev.content = u'New %d' % counter
+            docs.append(doc)
+        db.session.add_all([section, other])
+        db.session.commit()
+
+        def contents(label):
+            return [doc.workflow_revision.get(label) and doc.workflow_revision[label].content for doc in docs]
+
+        counts = MyDocument.promote_subtree(section, u'draft', u'published', dry_run=True)
+        self.assertEqual(counts, {'revisions': 2, 'unlabelled': 2, 'copied': 2, 'relabelled': 0})
+        self.assertEqual(contents(u'published'), [u'Old 0', u'Old 1', u'Old 2', u'Old 3'])
+
+        published = docs[0].workflow_revision[u'published']
+        draft = docs[0].workflow_revision[u'draft']
+        with QueryBudget(5):
+            counts = MyDocument.promote_subtree(section, u'draft', u'published')
+        self.assertEqual(counts, {'revisions': 2, 'unlabelled': 2, 'copied': 2, 'relabelled': 0})
+        db.session.commit()
+        self.assertEqual(published.workflow_label, None)
+        self.assertEqual(contents(u'published'), [u'New 0', u'Old 1', u'New 2', u'Old 3'])
+        self.assertEqual(contents(u'draft'), [u'New 0', None, u'New 2', u'New 3'])
+        self.assertEqual(docs[0].workflow_revision[u'published'].previous, draft)
+        self.assertEqual(docs[0].revisions.count(), 3)
+
+        # Relabelling moves the label without copying
+        counts = MyDocument.promote_subtree(self.root, u'draft', u'review', copy=False)
+        self.assertEqual(counts, {'revisions': 3, 'unlabelled': 0, 'copied': 0, 'relabelled': 3})
+        db.session.commit()
+        self.assertEqual(contents(u'review'), [u'New 0', None, u'New 2', u'New 3'])
+        self.assertEqual(contents(u'draft'), [None, None, None, None])
+        self.assertEqual(docs[0].revisions.count(), 3)
+        self.assertRaises(ValueError, MyDocument.promote_subtree, section, u'draft', u'draft')
+
+    def test_promote_subtree_delta(self):
+        """Copies of delta-stored revisions follow their source and have the same content."""
+        texts = [u''.join(u'Line %d in revision %d\n' % (i, counter if i == counter else 0)
+            for i in range(20)) for counter in range(3)]
+        docs = []
+        for length in (3, 2):
+            doc = DeltaDocument(name=u'doc%d' % length, title=u'Document', parent=self.root)
+            db.session.add(doc)
+            rev = None
+            for counter, text in enumerate(texts[:length]):
+                rev = doc.revise(rev, workflow_label=u'draft' if counter == length - 1 else None)
+                rev.content = text
+                db.session.commit()
+            docs.append(doc)
+        ids = [doc.id for doc in docs]
+        DeltaDocument.promote_subtree(self.root, u'draft', u'published')
+        db.session.commit()
+        db.session.expunge_all()
+        for doc_id, length in zip(ids, (3, 2)):
+            doc = DeltaDocument.query.get(doc_id)
+            draft = doc.workflow_revision[u'draft']
+            published = doc.workflow_revision[u'published']
+            self.assertEqual(published.previous_id, draft.id)
+            self.assertEqual((published.content, published.summary), (texts[length - 1], None))
+            self.assertEqual([r.id for r in doc.history(published)][1], draft.id)
+            self.assertEqual([r.content for r in doc.ancestry(published)], texts[:length] + [texts[length - 1]])
+            # A copy that would exceed the delta interval is stored in full
+            self.assertEqual(published.delta_depth, 0 if length == 3 else 2)
+
+    def test_delete_subtree_revisions(self):
+        """Deleting a subtree removes revisions of documents in it."""
+        container = Node(name=u'container', title=u'Container', parent=self.root)
+        doc1 = MyDocument(name=u'doc', title=u'Document', parent=container)
+        db.session.add_all([container, doc1])
+        rev1 = doc1.revise(workflow_label=u'draft')
+        db.session.commit()
+        rev2 = doc1.revise(rev1)
+        db.session.commit()
+        self.assertEqual(MyDocumentRevision.query.count(), 2)
+        self.assertEqual(rev2.node, doc1)
+        container.delete_subtree()
+        db.session.commit()
+        self.assertEqual(MyDocument.query.count(), 0)
+        self.assertEqual(MyDocumentRevision.query.count(), 0)
+        self.assertFalse(rev2 in db.session)
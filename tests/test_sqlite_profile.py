@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import create_engine
+from nodular import set_sqlite_profile
+
+
+class TestSQLiteProfile(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        set_sqlite_profile('default')
+        shutil.rmtree(self.tempdir)
+
+    def pragmas(self, *names):
+        engine = create_engine('sqlite:///' + os.path.join(self.tempdir, 'test.db'))
+        try:
+            with engine.connect() as connection:
+                return [connection.execute('PRAGMA %s' % name).scalar() for name in names]
+        finally:
+            engine.dispose()
+
+    def test_default(self):
+        """Only foreign keys are enabled by default."""
+        self.assertEqual(self.pragmas('foreign_keys', 'journal_mode', 'synchronous'), [1, 'delete', 2])
+
+    def test_read_heavy(self):
+        """The read-heavy profile uses a write-ahead log."""
+        set_sqlite_profile('read_heavy')
+        self.assertEqual(self.pragmas('foreign_keys', 'journal_mode', 'synchronous', 'cache_size', 'temp_store'),
+            [1, 'wal', 1, -65536, 2])
+        set_sqlite_profile('read_heavy', cache_size=-1024)
+        self.assertEqual(self.pragmas('cache_size', 'synchronous'), [-1024, 1])
+        set_sqlite_profile()
+        self.assertNotEqual(self.pragmas('cache_size'), [-1024])
+
+    def test_errors(self):
+        """Unknown profiles, pragmas and odd values are rejected."""
+        self.assertRaises(ValueError, set_sqlite_profile, 'fastest')
+        self.assertRaises(ValueError, set_sqlite_profile, 'default', user_version=1)
+        self.assertRaises(ValueError, set_sqlite_profile, 'default', cache_size='1; DROP TABLE node')